@@ -0,0 +1,82 @@
+"""
+Memory used by the indexes of the LOD app, in the dict layout built by
+lodindex.build and in the layout of compactindex.compact.
+
+  python benchmarks/lod_memory.py [-r resources] [-c classes] [file ...]
+
+The graph is generated as in lod_startup.py. The sizes are the sums of
+sys.getsizeof over everything reachable from the indexes, each object
+counted once. The terms the dicts share with the graph are counted
+too, as they are not shared after loading a snapshot.
+"""
+
+import array
+import getopt
+import sys
+import time
+
+import rdflib
+
+from rdflib_web import lodindex
+from rdflib_web import compactindex
+
+import lod_startup
+
+def deep_size(root):
+    seen=set()
+    total=0
+    stack=[root]
+    while stack:
+        o=stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total+=sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.iterkeys())
+            stack.extend(o.itervalues())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif isinstance(o, (basestring, array.array, int, long, float)):
+            pass
+        elif hasattr(o, "__dict__"):
+            stack.append(o.__dict__)
+    return total
+
+def main():
+    opts, files=getopt.getopt(sys.argv[1:], "r:c:")
+    opts=dict(opts)
+
+    if files:
+        graph=rdflib.Graph()
+        for f in files:
+            graph.parse(f, format=rdflib.util.guess_format(f))
+    else:
+        graph=lod_startup.generate(int(opts.get("-r", 100000)), int(opts.get("-c", 100)))
+    print "%d triples" % len(graph)
+
+    index=lod_startup.timed("lodindex.build", lodindex.build, graph)
+    names=("resources", "rresources", "resource_types", "labels")
+    dicts=dict((name, deep_size(index[name])) for name in names)
+    compact=lod_startup.timed("compactindex.compact", compactindex.compact, index)
+    compacts=dict((name, deep_size(compact[name])) for name in names)
+
+    print "%-16s %14s %14s" % ("", "dict", "compact")
+    for name in names:
+        print "%-16s %14d %14d" % (name, dicts[name], compacts[name])
+    print "%-16s %14d %14d" % ("all", deep_size([index[n] for n in names]),
+                               deep_size([compact[n] for n in names]))
+
+    resources=list(index["resource_types"])[:10000]
+    for name, layout in (("dict", index), ("compact", compact)):
+        start=time.time()
+        for r in resources:
+            for t in layout["resource_types"][r]:
+                if t in layout["resources"]:
+                    layout["resources"][t].get(r)
+            layout["labels"].get(r)
+        print "%-16s %10.1fus per resource" % (name+" lookups",
+                                              (time.time()-start)*1e6/len(resources))
+
+if __name__=="__main__":
+    main()
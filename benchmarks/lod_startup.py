@@ -0,0 +1,73 @@
+"""
+Startup time of the LOD app: how long indexing a graph takes.
+
+  python benchmarks/lod_startup.py [-r resources] [-c classes] [file ...]
+
+Without files, a graph with the given number of typed resources spread
+over the classes is generated, half of them labelled. Saving and
+loading a snapshot of the indexes (a warm restart) and indexing lazily
+are timed as well.
+"""
+
+import getopt
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import rdflib
+from rdflib import RDF, RDFS
+
+from rdflib_web import lod
+from rdflib_web import lodindex
+
+EX=rdflib.Namespace("http://example.org/")
+
+def generate(resources, classes):
+    graph=rdflib.Graph()
+    for i in xrange(resources):
+        r=EX["resource%d" % i]
+        graph.add((r, RDF.type, EX["Class%d" % (i % classes)]))
+        if i % 2:
+            graph.add((r, RDFS.label, rdflib.Literal("Resource %d" % i)))
+    return graph
+
+def timed(name, f, *args, **kwargs):
+    start=time.time()
+    result=f(*args, **kwargs)
+    print "%-24s %8.2fs" % (name, time.time()-start)
+    return result
+
+def main():
+    opts, files=getopt.getopt(sys.argv[1:], "r:c:v")
+    opts=dict(opts)
+    if "-v" in opts:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if files:
+        graph=rdflib.Graph()
+        for f in files:
+            timed("parse %s" % f, graph.parse, f, format=rdflib.util.guess_format(f))
+    else:
+        graph=timed("generate", generate, int(opts.get("-r", 100000)), int(opts.get("-c", 100)))
+    print "%d triples" % len(graph)
+
+    index=timed("lodindex.build", lodindex.build, graph)
+    print "%d types, %d labels" % (len(index["types"]), len(index["labels"]))
+    timed("lod.get", lod.get, graph)
+    lazy=timed("lodindex.LazyIndex", lodindex.LazyIndex, graph)
+    t=max(lazy.types, key=lambda t: len(index["resources"][t]))
+    timed("first use of a type", lazy.resources.__getitem__, t)
+    timed("LazyIndex.warm_up", lazy.warm_up)
+
+    path=tempfile.mktemp()
+    try:
+        timed("lodindex.save", lodindex.save, index, path, "key")
+        print "%d bytes" % os.path.getsize(path)
+        timed("lodindex.load", lodindex.load, path, "key")
+    finally:
+        os.remove(path)
+
+if __name__=="__main__":
+    main()
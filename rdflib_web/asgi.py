@@ -0,0 +1,405 @@
+"""
+An `ASGI <https://asgi.readthedocs.io/>`_ binding of the SPARQL endpoint
+and graph store, for serving many slow or mostly idle clients from a
+single process.
+
+Requests are handled on the asyncio event loop, while parsing, query
+evaluation and serialization run on a thread pool executor. Each of
+these takes the lock of the dataset and releases it in one call, results
+are written to a temporary file there (see streaming.spool). They are
+sent chunk by chunk from it, the chunks are read on a separate executor,
+so a connection waiting for a slow query or client costs no thread, only
+a coroutine, and a slow client never holds the lock. The timeout of a
+query covers its evaluation, not sending the results.
+
+This module requires Python 3.5 or newer. Get the application with
+:py:func:`get` and run it with any ASGI server::
+
+  from rdflib_web import asgi
+  app = asgi.get(my_rdflib_graph)
+
+  # e.g. uvicorn.run(app, port=5000)
+
+or start it from the commandline with ``rdfsparqlapp -a <RDF-file>``
+(which needs `uvicorn <https://www.uvicorn.org/>`_).
+
+Like the Flask blueprint, the app answers ``/sparql``, ``/update``,
+``/graph-store`` and ``/dataset``. Graph store and dataset request
+bodies are written to a temporary file as they arrive (in memory up to
+streaming.SPOOL_BYTES), from which N-Triples and N-Quads are loaded in
+batches, see bulkload. Multipart bodies are parsed in memory. HTML results are sent as a plain table, as the Flask
+templates are not available here.
+"""
+
+import asyncio
+import concurrent.futures
+import email.parser
+import io
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import rdflib
+from rdflib.util import guess_format
+
+from rdflib_web import caches
+from rdflib_web import generic_endpoint
+from rdflib_web import mimeutils
+from rdflib_web import querypool
+from rdflib_web import streaming
+
+__all__ = [ 'SPARQLApp', 'get', 'serve' ]
+
+_HTML_HEAD = (b'<!DOCTYPE html>\n<html><head><meta charset="utf-8"/>'
+              b'<title>Query Results</title></head><body>\n')
+_HTML_TAIL = b'\n</body></html>\n'
+
+class SPARQLApp(object):
+    """
+    ASGI application for a :py:class:`GenericEndpoint`.
+
+    :argument:ds: The dataset to be served, see GenericEndpoint
+    :argument:workers: Number of threads evaluating queries, applying
+    updates and handling graph store requests
+    :argument:max_pending: Number of queries that may be running or
+    waiting for a thread, further queries are answered with 503
+    :argument:timeout: Default query timeout in seconds, requests may
+    lower it with the ``timeout`` parameter
+    :argument:chunksize: Size of the chunks results are sent in
+    :argument:journal: An optional started journal.Journal for the
+    modifications
+    """
+
+    def __init__(self, ds, workers=4, max_pending=64, timeout=None,
+                 chunksize=streaming.CHUNKSIZE, retry_after=5, journal=None):
+        self._local = threading.local()
+        self.generic = generic_endpoint.GenericEndpoint(
+            ds=ds, coin_url=self._coin_url, prepared_cache=caches.LRUCache(100),
+            journal=journal)
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        # reads the chunks of spooled results, never waits for the lock
+        self.io_executor = concurrent.futures.ThreadPoolExecutor(2)
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.chunksize = chunksize
+        self.retry_after = retry_after
+        self.pending = 0
+
+    def _coin_url(self):
+        return "%s/graph-store/%s" % (self._local.base, rdflib.BNode())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        path = scope["path"][len(scope.get("root_path", "")):]
+        if path == "/sparql" and scope["method"] in ("GET", "POST"):
+            await self.query(scope, receive, send)
+        elif path == "/update" and scope["method"] == "POST":
+            await self.update(scope, receive, send)
+        elif path == "/dataset":
+            await self.dataset(scope, receive, send)
+        elif path == "/graph-store":
+            await self.graph_store(scope, receive, send, None)
+        elif path.startswith("/graph-store/"):
+            await self.graph_store(scope, receive, send,
+                                   rdflib.URIRef(_request_url(scope)))
+        else:
+            await _respond(send, 404, {}, "Not found")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                self.io_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _run(self, fn, *args):
+        # fn must release the lock before it returns
+        return asyncio.get_event_loop().run_in_executor(self.executor, fn, *args)
+
+    def _read(self, chunks):
+        return asyncio.get_event_loop().run_in_executor(self.io_executor, next, chunks, None)
+
+    async def query(self, scope, receive, send):
+        headers = _headers(scope)
+        args = _query_args(scope)
+        body = await _read_body(receive)
+        if scope["method"] == "POST":
+            mimetype = headers.get("content-type", "").split(";")[0].strip()
+            if mimetype == "application/x-www-form-urlencoded":
+                args.update(urllib.parse.parse_qsl(body.decode("utf-8")))
+            elif mimetype == "application/sparql-query":
+                args["query"] = body.decode("utf-8")
+
+        if "query" not in args:
+            await _respond(send, 400, {}, "Missing parameter 'query'")
+            return
+
+        if self.pending >= self.max_pending:
+            await _respond(send, 503, {"Retry-After": str(self.retry_after)},
+                           "Too many queries, try again later")
+            return
+
+        format, mimetype = _result_format(headers.get("accept", ""), args)
+        timeout = self.timeout
+        if "timeout" in args:
+            try:
+                requested = querypool.parse_timeout(args["timeout"])
+            except ValueError:
+                await _respond(send, 400, {}, "Invalid timeout %s" % args["timeout"])
+                return
+            timeout = requested if timeout is None else min(timeout, requested)
+
+        q = args["query"]
+        generic = self.generic
+        chunksize = self.chunksize
+        deadline = time.time() + timeout if timeout is not None else None
+
+        def expired():
+            return deadline is not None and time.time() >= deadline
+
+        def evaluate():
+            # the results are computed lazily, so they are written out
+            # before the lock is released
+            with generic.lock.reading():
+                bindings = generic.init_bindings(args)
+                key = generic.query_key(q, format, bindings)
+                cached = generic.cached_result(key)
+                if cached is not None:
+                    return io.BytesIO(cached)
+                results = generic.query(q, bindings)
+                if results.type in ('SELECT', 'ASK') and \
+                        format in streaming.RESULT_SERIALIZERS:
+                    chunks = streaming.RESULT_SERIALIZERS[format](results, chunksize)
+                else:
+                    chunks = [results.serialize(format=format)]
+                # stops once the query timed out, to release the lock
+                chunks = querypool.checked(chunks, expired)
+                return streaming.spool(generic.cache_chunks(key, chunks))
+
+        self.pending += 1
+        try:
+            future = self._run(evaluate)
+            try:
+                # shield, the thread cannot be stopped anyway
+                spooled = await asyncio.wait_for(asyncio.shield(future), timeout)
+            except (asyncio.TimeoutError, querypool.QueryTimeout):
+                future.add_done_callback(_close_result)
+                await _respond(send, 503, {}, "Query timed out")
+                return
+            except Exception as e:
+                await _respond(send, 400, {}, "Query failed: %s" % e)
+                return
+        finally:
+            self.pending -= 1
+        await self._stream(send, streaming.read_chunks(spooled, chunksize), format, mimetype)
+
+    async def update(self, scope, receive, send):
+        headers = _headers(scope)
+        args = _query_args(scope)
+        body = await _read_body(receive)
+        mimetype = headers.get("content-type", "").split(";")[0].strip()
+        if mimetype == "application/x-www-form-urlencoded":
+            args.update(urllib.parse.parse_qsl(body.decode("utf-8")))
+        elif mimetype == "application/sparql-update":
+            args["update"] = body.decode("utf-8")
+        if "update" not in args:
+            await _respond(send, 400, {}, "Missing parameter 'update'")
+            return
+
+        def apply():
+            self.generic.update(args["update"], self.generic.init_bindings(args))
+
+        try:
+            # the thread waits while the update is batched with others
+            await self._run(apply)
+        except Exception as e:
+            await _respond(send, 400, {}, "Update failed: %s" % e)
+            return
+        await _respond(send, 204, {}, None)
+
+    async def _stream(self, send, chunks, format, mimetype):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", mimetype.encode("latin-1"))]})
+        if format == "html":
+            await send({"type": "http.response.body", "body": _HTML_HEAD, "more_body": True})
+        tail = _HTML_TAIL if format == "html" else b""
+        await self._send_body(send, chunks, tail)
+
+    async def graph_store(self, scope, receive, send, graph_identifier):
+        headers = _headers(scope)
+        args = _query_args(scope)
+        content_type = headers.get("content-type", "")
+        mimetype = content_type.split(";")[0].strip()
+        if mimetype == "multipart/form-data":
+            body = _parse_multipart(content_type, await _read_body(receive),
+                                    args.get("mimetype"))
+        else:
+            body = await _spool_body(receive)
+
+        base = _request_url(scope, with_path=False)
+        method = scope["method"]
+
+        def handle():
+            # coin_url is called on this thread
+            self._local.base = base
+            try:
+                return self.generic.graph_store(method, graph_identifier, args, body,
+                                                mimetype, headers.get("accept"),
+                                                headers.get("if-none-match"))
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+
+        code, response_headers, response_body = await self._run(handle)
+        await self._send_graph(send, method, code, response_headers, response_body)
+
+    async def dataset(self, scope, receive, send):
+        headers = _headers(scope)
+        mimetype = headers.get("content-type", "").split(";")[0].strip()
+        body = await _spool_body(receive)
+        method = scope["method"]
+
+        def handle():
+            try:
+                return self.generic.dataset(method, body, mimetype, headers.get("accept"))
+            finally:
+                body.close()
+
+        code, response_headers, response_body = await self._run(handle)
+        await self._send_graph(send, method, code, response_headers, response_body)
+
+    async def _send_graph(self, send, method, code, headers, body):
+        if body is not None and not isinstance(body, (bytes, str)):
+            # a streamed graph
+            if method == "HEAD":
+                body.close()
+            else:
+                await self._send_chunks(send, code, headers, body)
+                return
+        if method == "HEAD":
+            body = None
+        await _respond(send, code, headers, body)
+
+    async def _send_chunks(self, send, code, headers, chunks):
+        raw_headers = [(k.lower().encode("latin-1"), str(v).encode("latin-1"))
+                       for k, v in headers.items()]
+        await send({"type": "http.response.start", "status": code, "headers": raw_headers})
+        await self._send_body(send, chunks, b"")
+
+    async def _send_body(self, send, chunks, tail):
+        future = None
+        try:
+            while True:
+                future = self._read(chunks)
+                chunk = await future
+                if chunk is None:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": tail, "more_body": False})
+        finally:
+            # closes the spooled file also when the client went away
+            if future is not None and not future.done():
+                future.add_done_callback(lambda f: chunks.close())
+            else:
+                chunks.close()
+
+def _close_result(future):
+    # the spooled results of a query that timed out
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def _headers(scope):
+    return dict((k.decode("latin-1").lower(), v.decode("latin-1"))
+                for k, v in scope["headers"])
+
+def _query_args(scope):
+    return dict(urllib.parse.parse_qsl(scope["query_string"].decode("latin-1"),
+                                       keep_blank_values=True))
+
+def _request_url(scope, with_path=True):
+    host = _headers(scope).get("host")
+    if not host and scope.get("server"):
+        host = "%s:%s" % tuple(scope["server"])
+    url = "%s://%s%s" % (scope.get("scheme", "http"), host, scope.get("root_path", ""))
+    if with_path:
+        url += scope["path"][len(scope.get("root_path", "")):]
+    return url
+
+async def _read_body(receive):
+    body = []
+    while True:
+        message = await receive()
+        body.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(body)
+
+async def _spool_body(receive):
+    # the body in a temporary file, GenericEndpoint takes it as it is
+    f = tempfile.SpooledTemporaryFile(max_size=streaming.SPOOL_BYTES)
+    try:
+        while True:
+            message = await receive()
+            f.write(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+    except:
+        f.close()
+        raise
+    f.seek(0)
+    return f
+
+def _parse_multipart(content_type, body, force_mimetype):
+    message = email.parser.BytesParser().parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    parts = []
+    for part in message.get_payload():
+        filename = part.get_filename()
+        if filename is None:
+            continue
+        mt = force_mimetype or part.get_content_type() or guess_format(filename)
+        parts.append({'data': part.get_payload(decode=True), 'mimetype': mt})
+    return parts
+
+def _result_format(accept, args):
+    """Picks the result format like the Flask endpoint does"""
+    format = mimeutils.resultformat(accept) # xml is default
+    # output parameter overrides header
+    format = args.get("output", format)
+    mimetype = mimeutils.resultformat_to_mime(format)
+    # force-accept parameter overrides mimetype
+    mimetype = args.get("force-accept", mimetype)
+    return format, mimetype
+
+async def _respond(send, status, headers, body):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    body = body or b""
+    raw_headers = [(k.lower().encode("latin-1"), str(v).encode("latin-1"))
+                   for k, v in headers.items()]
+    if not any(k == b"content-type" for k, v in raw_headers):
+        raw_headers.append((b"content-type", b"text/plain; charset=utf-8"))
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+def get(ds, **kwargs):
+    """Get the ASGI app serving the given dataset, kwargs are passed on
+    to :py:class:`SPARQLApp`"""
+    return SPARQLApp(ds, **kwargs)
+
+def serve(ds, host="127.0.0.1", port=5000, **kwargs):
+    """Serve the given dataset with uvicorn"""
+    try:
+        import uvicorn
+    except ImportError:
+        raise Exception("uvicorn not found - install with 'pip install uvicorn'")
+    uvicorn.run(get(ds, **kwargs), host=host, port=port)
@@ -0,0 +1,114 @@
+"""
+Group commit for writes arriving from many threads.
+
+Each modification of the dataset takes the write lock, waits for the
+readers to leave, and (with a transactional store) commits. With many
+small writers, most of the time goes into that, not into the writes.
+A :py:class:`Batcher` lets the first waiting thread apply the writes of
+all threads that queued up meanwhile in one go::
+
+  def apply(items):
+      return [write(item) for item in items]
+
+  batcher=Batcher(apply, guard=lock.writing)
+  batcher.submit(item) # from any thread, returns when item was applied
+
+There is no extra thread: the thread that finds nobody applying a
+batch becomes the leader, the others wait for it.
+"""
+
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+__all__ = [ 'Batcher' ]
+
+@contextmanager
+def _nothing():
+    yield
+
+class _Item(object):
+
+    def __init__(self, value):
+        self.value = value
+        self.result = None
+        self.exc_info = None
+        # set when the item was applied, or its thread is to lead
+        self.done = threading.Event()
+        self.lead = False
+
+class Batcher(object):
+    """
+    :argument:apply: A function taking a list of items, which returns a
+    list with a (result, exc_info) pair for each item, exc_info being
+    None if the item was applied successfully.
+    :argument:maxbatch: Maximum number of items applied at once
+    :argument:delay: Seconds the leader waits for more items before
+    applying a batch. Usually, the time it waits for the lock is enough.
+    :argument:guard: An optional function returning a context manager
+    (e.g. a lock) that is entered before the batch is taken from the
+    queue and left after it was applied. While the leader waits for it,
+    more items queue up.
+    """
+
+    def __init__(self, apply, maxbatch=100, delay=0, guard=None):
+        self.apply = apply
+        self.maxbatch = maxbatch
+        self.delay = delay
+        self.guard = guard
+        self._queue = []
+        self._leader = False
+        self._lock = threading.Lock()
+
+        # batch size metrics
+        self.batches = self.items = 0
+
+    def submit(self, value):
+        """Apply value with the next batch. Returns the result or raises
+        the exception for it."""
+        item = _Item(value)
+        with self._lock:
+            self._queue.append(item)
+            if not self._leader:
+                self._leader = item.lead = True
+        while True:
+            if item.lead:
+                item.lead = False
+                item.done.clear()
+                self._lead()
+            item.done.wait()
+            if not item.lead:
+                break
+        if item.exc_info is not None:
+            raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+        return item.result
+
+    def _lead(self):
+        """Apply one batch, then hand the lead on to the thread of the
+        next waiting item, so no thread applies batch after batch"""
+        if self.delay:
+            time.sleep(self.delay)
+        batch = []
+        try:
+            with (self.guard() if self.guard else _nothing()):
+                with self._lock:
+                    batch = self._queue[:self.maxbatch]
+                    del self._queue[:self.maxbatch]
+                results = self.apply([item.value for item in batch])
+        except Exception:
+            results = [(None, sys.exc_info())] * len(batch)
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            successor = None
+            if self._queue:
+                successor = self._queue[0]
+                successor.lead = True
+            else:
+                self._leader = False
+        for item, (result, exc_info) in zip(batch, results):
+            item.result, item.exc_info = result, exc_info
+            item.done.set()
+        if successor is not None:
+            successor.done.set()
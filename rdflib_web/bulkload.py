@@ -0,0 +1,249 @@
+"""
+Loading N-Triples and N-Quads in batches.
+
+``Graph.parse`` reads the whole document into memory before parsing it,
+and adds the triples to the store one by one. :py:func:`load` instead
+reads a file-like object line by line and hands the triples to the
+store's ``addN`` in batches of ``batchsize``, one call per graph, so the
+memory needed does not grow with the size of the document::
+
+  with open("dump.nt", "rb") as f:
+      result = load(f, graph, "application/n-triples")
+  rate = result.rate # triples per second
+
+The result also tells by how much the load raised the peak resident
+memory of the process (``memory_kb``), which is 0 when the load stayed
+within the memory the process had used before. The graph store reports
+both in the X-Ingest-* headers of its responses.
+
+The graph store uses it for PUT and POST requests in these formats,
+reading the request body from a temporary file it was written to before
+the write lock was taken.
+"""
+
+import codecs
+import io
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # not on windows
+    resource = None
+
+import rdflib
+from rdflib.plugins.parsers.ntriples import ParseError, r_wspace, r_tail
+try:
+    from rdflib.plugins.parsers.ntriples import NTriplesParser
+except ImportError: # renamed in rdflib 6
+    from rdflib.plugins.parsers.ntriples import W3CNTriplesParser as NTriplesParser
+
+__all__ = [ 'load', 'add', 'LoadResult', 'FORMATS', 'BATCHSIZE' ]
+
+FORMATS = { "application/n-triples": "nt",
+            "nt": "nt",
+            "application/n-quads": "nquads",
+            "nquads": "nquads" }
+"""The formats (mime types or rdflib format names) that can be loaded"""
+
+BATCHSIZE = 10000
+"""Default number of triples added to the store at once"""
+
+class LoadResult(object):
+    """
+    What a :py:func:`load` did.
+
+    :argument:triples: Number of triples (or quads) loaded
+    :argument:seconds: Time spent
+    :argument:contexts: Identifiers of the graphs loaded into
+    :argument:memory_kb: Kilobytes by which the load raised the peak
+    resident memory of the process, None where it is not known
+    """
+
+    def __init__(self, triples=0, seconds=0.0, contexts=None, memory_kb=None):
+        self.triples = triples
+        self.seconds = seconds
+        self.contexts = contexts or set()
+        self.memory_kb = memory_kb
+
+    @property
+    def rate(self):
+        """Triples per second"""
+        return self.triples / self.seconds if self.seconds else 0.0
+
+    def __add__(self, other):
+        memory_kb = None
+        if self.memory_kb is not None and other.memory_kb is not None:
+            # the loads ran one after the other
+            memory_kb = self.memory_kb + other.memory_kb
+        return LoadResult(self.triples + other.triples, self.seconds + other.seconds,
+                          self.contexts | other.contexts, memory_kb)
+
+    def headers(self):
+        """HTTP headers reporting the throughput, and the memory used
+        where it is known"""
+        headers = { "X-Ingest-Triples": str(self.triples),
+                    "X-Ingest-Triples-Per-Second": "%.0f" % self.rate }
+        if self.memory_kb is not None:
+            headers["X-Ingest-Peak-Memory-KB"] = str(self.memory_kb)
+        return headers
+
+def _peak_memory_kb():
+    """The peak resident memory of the process so far in kilobytes, or
+    None where it is not known"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin": # bytes there
+        peak //= 1024
+    return peak
+
+def _measured(result, start, peak):
+    # sets the time and memory the load took since start, with the
+    # peak memory then
+    result.seconds = time.time() - start
+    if peak is not None:
+        result.memory_kb = _peak_memory_kb() - peak
+    return result
+
+class _KeptBNodeIds(dict):
+    # maps each blank node label to itself, the parser then creates
+    # the blank node with the label as id
+    def get(self, label, default=None):
+        return label
+
+class _Parser(NTriplesParser):
+    """Parses one line at a time into a quad"""
+
+    def __init__(self, source, quads, keep_bnode_ids=False):
+        NTriplesParser.__init__(self)
+        self.quads = quads
+        # blank node ids are scoped to the document, the class keeps
+        # one dict for all parsers
+        self._bnode_ids = _KeptBNodeIds() if keep_bnode_ids else {}
+        self.file = codecs.getreader("utf-8")(source)
+        self.buffer = ''
+
+    def next_quad(self):
+        """The next quad with None as context where none is given, or
+        None at the end of the document"""
+        while True:
+            self.line = line = self.readline()
+            if line is None:
+                return None
+            try:
+                quad = self.parse_quad()
+            except ParseError, e:
+                raise ParseError("Invalid line (%s): %r" % (e, line))
+            if quad is not None:
+                return quad
+
+    def parse_quad(self):
+        self.eat(r_wspace)
+        if not self.line or self.line.startswith('#'):
+            return None
+        subject = self.subject()
+        self.eat(r_wspace)
+        predicate = self.predicate()
+        self.eat(r_wspace)
+        obj = self.object()
+        self.eat(r_wspace)
+        context = None
+        if self.quads:
+            context = self.uriref() or self.nodeid() or None
+        self.eat(r_tail)
+        if self.line:
+            raise ParseError("Trailing garbage")
+        return subject, predicate, obj, context
+
+class _Graphs(object):
+    """Adds quads to the graphs of the store of graph, which stands
+    for the context None"""
+
+    def __init__(self, graph, result, listener):
+        self.store = graph.store
+        self.graphs = { None: graph }
+        self.result = result
+        self.listener = listener
+        result.contexts.add(graph.identifier)
+
+    def add(self, quads):
+        # the quads by graph
+        batch = {}
+        for s, p, o, c in quads:
+            target = self.graphs.get(c)
+            if target is None:
+                if not self.store.context_aware:
+                    raise ParseError("Quads can only be loaded into a context aware store")
+                target = self.graphs[c] = rdflib.Graph(store=self.store, identifier=c)
+                if self.store.graph_aware:
+                    self.store.add_graph(target)
+                self.result.contexts.add(c)
+            batch.setdefault(target, []).append((s, p, o, target))
+        for quads in batch.itervalues():
+            if self.listener is not None:
+                self.listener(quads)
+            self.store.addN(quads)
+            self.result.triples += len(quads)
+
+def add(quads, graph, listener=None):
+    """
+    Add quads parsed elsewhere (e.g. by :py:mod:`rdflib_web.parsepool`)
+    in one batch per graph.
+
+    :argument:quads: A list of (s, p, o, graph identifier) tuples, None
+    as identifier stands for graph
+    :argument:graph: The graph triples are added to. Other graphs are
+    created in its store, which must be context aware then.
+    :argument:listener: See :py:func:`load`
+
+    :Returns: a :py:class:`LoadResult`
+    """
+    start, peak = time.time(), _peak_memory_kb()
+    result = LoadResult()
+    _Graphs(graph, result, listener).add(quads)
+    return _measured(result, start, peak)
+
+def load(source, graph, format, batchsize=BATCHSIZE, listener=None, keep_bnode_ids=False):
+    """
+    Load the document read from source into graph, in batches of
+    batchsize triples.
+
+    :argument:source: A file-like object, or a string
+    :argument:graph: The graph triples are added to. N-Quads may name
+    other graphs, these are created in the store of graph, which must
+    be context aware then.
+    :argument:format: One of :py:data:`FORMATS`
+    :argument:listener: An optional function called with each list of
+    (s, p, o, graph) quads before they are added, e.g. for journaling
+    (see :py:mod:`rdflib_web.journal`)
+    :argument:keep_bnode_ids: Whether the labels of blank nodes are
+    used as their ids, as when the document was written from the same
+    dataset. By default, the labels are scoped to the document and
+    fresh blank nodes are created.
+
+    :Returns: a :py:class:`LoadResult`
+    """
+    if not hasattr(source, "read"):
+        if isinstance(source, unicode):
+            source = source.encode("utf-8")
+        source = io.BytesIO(source)
+    quads = FORMATS[format] == "nquads"
+    if quads and not graph.store.context_aware:
+        raise ParseError("N-Quads can only be loaded into a context aware store")
+
+    start, peak = time.time(), _peak_memory_kb()
+    parser = _Parser(source, quads, keep_bnode_ids)
+    result = LoadResult()
+    graphs = _Graphs(graph, result, listener)
+    batch = []
+    while True:
+        quad = parser.next_quad()
+        if quad is not None:
+            batch.append(quad)
+        if len(batch) >= batchsize or (quad is None and batch):
+            graphs.add(batch)
+            batch = []
+        if quad is None:
+            break
+    return _measured(result, start, peak)
@@ -1,11 +1,15 @@
 """
 
-LRU and LFU Caching decorators taken from py3.2
+LRU and LFU Caching decorators taken from py3.2, a size-bounded LRU
+cache object, and one keeping large values in files
 
 """
 
 import collections
 import functools
+import os
+import tempfile
+import threading
 
 from heapq import nsmallest
 from operator import itemgetter
@@ -98,3 +102,207 @@ def lfu_cache(maxsize=100):
         wrapper.clear = clear
         return wrapper
     return decorating_function
+
+
+class LRUCache(object):
+    '''Least-recently-used cache bounded both in number of entries and
+    in total size of the values.
+
+    If ``maxbytes`` is given, the size of a value is computed by
+    ``sizeof`` (``len`` by default, i.e. the values are usually byte
+    strings), values larger than ``maxbytes`` are never stored. The cache
+    may be shared between threads.
+    Cache performance statistics stored in c.hits, c.misses and c.evictions.
+
+    '''
+
+    def __init__(self, maxsize=100, maxbytes=None, sizeof=len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof if maxbytes is not None else lambda value: 0
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._cache = collections.OrderedDict() # order: least recent to most recent
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._cache.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._cache[key] = value    # record recent use of this key
+            self.hits += 1
+            return value
+
+    def fits(self, size):
+        """Whether a value of the given size could be stored at all"""
+        return self.maxbytes is None or size <= self.maxbytes
+
+    def put(self, key, value):
+        """Store value, returns False if it is too large to be cached"""
+        size = self.sizeof(value)
+        if not self.fits(size):
+            return False
+        with self._lock:
+            if key in self._cache:
+                self.discard(key)
+            self._cache[key] = value
+            self.bytes += size
+            while len(self._cache) > self.maxsize or \
+                    (self.maxbytes is not None and self.bytes > self.maxbytes):
+                _, old = self._cache.popitem(last=False) # purge least recently used
+                self.bytes -= self.sizeof(old)
+                self.evictions += 1
+                self._dropped(old)
+        return True
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._cache:
+                value = self._cache.pop(key)
+                self.bytes -= self.sizeof(value)
+                self._dropped(value)
+
+    def clear(self, keep_statistics=False):
+        """Remove all entries and reset the statistics, unless
+        keep_statistics is set (e.g. when they are exported as
+        counters)"""
+        with self._lock:
+            values = self._cache.values()
+            self._cache.clear()
+            self.bytes = 0
+            if not keep_statistics:
+                self.hits = self.misses = self.evictions = 0
+            for value in values:
+                self._dropped(value)
+
+    def _dropped(self, value):
+        """Called holding the lock for each value removed from the cache"""
+        pass
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+
+class SpilledValue(object):
+    """A byte string cached in a file"""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def open(self, chunksize):
+        """Returns an iterator over the chunks of the file"""
+        f = open(self.path, "rb")
+        def chunks():
+            with f:
+                while True:
+                    chunk = f.read(chunksize)
+                    if not chunk:
+                        return
+                    yield chunk
+        return chunks()
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError: # still open on windows
+            pass
+
+
+class SpillingLRUCache(LRUCache):
+    '''LRUCache of byte strings, which keeps values larger than
+    ``spill_bytes`` in temporary files in ``spill_dir`` (the system
+    default if None). ``maxbytes`` bounds the total size of the values
+    in memory and on disk.
+
+    A file is removed when its entry is dropped. Readers which got
+    it before can read it to the end nevertheless (except on windows,
+    where it is not removed then).
+
+    '''
+
+    def __init__(self, maxsize=100, maxbytes=256*1024*1024, spill_bytes=1024*1024,
+                 spill_dir=None, chunksize=64*1024):
+        LRUCache.__init__(self, maxsize, maxbytes)
+        self.spill_bytes = spill_bytes
+        self.spill_dir = spill_dir
+        self.chunksize = chunksize
+
+    def _spill_file(self):
+        return tempfile.NamedTemporaryFile(prefix="rdflib-web-", suffix=".cache",
+                                           dir=self.spill_dir, delete=False)
+
+    def put(self, key, value):
+        if isinstance(value, bytes) and len(value) > self.spill_bytes:
+            if not self.fits(len(value)):
+                return False
+            with self._spill_file() as f:
+                f.write(value)
+            value = SpilledValue(f.name, len(value))
+        if not LRUCache.put(self, key, value):
+            if isinstance(value, SpilledValue):
+                value.remove()
+            return False
+        return True
+
+    def open(self, key):
+        """Returns the value under key if it is kept in memory, an
+        iterator over its chunks if it is in a file, or None"""
+        with self._lock:
+            value = self.get(key)
+            if isinstance(value, SpilledValue):
+                # before it can be removed
+                return value.open(self.chunksize)
+            return value
+
+    def cache_chunks(self, key, chunks):
+        """Passes through the chunks of a value and stores their
+        concatenation under key if they are all consumed, unless it is
+        too large. It is written to a file while the chunks pass once
+        it is larger than spill_bytes."""
+        size = 0
+        buf = []
+        spill = None
+        try:
+            for chunk in chunks:
+                if buf is not None or spill is not None:
+                    size += len(chunk)
+                    if not self.fits(size):
+                        buf = None
+                        if spill is not None:
+                            spill.close()
+                            os.remove(spill.name)
+                            spill = None
+                    elif spill is not None:
+                        spill.write(chunk)
+                    else:
+                        buf.append(chunk)
+                        if size > self.spill_bytes:
+                            spill = self._spill_file()
+                            spill.write(b"".join(buf))
+                            buf = None
+                yield chunk
+            if spill is not None:
+                spill.close()
+                LRUCache.put(self, key, SpilledValue(spill.name, size))
+                spill = None
+            elif buf is not None:
+                LRUCache.put(self, key, b"".join(buf))
+        finally:
+            # not consumed to the end
+            if spill is not None:
+                spill.close()
+                os.remove(spill.name)
+
+    def _dropped(self, value):
+        if isinstance(value, SpilledValue):
+            value.remove()
@@ -0,0 +1,376 @@
+"""
+A compact layout of the indexes of the LOD app.
+
+The dicts built by :py:func:`rdflib_web.lodindex.build` hold a term
+object, a hash table entry and a label string for every resource, in
+every index it is in. :py:func:`compact` turns them into read-mostly
+mappings with the same interface, backed by arrays:
+
+* the resources are interned: their IDs are their positions in a sorted
+  table of their N-Triples-like keys, packed into one byte string, and
+  looked up by bisection
+* the resources of each type are a sorted array of IDs, with their URL
+  labels in a packed string table alongside, and an array ordering them
+  by label for the reverse lookup
+* the types of the resources are one array, sliced by an array of
+  offsets indexed by resource ID
+* the labels are one packed string table indexed by resource ID
+
+Each mapping keeps the modifications made after compacting (see
+:py:func:`rdflib_web.lodindex.update`) in a dict and a set on top::
+
+  index=compact(lodindex.build(graph))
+  app.config.update(index)
+
+Lookups are bisections in python, slower than a dict lookup, and the
+labels come back as plain strings rather than literals.
+"""
+
+import array
+import bisect
+import collections
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError: # python 2
+    from collections import Mapping, MutableMapping
+
+import rdflib
+from rdflib.util import from_n3
+
+from rdflib_web.lodindex import quote
+
+__all__ = [ 'compact' ]
+
+def _typecode(maximum):
+    """The smallest unsigned array typecode holding maximum"""
+    for code in "BHIL":
+        if maximum < 2**(8*array.array(code).itemsize):
+            return code
+    raise OverflowError(maximum)
+
+class _Table(object):
+    """Strings packed into one byte string, looked up by position"""
+
+    def __init__(self, strings, text=False):
+        self.text = text
+        parts = [s.encode("utf-8") if text else s for s in strings]
+        total = sum(len(s) for s in parts)
+        self.offsets = array.array(_typecode(total), [0])
+        for s in parts:
+            self.offsets.append(self.offsets[-1] + len(s))
+        self.data = b"".join(parts)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        s = self.data[self.offsets[i]:self.offsets[i + 1]]
+        return s.decode("utf-8") if self.text else s
+
+class _Permuted(object):
+    """The items of a sequence in the order given by positions, for
+    bisecting"""
+
+    def __init__(self, items, order):
+        self.items = items
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        return self.items[self.order[i]]
+
+def _key(term):
+    if isinstance(term, rdflib.URIRef):
+        return b"u" + term.encode("utf-8")
+    if isinstance(term, rdflib.BNode):
+        return b"b" + term.encode("utf-8")
+    return b"n" + term.n3().encode("utf-8")
+
+class _Terms(object):
+    """The interned terms, their IDs are their positions in the sorted
+    table of their keys. While the indexes are compacted, ids maps the
+    terms to their IDs directly."""
+
+    def __init__(self, terms):
+        keyed = sorted((_key(t), t) for t in terms)
+        self.keys = _Table([k for k, _ in keyed])
+        self.ids = dict((t, i) for i, (_, t) in enumerate(keyed))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, i):
+        key = self.keys[i]
+        kind, value = key[:1], key[1:].decode("utf-8")
+        if kind == b"u":
+            # the URIs were checked when they were parsed
+            return unicode.__new__(rdflib.URIRef, value)
+        if kind == b"b":
+            return rdflib.BNode(value)
+        return from_n3(value)
+
+    def find(self, term):
+        """The ID of term, or -1"""
+        if not isinstance(term, rdflib.term.Node):
+            return -1
+        key = _key(term)
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return -1
+
+def _find(ids, i):
+    # the position of i in the sorted array ids, or -1
+    if i < 0:
+        return -1
+    p = bisect.bisect_left(ids, i)
+    if p < len(ids) and ids[p] == i:
+        return p
+    return -1
+
+class _Members(Mapping):
+    """resource => URL label, for the resources of one type"""
+
+    def __init__(self, terms, res):
+        self.terms = terms
+        entries = sorted((terms.ids[r], l) for r, l in res.iteritems())
+        self.ids = array.array(_typecode(len(terms)), (i for i, _ in entries))
+        self.labels = _Table([quote(l) for _, l in entries])
+        self.order = array.array(_typecode(len(entries)),
+                                 sorted(xrange(len(entries)), key=self.labels.__getitem__))
+
+    def __getitem__(self, r):
+        p = _find(self.ids, self.terms.find(r))
+        if p < 0:
+            raise KeyError(r)
+        return self.labels[p]
+
+    def __contains__(self, r):
+        return _find(self.ids, self.terms.find(r)) >= 0
+
+    def __iter__(self):
+        for i in self.ids:
+            yield self.terms[i]
+
+    def __len__(self):
+        return len(self.ids)
+
+class _ByLabel(Mapping):
+    """URL label => resource, for the resources of one type"""
+
+    def __init__(self, members):
+        self.members = members
+        self.sorted = _Permuted(members.labels, members.order)
+
+    def _position(self, l):
+        p = bisect.bisect_left(self.sorted, l)
+        if p < len(self.sorted) and self.sorted[p] == l:
+            return self.members.order[p]
+        return -1
+
+    def __getitem__(self, l):
+        p = self._position(l)
+        if p < 0:
+            raise KeyError(l)
+        return self.members.terms[self.members.ids[p]]
+
+    def __contains__(self, l):
+        return self._position(l) >= 0
+
+    def __iter__(self):
+        for p in self.members.order:
+            yield self.members.labels[p]
+
+    def __len__(self):
+        return len(self.members)
+
+class _ResourceTypes(Mapping):
+    """resource => set of its types"""
+
+    def __init__(self, terms, resource_types):
+        self.terms = terms
+        # the types are numbered
+        numbers = {}
+        by_id = {}
+        for r, ts in resource_types.iteritems():
+            if ts:
+                ns = by_id[terms.ids[r]] = []
+                for t in ts:
+                    n = numbers.get(t)
+                    if n is None:
+                        n = numbers[t] = len(numbers)
+                    ns.append(n)
+        self.types = [None] * len(numbers)
+        for t, n in numbers.iteritems():
+            self.types[n] = t
+        self.offsets = array.array(_typecode(sum(len(ns) for ns in by_id.itervalues())), [0])
+        self.numbers = array.array(_typecode(len(numbers)))
+        for i in xrange(len(terms)):
+            self.numbers.extend(by_id.get(i, ()))
+            self.offsets.append(len(self.numbers))
+        self.count = len(by_id)
+
+    def _slice(self, r):
+        i = self.terms.find(r)
+        if i < 0:
+            return ()
+        return self.numbers[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, r):
+        numbers = self._slice(r)
+        if not numbers:
+            raise KeyError(r)
+        return set(self.types[n] for n in numbers)
+
+    def __contains__(self, r):
+        return bool(self._slice(r))
+
+    def __iter__(self):
+        for i in xrange(len(self.terms)):
+            if self.offsets[i] < self.offsets[i + 1]:
+                yield self.terms[i]
+
+    def __len__(self):
+        return self.count
+
+class _Labels(Mapping):
+    """resource => label"""
+
+    def __init__(self, terms, labels):
+        self.terms = terms
+        self.present = array.array("B", [0]) * len(terms)
+        strings = [u""] * len(terms)
+        for r, l in labels.iteritems():
+            i = terms.ids[r]
+            self.present[i] = 1
+            strings[i] = unicode(l)
+        self.labels = _Table(strings, text=True)
+        self.count = len(labels)
+
+    def _id(self, r):
+        i = self.terms.find(r)
+        return i if i >= 0 and self.present[i] else -1
+
+    def __getitem__(self, r):
+        i = self._id(r)
+        if i < 0:
+            raise KeyError(r)
+        return self.labels[i]
+
+    def __contains__(self, r):
+        return self._id(r) >= 0
+
+    def __iter__(self):
+        for i in xrange(len(self.terms)):
+            if self.present[i]:
+                yield self.terms[i]
+
+    def __len__(self):
+        return self.count
+
+_MISSING = object()
+
+class _Overlay(MutableMapping):
+    """
+    A mapping with the modifications made to a read-only base mapping
+    kept in a dict (the keys added or changed) and a set (the keys of
+    base removed).
+
+    :argument:default: If given, a function whose result is stored for
+    missing keys and returned, as by a defaultdict
+    """
+
+    def __init__(self, base, default=None):
+        self.base = base
+        self.default = default
+        self.added = {}
+        self.removed = set()
+
+    def _get(self, k):
+        value = self.added.get(k, _MISSING)
+        if value is _MISSING and k not in self.removed:
+            try:
+                value = self.base[k]
+            except KeyError:
+                pass
+        return value
+
+    def __getitem__(self, k):
+        value = self._get(k)
+        if value is _MISSING:
+            if self.default is None:
+                raise KeyError(k)
+            value = self.added[k] = self.default()
+        return value
+
+    def get(self, k, default=None):
+        value = self._get(k)
+        return default if value is _MISSING else value
+
+    def pop(self, k, default=_MISSING):
+        value = self._get(k)
+        if value is _MISSING:
+            if default is _MISSING:
+                raise KeyError(k)
+            return default
+        del self[k]
+        return value
+
+    def __contains__(self, k):
+        return k in self.added or (k not in self.removed and k in self.base)
+
+    def __setitem__(self, k, value):
+        self.added[k] = value
+        self.removed.discard(k)
+
+    def __delitem__(self, k):
+        found = self.added.pop(k, _MISSING) is not _MISSING
+        if k not in self.removed and k in self.base:
+            self.removed.add(k)
+            found = True
+        if not found:
+            raise KeyError(k)
+
+    def __iter__(self):
+        for k in self.base:
+            if k not in self.removed and k not in self.added:
+                yield k
+        for k in self.added:
+            yield k
+
+    def __len__(self):
+        return len(self.base) - len(self.removed) + \
+            sum(1 for k in self.added if k not in self.base)
+
+def compact(index):
+    """
+    The indexes (a dict as returned by lodindex.build) in the compact
+    layout. types and rtypes, which are small, stay dicts.
+    """
+    terms = set(index["resource_types"])
+    terms.update(index["labels"])
+    for res in index["resources"].itervalues():
+        terms.update(r for r in res if r is not None)
+    terms = _Terms(terms)
+
+    resources = collections.defaultdict(dict)
+    rresources = {}
+    for t, res in index["resources"].iteritems():
+        if None in res: # only the types without resources
+            resources[t] = res
+            rresources[t] = index["rresources"][t]
+            continue
+        members = _Members(terms, res)
+        resources[t] = _Overlay(members)
+        rresources[t] = _Overlay(_ByLabel(members))
+
+    resource_types = _Overlay(_ResourceTypes(terms, index["resource_types"]), set)
+    labels = _Overlay(_Labels(terms, index["labels"]))
+    terms.ids = None
+
+    return { "types": index["types"], "rtypes": index["rtypes"],
+             "resource_types": resource_types,
+             "resources": resources, "rresources": rresources,
+             "labels": labels }
@@ -0,0 +1,161 @@
+"""
+Server-side cursors for paging through SELECT results.
+
+Paging with LIMIT/OFFSET evaluates the query again for every page. A
+cursor instead keeps the suspended iterator over the result rows
+between requests, so each page continues where the last one stopped.
+
+The iterator evaluates the query lazily against the live dataset, so
+it must not survive a modification. Before the dataset is changed,
+:py:meth:`CursorStore.spill_all` writes the remaining rows of every open
+cursor to a temporary file, later pages are then read from there.
+
+Cursors not used for ``ttl`` seconds are closed, and at most
+``maxcursors`` can be open at the same time.
+"""
+
+import threading
+import time
+import uuid
+import tempfile
+import itertools
+import cPickle as pickle
+
+__all__ = [ 'CursorStore', 'TooManyCursors', 'NoSuchCursor' ]
+
+class TooManyCursors(Exception):
+    pass
+
+class NoSuchCursor(KeyError):
+    """The token names no open cursor, it is unknown, expired or
+    exhausted"""
+    pass
+
+class _Cursor(object):
+
+    def __init__(self, vars, rows):
+        self.vars = vars
+        self.rows = rows
+        self.spill = None
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+
+    def take(self, n):
+        """Returns the next n rows and whether there are more"""
+        page = list(itertools.islice(self.rows, n))
+        try:
+            peek = next(self.rows)
+        except StopIteration:
+            return page, False
+        self.rows = itertools.chain([peek], self.rows)
+        return page, True
+
+    def spill_rows(self, directory):
+        """Evaluate the remaining rows into a temporary file"""
+        if self.spill is not None:
+            return
+        self.spill = tempfile.TemporaryFile(dir=directory)
+        for row in self.rows:
+            # only the values, a row references the query context and
+            # thereby the whole graph
+            values = tuple(row.get(v) for v in self.vars)
+            pickle.dump(values, self.spill, pickle.HIGHEST_PROTOCOL)
+        self.spill.seek(0)
+        self.rows = self._read_spill()
+
+    def _read_spill(self):
+        while True:
+            try:
+                values = pickle.load(self.spill)
+            except EOFError:
+                return
+            yield dict((v, value) for v, value in zip(self.vars, values)
+                       if value is not None)
+
+    def close(self):
+        if hasattr(self.rows, "close"):
+            self.rows.close()
+        if self.spill is not None:
+            self.spill.close()
+
+class CursorStore(object):
+    """
+    The open cursors of an endpoint.
+
+    :argument:maxcursors: Maximum number of open cursors
+    :argument:ttl: Seconds after which an unused cursor is closed
+    :argument:spill_dir: Directory for spill files, the system default
+    if None
+    """
+
+    def __init__(self, maxcursors=100, ttl=300, spill_dir=None):
+        self.maxcursors = maxcursors
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        # called holding self._lock
+        now = time.time()
+        for token, cursor in self._cursors.items():
+            if now - cursor.last_used > self.ttl and cursor.lock.acquire(False):
+                del self._cursors[token]
+                cursor.close()
+                cursor.lock.release()
+
+    def first_page(self, vars, rows, n):
+        """
+        Returns the first n of rows (an iterator over the bindings of a
+        SELECT result) and a token for fetching the next page, or None
+        if that was all. Must be called holding the read lock of the
+        dataset.
+        """
+        cursor = _Cursor(vars, iter(rows))
+        page, more = cursor.take(n)
+        if not more:
+            return page, None
+
+        with self._lock:
+            self._expire()
+            if len(self._cursors) >= self.maxcursors:
+                cursor.close()
+                raise TooManyCursors()
+            token = uuid.uuid4().hex
+            self._cursors[token] = cursor
+        return page, token
+
+    def next_page(self, token, n):
+        """
+        Returns the variables and the next n rows of the cursor, and the
+        token for the following page or None if the cursor is exhausted
+        (and thereby closed). Raises NoSuchCursor for unknown or expired
+        tokens. Must be called holding the read lock of the dataset.
+        """
+        with self._lock:
+            self._expire()
+            cursor = self._cursors.get(token)
+        if cursor is None:
+            raise NoSuchCursor(token)
+
+        with cursor.lock:
+            page, more = cursor.take(n)
+            cursor.last_used = time.time()
+            if not more:
+                with self._lock:
+                    self._cursors.pop(token, None)
+                cursor.close()
+                token = None
+        return cursor.vars, page, token
+
+    def spill_all(self):
+        """Materialize the remaining rows of all cursors. This must be
+        called before the dataset is modified, holding its write lock."""
+        with self._lock:
+            cursors = self._cursors.values()
+        for cursor in cursors:
+            with cursor.lock:
+                cursor.spill_rows(self.spill_dir)
+
+    def __len__(self):
+        return len(self._cursors)
@@ -19,13 +19,111 @@ or if you installed with pip, commands ``rdflodapp`` has been added to your path
 
 Either way, the endpoint will be available at http://localhost:5000
 
+With ``rdfsparqlapp -a <RDF-file>`` the asyncio variant from
+:py:mod:`rdflib_web.asgi` is started instead (python 3 only).
+
 You can also start the server from your application by calling the :py:func:`serve` method
 or get the application object yourself by called :py:func:`get` function
 
+SELECT and ASK results in xml, json and html are serialized while the
+query is evaluated, into a temporary file once they are larger than
+``app.config["spool_bytes"]`` (1MB), so the memory used does not grow
+with the size of the result. They are sent to the client from there,
+after the read lock of the dataset was released, so that a slow client
+does not hold up writers. Set ``app.config["stream_results"]=False`` to
+serialize them in one piece instead, ``app.config["stream_chunksize"]``
+sets the size of the chunks sent.
+
+The first byte of a result is therefore only sent once the whole
+result has been serialized: the memory used is bounded, but the time to
+the first byte of a large result is not shorter than without streaming.
+This holds for graph store GET requests and dataset dumps too. In
+exchange, errors and timeouts are answered with a proper status code,
+and the lock is held only as long as serializing takes, whatever the
+speed of the client.
+
+Serialized query results can be cached by setting
+``app.config["query_cache_entries"]`` to the maximum number of cached
+results (and optionally ``app.config["query_cache_bytes"]`` to their
+maximum total size, 64MB by default). Cached results are invalidated by
+every write through the graph store. If the application modifies the
+graph itself, it must call ``app.config["generic"].changed()``.
+
+Likewise, graphs serialized for graph store GET requests are cached with
+``app.config["graph_cache_entries"]`` set, until the graph is modified.
+``app.config["graph_cache_bytes"]`` (256MB) bounds their total size.
+Graphs larger than ``app.config["graph_cache_spill_bytes"]`` (1MB) are
+kept in files in ``app.config["graph_cache_dir"]`` (the system's
+temporary directory by default).
+
+Parsed queries are kept for the last
+``app.config["prepared_query_cache_entries"]`` (100 by default) distinct
+query strings. Variables can be bound by request parameters, e.g.
+``$s=<http://example.org/book/book1>`` binds ``?s``, so that templated
+queries can share one parsed form.
+
+Queries are evaluated on a pool of ``app.config["query_workers"]`` (4 by
+default) threads. At most ``app.config["query_queue_size"]`` (16) further
+queries wait for a free worker, beyond that requests are answered with
+503 and a Retry-After header. ``app.config["query_timeout"]`` sets a
+timeout in seconds, which a request can lower with the ``timeout``
+parameter. Queries whose evaluation and serialization take longer are
+abandoned and answered with 503, sending the result to the client is
+not limited.
+
+SELECT results can be fetched page by page: with the ``pagesize``
+parameter, only the first rows are returned, and if there are more, the
+response carries an ``X-Cursor`` header. Requesting ``/sparql`` with that
+token as ``cursor`` parameter returns the next page, without evaluating
+the query again. At most ``app.config["max_cursors"]`` (100) cursors are
+open, they are closed after ``app.config["cursor_ttl"]`` (300) idle
+seconds.
+
+Responses carry ETags derived from the dataset version, so clients
+re-requesting unchanged data get a 304 without the query being run, and
+are compressed according to Accept-Encoding, see
+:py:mod:`rdflib_web.httputils`. Graph store responses carry ETags and
+Last-Modified dates of the graph, which only change when the graph
+does. HEAD requests on the graph store are answered without serializing
+the graph.
+
+The time spent parsing, translating, evaluating, serializing and
+rendering queries, and in graph store requests, is recorded in
+histograms by query form and result format. They are served with the
+lock and cache statistics in the Prometheus text format on ``/metrics``,
+see :py:mod:`rdflib_web.metrics`. Set ``app.config["metrics"]=False``
+to switch this off.
+
+SPARQL 1.1 Updates are POSTed to ``/update``. Updates arriving while
+others are applied are applied together in one batch of at most
+``app.config["update_batch"]`` (100) updates, holding the write lock
+once. ``app.config["update_delay"]`` (0) seconds are waited for more
+updates before a batch is applied.
+
+The files of a multipart/form-data POST to the graph store are parsed
+in parallel by ``app.config["parse_workers"]`` (4) processes, see
+:py:mod:`rdflib_web.parsepool`. If one of them cannot be parsed, none
+is added. On python 2 the processes are forked, :py:func:`start_parse_pool`
+starts them before the server starts its threads (:py:func:`serve` does).
+
+With ``app.config["journal"]`` set to a :py:class:`rdflib_web.journal.Journal`,
+all modifications are journaled, so that the dataset can be restored
+after a restart. ``rdfsparqlapp -j <directory>`` keeps a journal there,
+and starts from it instead of the files given if it exists.
+
+The whole dataset can be dumped with a GET on ``/dataset`` as N-Quads
+or TriG, spooled while it is read from the store, and restored with a
+PUT (replacing all graphs) or extended with a POST in the same formats.
+
+Access to the graph is coordinated by the reader-writer lock
+``app.config["generic"].lock``: queries and pages read concurrently,
+graph store writes are exclusive. Applications sharing the graph with
+other threads should use the same lock.
+
 """
 try:
     from flask import ( Blueprint, Flask, render_template, request, make_response,
-        Markup, g, url_for, current_app )
+        Markup, g, url_for, current_app, Response )
 except:
     raise Exception("Flask not found - install with 'easy_install flask'")
 
@@ -34,13 +132,23 @@ import rdflib
 import sys
 import time
 import traceback
+import itertools
 
 import mimeutils
 
 from rdflib_web import htmlresults
+from rdflib_web import streaming
+from rdflib_web import caches
+from rdflib_web import querypool
+from rdflib_web import cursors
+from rdflib_web import httputils
+from rdflib_web import metrics
+from rdflib_web import bulkload
+from rdflib_web import parsepool
+from rdflib_web import journal
 from rdflib_web import __version__
 from rdflib_web import generic_endpoint
-__all__ = [ 'endpoint', 'get', 'serve' ]
+__all__ = [ 'endpoint', 'get', 'serve', 'start_parse_pool' ]
 
 
 endpoint = Blueprint('sparql_endpoint', __name__)
@@ -54,6 +162,7 @@ def setup(state):
     state.app.jinja_env.globals["rdflib_web_version"]=__version__
     state.app.jinja_env.globals["python_version"]="%d.%d.%d"%(sys.version_info[0], sys.version_info[1], sys.version_info[2])
     state.app.before_first_request(__create_generic_endpoint)
+    state.app.before_first_request(__create_query_pool)
     state.app.before_first_request(__register_namespaces)
 
 
@@ -62,15 +171,8 @@ DEFAULT = generic_endpoint.GenericEndpoint.DEFAULT
 @endpoint.route("/sparql", methods=['GET', 'POST'])
 def query():
     try:
-        q=request.values["query"]
-
-        a=request.headers["Accept"]
-
-        format="xml" # xml is default
-        if mimeutils.HTML_MIME in a:
-            format="html"
-        if mimeutils.JSON_MIME in a:
-            format="json"
+        # xml is default
+        format=mimeutils.resultformat(request.headers.get("Accept"))
 
         # output parameter overrides header
         format=request.values.get("output", format)
@@ -80,23 +182,226 @@ def query():
         # force-accept parameter overrides mimetype
         mimetype=request.values.get("force-accept", mimetype)
 
+        try:
+            timeout=_timeout()
+        except ValueError:
+            return "Invalid timeout %s"%request.values["timeout"], 400
+
+        if "cursor" in request.values or "pagesize" in request.values:
+            return _paged(format, mimetype, timeout)
+
+        q=request.values["query"]
+
         # pretty=None
         # if "force-accept" in request.values:
         #     pretty=True
 
         # default-graph-uri
 
-        results=g.generic.ds.query(q).serialize(format=format)
+        bindings=g.generic.init_bindings(request.values)
+
+        key=g.generic.query_key(q, format, bindings)
+        results=g.generic.cached_result(key)
+        # cache hits are not timed
+        timer=metrics.RequestTimer(None)
+        if results is None:
+            generic=g.generic
+            stream=current_app.config.get("stream_results", True)
+            chunksize=current_app.config.get("stream_chunksize", streaming.CHUNKSIZE)
+            spool_bytes=current_app.config.get("spool_bytes", streaming.SPOOL_BYTES)
+            timer=generic.timer(format=format)
+
+            def evaluate():
+                # results are computed lazily, so the read lock is held
+                # until the last chunk has been serialized
+                with generic.lock.reading():
+                    results=generic.query(q, bindings, timer)
+                    if stream and results.type in ('SELECT', 'ASK') and \
+                            format in streaming.RESULT_SERIALIZERS:
+                        chunks=streaming.RESULT_SERIALIZERS[format](results, chunksize)
+                    else:
+                        chunks=_serialize(results, format)
+                    # stops once the query timed out, to release the lock
+                    chunks=querypool.checked(timer.chunks(chunks))
+                    spooled=streaming.spool(generic.cache_chunks(key, chunks), spool_bytes)
+                yield spooled
+
+            try:
+                chunks=_submit(evaluate, timeout, chunksize)
+            except querypool.PoolFull:
+                retry=str(current_app.config.get("query_retry_after", 5))
+                return "Too many queries, try again later", 503, {"Retry-After": retry}
+            except querypool.QueryTimeout:
+                return "Query timed out", 503
+
+            if stream:
+                response=_stream_results(chunks, format, q, timer)
+                response.headers["Content-Type"]=mimetype
+                return response
+
+            results=b"".join(chunks)
+
         if format=='html':
-            response=make_response(render_template("results.html", results=Markup(unicode(results,"utf-8")), q=q))
+            with timer.phase("render"):
+                page=render_template("results.html", results=Markup(unicode(results,"utf-8")), q=q)
+            response=make_response(page)
         else:
             response=make_response(results)
+        timer.finish()
 
         response.headers["Content-Type"]=mimetype
         return response
     except:
         return "<pre>"+traceback.format_exc()+"</pre>", 400
 
+def _serialize(results, format):
+    """Serialize in one piece, when the chunk is taken"""
+    yield results.serialize(format=format)
+
+@endpoint.route("/update", methods=['POST'])
+def update():
+    """SPARQL 1.1 Update, with the update in the ``update`` form
+    parameter or as application/sparql-update body"""
+    if request.mimetype=="application/sparql-update":
+        u=request.get_data(as_text=True)
+    elif "update" in request.form:
+        u=request.form["update"]
+    else:
+        return "Missing parameter 'update'", 400
+    try:
+        bindings=g.generic.init_bindings(request.values)
+        g.generic.update(u, bindings)
+    except:
+        return "<pre>"+traceback.format_exc()+"</pre>", 400
+    return "", 204
+
+_RESULTS_MARKER='__RESULTS__'
+
+def _html_page(table, q, timer):
+    """Wrap the streamed result table into the results.html page"""
+    start=g.start
+    with timer.phase("render"):
+        page=render_template("results.html", results=Markup(_RESULTS_MARKER), q=q)
+    head, tail=page.split(_RESULTS_MARKER, 1)
+    def end():
+        yield tail.replace('__EXECUTION_TIME__', "%.3f"%(time.time()-start)).encode("utf-8")
+    return itertools.chain([head.encode("utf-8")], table, end())
+
+def _stream_results(chunks, format, q, timer):
+    """Create a chunked response from the chunks of a serialized result,
+    which are computed while the response is sent"""
+    if format=='html':
+        chunks=_html_page(chunks, q, timer)
+    return Response(_finish_timer(chunks, timer))
+
+def _finish_timer(chunks, timer):
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        timer.finish()
+
+def _paged(format, mimetype, timeout):
+    """
+    Answer a request for the first page of a SELECT result (with the
+    pagesize parameter) or for a following page (with the cursor
+    parameter). The token for the next page is sent in the X-Cursor
+    header.
+    """
+    generic=g.generic
+    if generic.cursors is None:
+        return "Cursors are not enabled", 400
+
+    try:
+        pagesize=int(request.values.get("pagesize",
+            current_app.config.get("cursor_pagesize", 1000)))
+    except ValueError:
+        pagesize=0
+    if pagesize<=0:
+        return "Invalid pagesize %s"%request.values.get("pagesize"), 400
+    token=request.values.get("cursor")
+    if token is None:
+        q=request.values["query"]
+        bindings=generic.init_bindings(request.values)
+    page={}
+    # only SELECT results can be paged
+    timer=generic.timer("SELECT", format)
+
+    def evaluate():
+        with generic.lock.reading():
+            if token is None:
+                results=generic.query(q, bindings, timer)
+                if results.type!='SELECT':
+                    raise Exception("Only SELECT results can be paged")
+                page["vars"]=results.vars
+                page["rows"], page["token"]=generic.cursors.first_page(
+                    results.vars, streaming.iter_bindings(results), pagesize)
+            else:
+                page["vars"], page["rows"], page["token"]=generic.cursors.next_page(
+                    token, pagesize)
+
+        result=rdflib.query.Result('SELECT')
+        result.vars=page["vars"]
+        result.bindings=page["rows"]
+        if format in streaming.RESULT_SERIALIZERS:
+            chunks=streaming.RESULT_SERIALIZERS[format](result)
+        else:
+            chunks=_serialize(result, format)
+        yield streaming.spool(timer.chunks(chunks))
+
+    try:
+        chunks=_submit(evaluate, timeout)
+    except cursors.NoSuchCursor:
+        return "No such cursor %s"%token, 404
+    except cursors.TooManyCursors:
+        retry=str(current_app.config.get("query_retry_after", 5))
+        return "Too many open cursors, try again later", 503, {"Retry-After": retry}
+    except querypool.PoolFull:
+        retry=str(current_app.config.get("query_retry_after", 5))
+        return "Too many queries, try again later", 503, {"Retry-After": retry}
+    except querypool.QueryTimeout:
+        return "Query timed out", 503
+
+    if format=='html':
+        chunks=_html_page(chunks, request.values.get("query", ""), timer)
+    response=make_response(b"".join(chunks))
+    timer.finish()
+    response.headers["Content-Type"]=mimetype
+    if page.get("token"):
+        response.headers["X-Cursor"]=page["token"]
+    return response
+
+def _timeout():
+    """The timeout for a query, the timeout parameter limited by the
+    query pool's. Raises ValueError if the parameter is invalid."""
+    pool=current_app.config.get("query_pool")
+    requested=request.values.get("timeout")
+    if pool is None:
+        # checked all the same
+        if requested is not None:
+            querypool.parse_timeout(requested)
+        return None
+    return pool.timeout_for(requested)
+
+def _submit(evaluate, timeout, chunksize=streaming.CHUNKSIZE):
+    """
+    Run evaluate on the query pool, if there is one, and return an
+    iterator over the chunks of the result. evaluate yields one file,
+    to which the whole result was written (see streaming.spool), so
+    the errors and the timeout of the evaluation are reported here, and
+    sending the result is not limited by the timeout.
+    """
+    pool=current_app.config.get("query_pool")
+    if pool is None:
+        job=iter(evaluate())
+    else:
+        job=pool.submit(evaluate, timeout)
+    try:
+        spooled=next(job)
+    finally:
+        job.close()
+    return streaming.read_chunks(spooled, chunksize)
+
 def graph_store_do(graph_identifier):
     method = request.method
     mimetype = request.mimetype
@@ -108,17 +413,31 @@ def graph_store_do(graph_identifier):
             data = data_file.read()
             mt = force_mimetype or data_file.mimetype or rdflib.guess_format(data_file.filename)
             body.append({'data': data, 'mimetype': mt})
+    elif mimetype in bulkload.FORMATS:
+        # loaded while it is read
+        body = request.stream
     else:
         body = request.data
 
     result = g.generic.graph_store(
         method=method, graph_identifier=graph_identifier, args=args,
         body=body, mimetype=mimetype,
-        accept_header=request.headers.get("Accept")
+        accept_header=request.headers.get("Accept"),
+        if_none_match=request.headers.get("If-None-Match")
     )
+    return _graph_response(result)
+
+def _graph_response(result):
     code, headers, body = result
 
-    response = make_response(body or '', code)
+    if body is not None and not isinstance(body, basestring):
+        # the streamed graph
+        response = Response(body, code)
+    elif body is None and request.method == 'HEAD':
+        # not an empty body, the length is only known if given
+        response = Response(iter(()), code)
+    else:
+        response = make_response(body or '', code)
     for k, v in headers.items():
         response.headers[k] = v
     return response
@@ -134,37 +453,125 @@ def graph_store_direct(path):
     return graph_store_do(graph_identifier)
 
 
+@endpoint.route("/metrics", endpoint="metrics")
+def prometheus_metrics():
+    """The request phase histograms, lock and cache statistics in the
+    Prometheus text format"""
+    generic=g.generic
+    if generic.metrics is None:
+        return "Metrics are not enabled", 404
+    text=generic.metrics.render()+metrics.render_lock(generic.lock.stats())
+    if generic.query_cache is not None:
+        text+=metrics.render_cache("query", generic.query_cache)
+    if generic.prepared_cache is not None:
+        text+=metrics.render_cache("prepared_query", generic.prepared_cache)
+    if generic.graph_cache is not None:
+        text+=metrics.render_cache("graph", generic.graph_cache)
+    response=make_response(text)
+    response.headers["Content-Type"]="text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+@endpoint.route("/dataset", methods=["GET", "PUT", "POST"]) # HEAD is done by flask via GET
+def dataset():
+    """Dump or load the whole dataset as N-Quads or TriG"""
+    if request.mimetype in bulkload.FORMATS:
+        body = request.stream
+    else:
+        body = request.data
+    return _graph_response(g.generic.dataset(
+        method=request.method, body=body, mimetype=request.mimetype,
+        accept_header=request.headers.get("Accept")))
+
 #@endpoint.route("/") # bound later
 def index():
     return render_template("index.html")
 
 def __register_namespaces():
-    for p,ns in current_app.config["graph"].namespaces():
-        htmlresults.nm.bind(p,ns,override=True)
+    with current_app.config["generic"].lock.reading():
+        for p,ns in current_app.config["graph"].namespaces():
+            htmlresults.nm.bind(p,ns,override=True)
 
 def __create_generic_endpoint():
+    query_cache=None
+    if current_app.config.get("query_cache_entries"):
+        query_cache=caches.LRUCache(
+            maxsize=current_app.config["query_cache_entries"],
+            maxbytes=current_app.config.get("query_cache_bytes", 64*1024*1024))
+    prepared_cache=None
+    if current_app.config.get("prepared_query_cache_entries", 100):
+        prepared_cache=caches.LRUCache(
+            maxsize=current_app.config.get("prepared_query_cache_entries", 100))
+    graph_cache=None
+    if current_app.config.get("graph_cache_entries"):
+        graph_cache=caches.SpillingLRUCache(
+            maxsize=current_app.config["graph_cache_entries"],
+            maxbytes=current_app.config.get("graph_cache_bytes", 256*1024*1024),
+            spill_bytes=current_app.config.get("graph_cache_spill_bytes", 1024*1024),
+            spill_dir=current_app.config.get("graph_cache_dir"))
+    cursor_store=None
+    if current_app.config.get("max_cursors", 100):
+        cursor_store=cursors.CursorStore(
+            maxcursors=current_app.config.get("max_cursors", 100),
+            ttl=current_app.config.get("cursor_ttl", 300),
+            spill_dir=current_app.config.get("cursor_spill_dir"))
     current_app.config["generic"]=generic_endpoint.GenericEndpoint(
         ds=current_app.config["graph"],
-        coin_url=lambda: url_for("graph_store_direct", path=str(rdflib.BNode()), _external=True)
+        coin_url=lambda: url_for("graph_store_direct", path=str(rdflib.BNode()), _external=True),
+        query_cache=query_cache,
+        prepared_cache=prepared_cache,
+        cursors=cursor_store,
+        metrics=metrics.Metrics() if current_app.config.get("metrics", True) else None,
+        update_batch=current_app.config.get("update_batch", 100),
+        update_delay=current_app.config.get("update_delay", 0),
+        graph_cache=graph_cache,
+        parse_pool=current_app.config.get("parse_pool") or
+            parsepool.ParsePool(workers=current_app.config.get("parse_workers", 4)),
+        journal=current_app.config.get("journal")
     )
 
+def __create_query_pool():
+    if current_app.config.get("query_workers", 4) and "query_pool" not in current_app.config:
+        current_app.config["query_pool"]=querypool.QueryPool(
+            workers=current_app.config.get("query_workers", 4),
+            queue_size=current_app.config.get("query_queue_size", 16),
+            timeout=current_app.config.get("query_timeout"))
+
 @endpoint.before_request
 def __start():
     g.start=time.time()
 
+@endpoint.before_request
+def __conditional():
+    # metrics change without the dataset changing, and the graph store
+    # has an ETag for each graph
+    if request.endpoint not in ("sparql_endpoint.metrics",
+                                "sparql_endpoint.graph_store_indirect",
+                                "sparql_endpoint.graph_store_direct"):
+        return httputils.not_modified()
+
 @endpoint.after_request
 def __end(response):
     diff = time.time() - g.start
-    if response.response and response.content_type.startswith("text/html") and response.status_code==200:
+    if not response.is_streamed and response.response and response.content_type.startswith("text/html") and response.status_code==200:
         response.response[0]=response.response[0].replace('__EXECUTION_TIME__', "%.3f"%diff)
         response.headers["Content-Length"]=len(response.response[0])
-    return response
+    return httputils.finish(response)
 
 
-def serve(ds,debug=False):
+def start_parse_pool(app):
+    """Start the processes parsing multipart/form-data uploads for the
+    app, call it before the server starts any threads. They are stopped
+    at exit."""
+    pool=parsepool.ParsePool(workers=app.config.get("parse_workers", 4))
+    pool.start()
+    app.config["parse_pool"]=pool
+    return pool
+
+def serve(ds,debug=False,journal=None):
     """Serve the given dataset on localhost with the LOD App"""
 
-    a=get(ds)
+    a=get(ds,journal)
+    start_parse_pool(a)
     a.run(debug=debug)
     return a
 
@@ -175,12 +582,14 @@ def _set_generic():
     g.generic = current_app.config["generic"]
     g.graph = g.generic.ds
 
-def get(ds):
+def get(ds, journal=None):
     """
-    Get the LOD Flask App setup to serve the given dataset
+    Get the LOD Flask App setup to serve the given dataset, optionally
+    writing the modifications to a started journal.Journal
     """
     app = Flask(__name__)
     app.config["graph"]=ds
+    app.config["journal"]=journal
 
     app.register_blueprint(endpoint)
     app.add_url_rule('/', 'index', index)
@@ -192,15 +601,27 @@ def _main(g, out, opts):
     import rdflib
     import sys
 
-    if 'x' in opts:
+    opts=dict(opts)
+    if '-x' in opts:
         import bookdb
         g=bookdb.bookdb
 
-    serve(g, True)
+    j=None
+    if '-j' in opts:
+        j=journal.Journal(opts['-j'], g)
+        j.start()
+
+    if '-a' in opts:
+        # the asyncio/ASGI variant
+        if sys.version_info < (3, 5):
+            raise Exception("The ASGI app requires python 3.5 or newer")
+        from rdflib_web import asgi
+        asgi.serve(g, journal=j)
+    else:
+        serve(g, True, j)
 
 def main():
-    from rdflib.extras.cmdlineutils import main as cmdmain
-    cmdmain(_main, stdin=False, options='x')
+    journal.main(_main, options='xaj:')
 
 if __name__=='__main__':
     main()
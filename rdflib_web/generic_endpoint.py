@@ -1,4 +1,29 @@
+import hashlib
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from email.utils import formatdate
+
 import rdflib
+from rdflib.store import Store
+from rdflib.plugins.sparql.parser import parseQuery, parseUpdate
+from rdflib.plugins.sparql.algebra import translateQuery, translateUpdate
+from rdflib.util import from_n3
+
+from rdflib_web.rwlock import ReadWriteLock
+from rdflib_web.metrics import RequestTimer
+from rdflib_web import streaming
+from rdflib_web import bulkload
+from rdflib_web import mimeutils
+from rdflib_web.batching import Batcher
+from rdflib_web import parsepool
+from rdflib_web.parsepool import ParsePool
+
+# The pyparsing grammars of the SPARQL parser keep state while parsing
+_parsing = threading.Lock()
 
 class DefaultGraphReadOnly(Exception):
     pass
@@ -6,6 +31,162 @@ class DefaultGraphReadOnly(Exception):
 class NamedGraphsNotSupported(Exception):
     pass
 
+class GraphMetadata(object):
+    """
+    What the endpoint knows about a graph without reading it.
+
+    :argument:version: The dataset version after the last modification
+    of the graph, or when it was first looked at since the endpoint
+    lost track of it (see GenericEndpoint.changed).
+    :argument:modified: Time of that modification, or when the endpoint
+    lost track
+    """
+
+    def __init__(self, version, modified):
+        self.version = version
+        self.modified = modified
+        # number of triples, counted when needed
+        self.triples = None
+        # lengths of complete serializations of this version by format
+        self.sizes = {}
+
+class _RecordingStore(Store):
+    """
+    Passes everything on to store, telling the recorder what was
+    actually changed: recorder.add and recorder.remove are called with
+    the (s, p, o, graph) quads added and removed, recorder.create and
+    recorder.drop with the identifiers of the graphs added and removed
+    (as the methods of a journal.Journal). SPARQL Updates are evaluated
+    by rdflib against a graph over it, see _view.
+    """
+
+    def __init__(self, store, recorder):
+        Store.__init__(self)
+        self.store = store
+        self.recorder = recorder
+        self.context_aware = store.context_aware
+        self.formula_aware = store.formula_aware
+        self.graph_aware = store.graph_aware
+        self.transaction_aware = store.transaction_aware
+
+    def add(self, triple, context, quoted=False):
+        if not quoted and next(iter(self.store.triples(triple, context)), None) is None:
+            self.recorder.add([triple + (context,)])
+        self.store.add(triple, context, quoted)
+
+    def addN(self, quads):
+        for s, p, o, c in quads:
+            self.add((s, p, o), c)
+
+    def remove(self, triple, context=None):
+        # the matches, before they are gone
+        removed = []
+        for t, contexts in self.store.triples(triple, context):
+            removed.extend(t + (c,) for c in ([context] if context is not None else contexts))
+        if removed:
+            self.recorder.remove(removed)
+        self.store.remove(triple, context)
+
+    def add_graph(self, graph):
+        self.recorder.create(graph.identifier)
+        self.store.add_graph(graph)
+
+    def remove_graph(self, graph):
+        self.remove((None, None, None), graph)
+        self.recorder.drop(graph.identifier)
+        self.store.remove_graph(graph)
+
+    def triples(self, triple, context=None):
+        return self.store.triples(triple, context)
+
+    def __len__(self, context=None):
+        return self.store.__len__(context)
+
+    def contexts(self, triple=None):
+        return self.store.contexts(triple)
+
+    def bind(self, *args, **kwargs):
+        return self.store.bind(*args, **kwargs)
+
+    def prefix(self, namespace):
+        return self.store.prefix(namespace)
+
+    def namespace(self, prefix):
+        return self.store.namespace(prefix)
+
+    def namespaces(self):
+        return self.store.namespaces()
+
+    def commit(self):
+        self.store.commit()
+
+    def rollback(self):
+        self.store.rollback()
+
+class _Changes(object):
+    """
+    Collects the (s, p, o) triples added and removed for the
+    change_hooks, only those with the given predicates unless these are
+    None, and passes all quads on to the journal, if there is one. It
+    is the recorder of a _RecordingStore.
+    """
+
+    def __init__(self, predicates, journal):
+        self.predicates = predicates
+        self.journal = journal
+        self.added = []
+        self.removed = []
+
+    def _collect(self, into, quads):
+        predicates = self.predicates
+        into.extend((s, p, o) for s, p, o, _ in quads
+                    if predicates is None or p in predicates)
+
+    def add(self, quads):
+        self._collect(self.added, quads)
+        if self.journal is not None:
+            self.journal.add(quads)
+
+    def remove(self, quads):
+        self._collect(self.removed, quads)
+        if self.journal is not None:
+            self.journal.remove(quads)
+
+    def create(self, identifier):
+        if self.journal is not None:
+            self.journal.create(identifier)
+
+    def drop(self, identifier):
+        if self.journal is not None:
+            self.journal.drop(identifier)
+
+    def clearing(self, graph):
+        """The triples of graph are about to be removed, the journal
+        is told by the caller"""
+        if self.predicates is None:
+            self.removed.extend(graph)
+        else:
+            for p in self.predicates:
+                self.removed.extend(graph.triples((None, p, None)))
+
+    def abort(self):
+        """What was collected was rolled back"""
+        self.added = []
+        self.removed = []
+        if self.journal is not None:
+            self.journal.abort()
+
+def _view(ds, store):
+    """A graph like ds, over another store"""
+    if isinstance(ds, rdflib.Dataset):
+        view = rdflib.Dataset(store=store, default_union=ds.default_union)
+    elif isinstance(ds, rdflib.ConjunctiveGraph):
+        view = rdflib.ConjunctiveGraph(store=store, identifier=ds.default_context.identifier)
+        view.default_union = ds.default_union
+    else:
+        view = rdflib.Graph(store=store, identifier=ds.identifier)
+    return view
+
 class GenericEndpoint:
     """
     This is an implementation of the SPAQL 1.1 Protocol and SPARQL 1.1
@@ -13,7 +194,9 @@ class GenericEndpoint:
     frameworks.
     """
 
-    def __init__(self, ds, coin_url):
+    def __init__(self, ds, coin_url, query_cache=None, prepared_cache=None, lock=None,
+                 cursors=None, metrics=None, update_batch=100, update_delay=0,
+                 graph_cache=None, parse_pool=None, journal=None):
         """
         :argument:ds: The dataset to be used. Must be a Dataset (recommeded),
         ConjunctiveGraph or Graph. In case of a Graph, it is served as
@@ -21,26 +204,372 @@ class GenericEndpoint:
         :argument:coin_url: A function that takes no arguments and outputs
         an URI for a fresh graph. This is used when graph_identifier is
         None and neither 'default' nor 'graph' can be found in args.
+        :argument:query_cache: An optional caches.LRUCache for serialized
+        query results, see query_key.
+        :argument:prepared_cache: An optional caches.LRUCache for parsed
+        and translated queries, see prepare.
+        :argument:lock: The rwlock.ReadWriteLock guarding ds, a new
+        one is created if not given. Graph store requests take it
+        themselves, queries must be evaluated holding it for reading.
+        :argument:cursors: An optional cursors.CursorStore for paging
+        through SELECT results.
+        :argument:metrics: An optional metrics.Metrics recording the
+        time spent in the phases of the requests, see timer.
+        :argument:update_batch: Maximum number of updates applied
+        together, see update.
+        :argument:update_delay: Seconds to wait for more updates before
+        applying a batch.
+        :argument:graph_cache: An optional caches.SpillingLRUCache for
+        graphs serialized by graph store GET requests. An entry is
+        dropped when its graph is modified.
+        :argument:parse_pool: The parsepool.ParsePool parsing the parts
+        of multipart/form-data requests. If not given, they are parsed
+        one after the other.
+        :argument:journal: An optional journal.Journal, to which the
+        modifications are written. It must have been started.
         """
         self.ds = ds
         self.coin_url = coin_url
+        self.query_cache = query_cache
+        self.prepared_cache = prepared_cache
+        self.lock = lock or ReadWriteLock()
+        self.cursors = cursors
+        self.metrics = metrics
+        self.graph_cache = graph_cache
+        self.parse_pool = parse_pool or ParsePool(workers=0)
+        self.journal = journal
+        # Called holding the write lock before the dataset is modified
+        self.write_hooks = []
+        if cursors is not None:
+            self.write_hooks.append(cursors.spill_all)
+        # Called holding the write lock after the dataset was modified,
+        # with the lists of (s, p, o) triples added and removed, or
+        # None for both if they are not known, see notify_changed. A
+        # hook with a predicates attribute (a set) only needs the
+        # triples with these predicates.
+        self.change_hooks = []
+        self.version = 0
+        # identifiers of the named graphs, None until needed, and
+        # GraphMetadata by graph identifier (or DEFAULT)
+        self._graph_ids = None
+        self._graph_meta = {}
+        self._forgotten = time.time()
+        # the version is only unique within one process
+        self._epoch = uuid.uuid4().hex
+        self.updates = Batcher(self._apply_updates, update_batch, update_delay,
+                               guard=self.lock.writing)
+        self._namespaces = None
+        self._namespaces_version = None
 
     DEFAULT = 'DEFAULT'
 
     RESULT_GRAPH = 0
 
+    RESULT_DATASET = 1
+
+    RESULT_QUADS = 2
+
+    MUTATING_METHODS = ('PUT', 'POST', 'DELETE')
+
+    BINDING_PREFIX = '$'
+
+    INGEST_BATCHSIZE = bulkload.BATCHSIZE
+
+    # responses are written out before they are sent, see _stream_graph
+    SPOOL_BYTES = streaming.SPOOL_BYTES
+
+    # all serializers registered with rdflib, these last
+    GRAPH_FORMATS = mimeutils.graph_mimetypes(
+        ['application/n-triples', 'text/n3', 'text/turtle', 'application/rdf+xml'])
+
+    # n-quads first, so that it is never chosen by a wildcard
+    DATASET_FORMATS = ['application/n-quads'] + GRAPH_FORMATS
+
+    QUAD_FORMATS = ['application/trig', 'application/n-quads']
+
+    def changed(self):
+        """Increases the dataset version. This is done for every
+        modifying graph store request, but it must be called by the
+        application if it modifies the dataset itself (while holding
+        self.lock for writing). The index of graph identifiers and the
+        metadata of the graphs are then rebuilt when they are needed
+        next, all graphs count as modified now."""
+        self.version += 1
+        self._forget()
+        self.notify_changed(None, None)
+
+    def notify_changed(self, added, removed):
+        """Calls the change_hooks with the triples added to and removed
+        from the dataset. added and removed are None if anything may
+        have changed. Triples may be listed that were already there, or
+        are still there in another graph."""
+        for hook in self.change_hooks:
+            hook(added, removed)
+
+    def _changes(self):
+        # The _Changes of a modification, None if neither the journal
+        # nor the change_hooks need them
+        if not self.change_hooks and self.journal is None:
+            return None
+        predicates = set()
+        for hook in self.change_hooks:
+            if getattr(hook, "predicates", None) is None:
+                predicates = None
+                break
+            predicates.update(hook.predicates)
+        return _Changes(predicates, self.journal)
+
+    def _forget(self):
+        self._graph_ids = None
+        self._graph_meta = {}
+        self._forgotten = time.time()
+        if self.graph_cache is not None:
+            # the statistics are served on /metrics
+            self.graph_cache.clear(keep_statistics=True)
+
+    def has_graph(self, identifier):
+        """Whether the dataset has a named graph identifier. The
+        identifiers are indexed the first time, and the index is kept up
+        to date by graph store requests."""
+        graph_ids = self._graph_ids
+        if graph_ids is None:
+            # concurrent readers may both build it, which is harmless
+            graph_ids = set(g.identifier for g in self.ds.contexts())
+            self._graph_ids = graph_ids
+        return identifier in graph_ids
+
+    def _graph_added(self, identifier):
+        if self._graph_ids is not None and identifier != self.DEFAULT:
+            self._graph_ids.add(identifier)
+
+    def _graph_removed(self, identifier):
+        if self._graph_ids is not None:
+            self._graph_ids.discard(identifier)
+
+    def _graphs_modified(self, identifiers):
+        # after the version was increased
+        now = time.time()
+        if identifiers and self.ds.default_union:
+            # the union changes with every graph
+            identifiers = set(identifiers) | set([self.DEFAULT])
+        for identifier in identifiers:
+            self._graph_meta[identifier] = GraphMetadata(self.version, now)
+            if self.graph_cache is not None:
+                for format in self.DATASET_FORMATS:
+                    self.graph_cache.discard((identifier, format))
+
+    def _metadata(self, identifier, graph):
+        # graph is where the triples are counted
+        meta = self._graph_meta.get(identifier)
+        if meta is None:
+            meta = self._graph_meta.setdefault(
+                identifier, GraphMetadata(self.version, self._forgotten))
+        if meta.triples is None:
+            meta.triples = len(graph)
+        return meta
+
+    def graph_etag(self, identifier, meta, format):
+        """The weak ETag of the graph serialized in format, it changes
+        with every modification of the graph"""
+        h = hashlib.sha1()
+        for x in (self._epoch, identifier, meta.version, format):
+            h.update(unicode(x).encode("utf-8"))
+        return 'W/"%s"' % h.hexdigest()
+
+    def init_bindings(self, args):
+        """Returns the initial bindings given in the request parameters.
+        A parameter ``$name`` binds the variable ``?name`` to the value,
+        which is given in N3 syntax (e.g. ``<http://example.org/>``,
+        ``"chat"@fr`` or ``42``). Prefixes bound in the dataset can be
+        used."""
+        bindings = {}
+        for k in args:
+            if k.startswith(self.BINDING_PREFIX) and len(k) > len(self.BINDING_PREFIX):
+                var = rdflib.Variable(k[len(self.BINDING_PREFIX):])
+                bindings[var] = from_n3(args[k], nsm=self.ds.namespace_manager)
+        return bindings
+
+    def timer(self, form=None, format=None):
+        """Returns a metrics.RequestTimer for a request, which records
+        into self.metrics when it is finished."""
+        return RequestTimer(self.metrics, form, format)
+
+    def _prepare(self, query, namespaces, timer):
+        with timer.phase("parse"):
+            with _parsing:
+                parsetree = parseQuery(query)
+        with timer.phase("algebra"):
+            return translateQuery(parsetree, initNs=namespaces)
+
+    def prepare(self, query, timer=None):
+        """Returns the parsed and translated query. With a
+        prepared_cache, queries are only parsed the first time they are
+        seen. As in Graph.query, the namespaces bound in the dataset can be
+        used in the query, so the cache is emptied when the bindings
+        change."""
+        timer = timer or self.timer()
+        if self.prepared_cache is None:
+            return self._prepare(query, dict(self.ds.namespaces()), timer)
+
+        if self._namespaces_version != self.version:
+            namespaces = dict(self.ds.namespaces())
+            if namespaces != self._namespaces:
+                self.prepared_cache.clear(keep_statistics=True)
+                self._namespaces = namespaces
+            self._namespaces_version = self.version
+
+        prepared = self.prepared_cache.get(query)
+        if prepared is None:
+            prepared = self._prepare(query, self._namespaces, timer)
+            self.prepared_cache.put(query, prepared)
+        return prepared
+
+    def query(self, query, initBindings=None, timer=None):
+        """Evaluates the query string against the dataset and returns the
+        rdflib result. The form of the query is set on the timer, and
+        the rows of SELECT results, which are computed while they are
+        consumed, count as evaluation time."""
+        timer = timer or self.timer()
+        prepared = self.prepare(query, timer)
+        # SelectQuery -> SELECT
+        timer.form = prepared.algebra.name[:-len("Query")].upper()
+        with timer.phase("evaluation"):
+            result = self.ds.query(prepared, initBindings=initBindings or {})
+        if getattr(result, "_genbindings", None) is not None:
+            result._genbindings = timer.rows(result._genbindings)
+        return result
+
+    def update(self, update, initBindings=None, timer=None):
+        """Applies the SPARQL 1.1 Update string to the dataset and
+        returns when it is done, raising the exceptions of the update.
+
+        Updates arriving while others are applied are queued and then
+        applied together, taking the write lock once and, if the store
+        is transactional, in one transaction. Thus many small writers
+        do not wait for the lock one after the other."""
+        timer = timer or self.timer("UPDATE")
+        with timer.phase("parse"):
+            with _parsing:
+                parsetree = parseUpdate(update)
+        start = time.time()
+        seconds = self.updates.submit((parsetree, initBindings or {}, update))
+        timer.add("evaluation", seconds)
+        timer.add("wait", time.time() - start - seconds)
+        timer.finish()
+        self._snapshot_if_due()
+
+    def _snapshot_if_due(self):
+        # called after a modification, without holding the lock
+        if self.journal is not None and self.journal.due():
+            with self.lock.reading():
+                self.journal.snapshot()
+
+    def _apply_updates(self, updates):
+        """Applies a batch of parsed updates in order, returning the
+        time each took and its exception, if it failed. A failed update
+        does not affect the others, on a transactional store the batch
+        is rolled back and applied again without it. Called by
+        self.updates holding the write lock."""
+        results = [None] * len(updates)
+        transactional = self.ds.store.transaction_aware
+        journal = self.journal
+        changes = self._changes()
+        target = self.ds
+        if changes is not None:
+            # what the updates did is journaled, not the updates, which
+            # may not give the same result when applied again, and the
+            # change_hooks get the triples
+            target = _view(self.ds, _RecordingStore(self.ds.store, changes))
+        for hook in self.write_hooks:
+            hook()
+        try:
+            # translated here, where the namespaces cannot change
+            namespaces = dict(self.ds.namespaces())
+            pending = range(len(updates))
+            while True:
+                failed = []
+                for i in pending:
+                    parsetree, bindings, _ = updates[i]
+                    start = time.time()
+                    try:
+                        update = translateUpdate(parsetree, initNs=namespaces)
+                        target.update(update, initBindings=bindings)
+                        results[i] = (time.time() - start, None)
+                    except Exception:
+                        results[i] = (time.time() - start, sys.exc_info())
+                        failed.append(i)
+                if not failed or not transactional:
+                    break
+                self.ds.rollback()
+                if changes is not None:
+                    changes.abort()
+                pending = [i for i in pending if i not in failed]
+            if transactional:
+                self.ds.commit()
+        finally:
+            # updates may create and drop graphs
+            self.version += 1
+            self._forget()
+            if journal is not None:
+                journal.commit()
+            if changes is not None and (changes.added or changes.removed):
+                self.notify_changed(changes.added, changes.removed)
+        return results
+
+    def query_key(self, query, format, initBindings=None):
+        """Returns the key under which the result of query serialized
+        in format is cached. The key includes the current dataset version,
+        so results computed before a modification are never served
+        afterwards."""
+        bindings = tuple(sorted(initBindings.items())) if initBindings else ()
+        return (_normalize_query(query), bindings, format, self.version)
+
+    def cached_result(self, key):
+        """Returns the cached serialized result or None"""
+        if self.query_cache is None:
+            return None
+        return self.query_cache.get(key)
+
+    def cache_result(self, key, data):
+        if self.query_cache is not None:
+            self.query_cache.put(key, data)
+
+    def cache_chunks(self, key, chunks):
+        """Passes through the chunks of a serialized result and caches
+        the concatenation when the iteration completes, unless it is
+        too large for the cache."""
+        if self.query_cache is None:
+            for chunk in chunks:
+                yield chunk
+            return
+        buf = []
+        size = 0
+        for chunk in chunks:
+            if buf is not None:
+                buf.append(chunk)
+                size += len(chunk)
+                if not self.query_cache.fits(size):
+                    buf = None
+            yield chunk
+        if buf is not None:
+            self.query_cache.put(key, b"".join(buf))
+
     def negotiate(self, resulttype, accept_header):
-        #TODO: Find all mimetypes supported by the serializers
-        #automatically instead of hardcoded
-        import logging
+        """The format and content type for a result of resulttype, the
+        serialization preferred by accept_header"""
         if resulttype == self.RESULT_GRAPH:
-            available = ['application/n-triples', 'text/n3', 'text/turtle', 'application/rdf+xml']
+            available = self.GRAPH_FORMATS
+        elif resulttype == self.RESULT_DATASET:
+            available = self.DATASET_FORMATS
+        elif resulttype == self.RESULT_QUADS:
+            available = self.QUAD_FORMATS
         assert available, "Invalid resulttype"
-        import mimeutils
-        best = mimeutils.best_match(available, accept_header) or available[-1]
+        # the negotiator caches the result for each header
+        best = mimeutils.negotiator(available, available[-1]).best_match(accept_header)
         return best, best
 
-    def graph_store(self, method, graph_identifier, args, body, mimetype, accept_header):
+    def graph_store(self, method, graph_identifier, args, body, mimetype, accept_header,
+                    if_none_match=None):
         """Handles a request according to the SPARQL 1.1 graph store
         protocol.
 
@@ -50,11 +579,21 @@ class GenericEndpoint:
         special value GenericEndpoint.DEFAULT denotes the default graph. 
         :argument:args: A dict containing all URL parameters
         :argument:body: The request body as list of dicts if the
-        content-type is multipart/form-data, otherwise a string.
+        content-type is multipart/form-data, otherwise a string or a
+        file-like object. A file-like object is copied to a temporary
+        file before the write lock is taken, so that a slow client does
+        not hold it. N-Triples and N-Quads are read from it in batches
+        (see bulkload), and the response headers report the throughput. The parts of multipart/form-data bodies are parsed
+        in parallel by the parse_pool before the write lock is taken,
+        if a part cannot be parsed, nothing is added and the response
+        is 400, with one line for each failed part.
         :argument:mimetype: The mime type part (i.e. without charset) of
         the request body
         :argument:accept_header: The accept header value as given by
         the client. This is required for content negotiation.
+        :argument:if_none_match: The If-None-Match header value as given
+        by the client, a GET or HEAD is answered with 304 if it names
+        the ETag of the graph.
 
         :Returns:
 
@@ -64,7 +603,25 @@ class GenericEndpoint:
         at least 400), then the body only consists of a error message
         as string. In this case, the caller is responsible to create a
         proper status body. If the status code is 201 or 204, the body
-        is None.
+        is None. Graphs requested as N-Triples (or N-Quads, for the
+        default graph of a ConjunctiveGraph that is the union of all
+        graphs) are returned as an iterator over chunks. They are
+        written to a temporary file holding the read lock taken for the
+        metadata and ETag, so that the body is of the same version, and
+        read from it while the iterator is consumed. It must be consumed
+        or closed. The iterator is only returned once the whole graph was
+        written, a large graph is not sent any earlier than it would be
+        in one piece.
+
+        With a graph_cache, serialized graphs are kept until the graph
+        is modified, large ones in files, from which they are streamed.
+
+        GET and HEAD responses carry an ETag and Last-Modified header,
+        and X-Graph-Triples with the number of triples. They are
+        answered from metadata kept for each graph, which is updated by
+        the modifying requests, a HEAD does not serialize the graph.
+        Its Content-Length is given if the graph has been serialized in
+        the format since it was modified.
 
         This method can through exceptions. If this happens, it is always an
         internal error.
@@ -79,11 +636,143 @@ class GenericEndpoint:
             else:
                 return (400, dict(), "Missing URL query string parameter 'graph' or 'default'")
 
+        # the format is replaced by the negotiated one for GET
+        timer = self.timer(method, mimetype)
+        start = time.time()
+        if method == 'POST' and mimetype == "multipart/form-data":
+            with timer.phase("parse"):
+                parsed = self.parse_pool.parse(
+                    [(part['data'], part['mimetype']) for part in body])
+            errors = ["Part %d (%s): %s" % (i + 1, part['mimetype'], error)
+                      for i, (part, (_, error)) in enumerate(zip(body, parsed))
+                      if error is not None]
+            if errors:
+                timer.finish()
+                return (400, dict(), "\n".join(errors))
+            body = [quads for quads, _ in parsed]
+        if method in self.MUTATING_METHODS:
+            body = self._spool_body(body)
+            try:
+                with self.lock.writing():
+                    for hook in self.write_hooks:
+                        hook()
+                    response = self._graph_store(method, graph_identifier, body, mimetype,
+                                                 accept_header, if_none_match, timer)
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+        else:
+            with self.lock.reading():
+                response = self._graph_store(method, graph_identifier, body, mimetype,
+                                             accept_header, if_none_match, timer)
+        timer.add("evaluation", time.time() - start - timer.total())
+        if method in self.MUTATING_METHODS:
+            self._snapshot_if_due()
+        code, headers, data = response
+        if data is not None and not isinstance(data, basestring):
+            return code, headers, self._stream_graph(data, timer)
+        timer.finish()
+        return response
+
+    def dataset(self, method, body, mimetype, accept_header):
+        """Dumps or loads all graphs of the dataset at once, for backups.
+
+        :argument:method: 'GET' streams the dataset as N-Quads or TriG,
+        'PUT' replaces the dataset with the body, 'POST' adds the body
+        to it.
+        :argument:body: A string or file-like object, which is copied
+        to a temporary file before the write lock is taken. N-Quads are
+        read from it in batches, see bulkload.
+        :argument:mimetype: The mime type of the body
+        :argument:accept_header: The accept header given by the client
+
+        :Returns: like graph_store, a GET returns an iterator over the
+        chunks of the dump. It is written out holding the read lock, and
+        sent from a temporary file once the lock is released.
+        """
+        if not self.ds.context_aware:
+            return (400, dict(), "Named graphs not supported")
+        timer = self.timer(method, mimetype)
+
+        if method == 'GET' or method == 'HEAD':
+            format, content_type = self.negotiate(self.RESULT_QUADS, accept_header)
+            timer.format = format
+            with self.lock.reading():
+                spooled = self._spool(streaming.GRAPH_SERIALIZERS[format](self.ds), timer)
+            return (200, {"Content-type": content_type}, self._stream_graph(spooled, timer))
+
+        if method not in ('PUT', 'POST'):
+            return (405, {"Allow": "GET, HEAD, POST, PUT"}, "Method %s not supported" % method)
+        if mimetype not in bulkload.FORMATS and mimetype != 'application/trig':
+            return (415, dict(), "Datasets are loaded from N-Quads or TriG")
+
+        start = time.time()
+        headers = dict()
+        body = self._spool_body(body)
+        with self.lock.writing():
+            for hook in self.write_hooks:
+                hook()
+            try:
+                if method == 'PUT':
+                    for context in list(self.ds.contexts()):
+                        if hasattr(self.ds, "remove_graph"):
+                            self.ds.remove_graph(context)
+                        else:
+                            self.ds.remove((None, None, None, context))
+                with timer.phase("parse"):
+                    if mimetype in bulkload.FORMATS:
+                        headers = bulkload.load(body, self.ds.default_context, mimetype,
+                                                self.INGEST_BATCHSIZE).headers()
+                    else:
+                        if hasattr(body, "read"):
+                            body = body.read()
+                        self.ds.default_context.parse(data=body, format="trig")
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+                self.changed()
+                if self.journal is not None:
+                    # cheaper than journaling the whole dataset
+                    self.journal.snapshot()
+        timer.add("evaluation", time.time() - start - timer.total())
+        timer.finish()
+        return (204, headers, None)
+
+    def _spool_body(self, body):
+        # Reads a request body from the client into a temporary file,
+        # before the write lock is taken. A temporary file is used as
+        # it is, e.g. the ASGI app spools the body as it arrives.
+        if not hasattr(body, "read") or isinstance(body, tempfile.SpooledTemporaryFile):
+            return body
+        return streaming.spool(iter(lambda: body.read(streaming.CHUNKSIZE), b""),
+                               self.SPOOL_BYTES)
+
+    def _spool(self, chunks, timer):
+        # Writes the chunks to a temporary file (in memory up to
+        # SPOOL_BYTES), the caller holds the read lock
+        return streaming.spool(timer.chunks(chunks), self.SPOOL_BYTES)
+
+    def _stream_graph(self, chunks, timer):
+        # Sends a spooled file or the chunks of a file of the
+        # graph_cache, without the lock, so a slow client does not hold
+        # off writers
+        if hasattr(chunks, "read"):
+            chunks = streaming.read_chunks(chunks)
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            timer.finish()
+
+    def _graph_store(self, method, graph_identifier, body, mimetype, accept_header,
+                     if_none_match, timer):
         existed = False
+        # the graphs modified by the request
+        touched = set()
         if graph_identifier == self.DEFAULT:
             existed = True
         elif graph_identifier and self.ds.context_aware:
-            existed = graph_identifier in {g.identifier for g in self.ds.contexts()}
+            existed = self.has_graph(graph_identifier)
 
         def get_graph(identifier):
             # Creates the graph if it does not already exist and returns
@@ -101,11 +790,23 @@ class GenericEndpoint:
             else:
                 raise NamedGraphsNotSupported()
 
+        def counted_graph(identifier):
+            # The graph whose triples are those of the response
+            if identifier == self.DEFAULT and self.ds.context_aware \
+                    and not self.ds.default_union:
+                return self.ds.default_context
+            return get_graph(identifier)
+
+        # the triples for the change_hooks
+        changes = self._changes() if method in self.MUTATING_METHODS else None
+
         def clear_graph(identifier):
+            if identifier == self.DEFAULT and self.ds.default_union:
+                raise DefaultGraphReadOnly()
+            if changes is not None:
+                changes.clearing(counted_graph(identifier))
             if identifier == self.DEFAULT:
-                if self.ds.default_union:
-                    raise DefaultGraphReadOnly()
-                elif self.ds.context_aware:
+                if self.ds.context_aware:
                     self.ds.default_context.remove((None,None,None))
                 else:
                     self.ds.remove((None,None,None))
@@ -118,20 +819,55 @@ class GenericEndpoint:
             if identifier == self.DEFAULT and self.ds.default_union:
                 raise DefaultGraphReadOnly()
             elif hasattr(self.ds, "remove_graph"):
+                if changes is not None:
+                    changes.clearing(get_graph(identifier))
                 self.ds.remove_graph(get_graph(identifier))
             else:
                 clear_graph(identifier)
 
+        journal = self.journal
+        # the triples added go to the journal and the change_hooks
+        listener = changes.add if changes is not None else None
+
         def parseInto(target, data, format):
             # Makes shure that the for ConjucntiveGraph and Dataset we
             # parse into the default graph instead of into a fresh
             # graph.
+            # Line based formats are loaded in batches, returning a
+            # bulkload.LoadResult
             if target.default_union:
                 raise DefaultGraphReadOnly()
             if target.context_aware:
-                target.default_context.parse(data=data, format=format)
-            else:
-                target.parse(data=data, format=format)
+                target = target.default_context
+            with timer.phase("parse"):
+                if format in bulkload.FORMATS:
+                    result = bulkload.load(data, target, format, self.INGEST_BATCHSIZE,
+                                           listener)
+                    for identifier in result.contexts:
+                        self._graph_added(identifier)
+                    touched.update(result.contexts)
+                    return result
+                if hasattr(data, "read"):
+                    data = data.read()
+                if listener is None:
+                    target.parse(data=data, format=format)
+                    return
+                # the journal and the change_hooks need the quads, with
+                # the graphs named in TriG or TriX
+                quads = parsepool.parse(data, format)
+            return addInto(target, quads)
+
+        def addInto(target, quads):
+            # Adds the quads parsed by the parse_pool like parseInto
+            if target.default_union:
+                raise DefaultGraphReadOnly()
+            if target.context_aware:
+                target = target.default_context
+            result = bulkload.add(quads, target, listener)
+            for identifier in result.contexts:
+                self._graph_added(identifier)
+            touched.update(result.contexts)
+            return result
 
         try:
 
@@ -139,12 +875,20 @@ class GenericEndpoint:
                 if existed:
                     clear_graph(graph_identifier)
                 target = get_graph(graph_identifier)
-                parseInto(target, data=body, format=mimetype)
-                response = (204 if existed else 201, dict(), None)
+                self._graph_added(graph_identifier)
+                touched.add(graph_identifier)
+                if journal is not None:
+                    journal.clear(graph_identifier)
+                loaded = parseInto(target, data=body, format=mimetype)
+                response = (204 if existed else 201, _load_headers([loaded]), None)
 
             elif method == 'DELETE':
                 if existed:
+                    touched.add(graph_identifier)
                     remove_graph(graph_identifier)
+                    self._graph_removed(graph_identifier)
+                    if journal is not None:
+                        journal.drop(graph_identifier)
                     response = (204, dict(), None)
                 else:
                     response = (404, dict(), 'Graph %s not found' % graph_identifier)
@@ -158,20 +902,45 @@ class GenericEndpoint:
                     graph_identifier = rdflib.URIRef(url)
                     additional_headers['location'] = url
                 target = get_graph(graph_identifier)
+                self._graph_added(graph_identifier)
+                touched.add(graph_identifier)
+                if journal is not None:
+                    journal.create(graph_identifier)
                 if mimetype == "multipart/form-data":
-                    for post_item in body:
-                        target = get_graph(graph_identifier)
-                        parseInto(target, data=post_item['data'], format=post_item['mimetype'])
+                    # parsed already, see graph_store
+                    loaded = [addInto(target, quads) for quads in body]
                 else:
-                    parseInto(target, data=body, format=mimetype)
+                    loaded = [parseInto(target, data=body, format=mimetype)]
+                additional_headers.update(_load_headers(loaded))
                 response = (204 if existed else 201, additional_headers, None)
 
             elif method == 'GET' or method == 'HEAD':
                 if existed:
-                    format, content_type = self.negotiate(self.RESULT_GRAPH, accept_header)
+                    resulttype = self.RESULT_GRAPH
+                    if graph_identifier == self.DEFAULT and self.ds.context_aware \
+                            and self.ds.default_union:
+                        resulttype = self.RESULT_DATASET
+                    format, content_type = self.negotiate(resulttype, accept_header)
                     if content_type.startswith('text/'): content_type += "; charset=utf-8"
-                    headers = {"Content-type": content_type}
-                    response = (200, headers, get_graph(graph_identifier).serialize(format=format))
+                    timer.format = format
+                    meta = self._metadata(graph_identifier, counted_graph(graph_identifier))
+                    etag = self.graph_etag(graph_identifier, meta, format)
+                    headers = {"ETag": etag,
+                               "Last-Modified": formatdate(meta.modified, usegmt=True)}
+                    if _etag_matches(if_none_match, etag):
+                        response = (304, headers, None)
+                    else:
+                        headers["Content-type"] = content_type
+                        headers["X-Graph-Triples"] = str(meta.triples)
+                        if method == 'HEAD':
+                            if format in meta.sizes:
+                                headers["Content-Length"] = str(meta.sizes[format])
+                            data = None
+                        else:
+                            data = self._serialize_graph(graph_identifier,
+                                                         get_graph(graph_identifier),
+                                                         format, meta, timer)
+                        response = (200, headers, data)
                 else:
                     response = (404, dict(), 'Graph %s not found' % graph_identifier)
 
@@ -182,6 +951,86 @@ class GenericEndpoint:
             response = (400, dict(), "Default graph is read only because it is the uion")
         except NamedGraphsNotSupported:
             response = (400, dict(), "Named graphs not supported")
+        except:
+            # The request may have changed graphs partially
+            self._forget()
+            raise
+        finally:
+            if method in self.MUTATING_METHODS:
+                self.version += 1
+                self._graphs_modified(touched)
+                if journal is not None:
+                    # what was done, also if it failed half way
+                    journal.commit()
+                if changes is not None and (changes.added or changes.removed):
+                    self.notify_changed(changes.added, changes.removed)
 
         return response
 
+    def _serialize_graph(self, identifier, graph, format, meta, timer):
+        # Returns the graph serialized in format, from the graph_cache
+        # if it is there, or an iterator over its chunks
+        key = (identifier, format)
+        if self.graph_cache is not None:
+            data = self.graph_cache.open(key)
+            if data is not None:
+                return data
+        if format in streaming.GRAPH_SERIALIZERS:
+            data = _measured(streaming.GRAPH_SERIALIZERS[format](graph), meta.sizes, format)
+            if self.graph_cache is not None:
+                data = self.graph_cache.cache_chunks(key, data)
+            # still holding the read lock taken for meta, sent by
+            # _stream_graph
+            return self._spool(data, timer)
+        with timer.phase("serialization"):
+            data = graph.serialize(format=format)
+        meta.sizes[format] = len(data)
+        if self.graph_cache is not None:
+            self.graph_cache.put(key, data)
+        return data
+
+def _load_headers(results):
+    """The headers reporting the bulk loads among results"""
+    results = [r for r in results if r is not None]
+    if not results:
+        return dict()
+    # not chained, which 2to3 would not convert
+    total = reduce(lambda a, b: a + b, results)
+    return total.headers()
+
+def _measured(chunks, sizes, format):
+    """Passes through the chunks, recording their total length in
+    sizes if they are all consumed"""
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    sizes[format] = size
+
+_r_etag = re.compile(r'(?:W/)?"([^"]*)"|\*')
+
+def _etag_matches(header, etag):
+    """Whether the If-None-Match header value names etag, comparing
+    weakly"""
+    if not header:
+        return False
+    tag = _r_etag.match(etag).group(1)
+    for m in _r_etag.finditer(header):
+        if m.group() == "*" or m.group(1) == tag:
+            return True
+    return False
+
+# Matches string literals, in which whitespace is significant
+_r_quoted = re.compile(r'''("""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^\'\\]|\\.|\'(?!\'\'))*\'\'\'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\')''')
+_r_space = re.compile(r"\s+")
+
+def _normalize_query(query):
+    """Collapses whitespace outside of string literals, so that
+    queries differing only in formatting share a cache entry. Line breaks
+    are kept because they end comments."""
+    parts = _r_quoted.split(query.strip())
+    # the split puts the quoted parts at odd indices
+    for i in range(0, len(parts), 2):
+        parts[i] = _r_space.sub(lambda m: "\n" if "\n" in m.group() else " ", parts[i])
+    return "".join(parts)
+
@@ -117,6 +117,15 @@ class HTMLResultSerializer(ResultSerializer):
             template = env.from_string(SELECT_TEMPLATE)
             stream.write(template.render(result=self.result))
 
+def generate_select(vars, bindings):
+    """
+    Render the table for a SELECT result piece by piece. Returns a
+    generator of unicode strings, bindings may be any iterable and
+    is consumed lazily.
+    """
+    template = env.from_string(SELECT_TEMPLATE)
+    return template.generate(result={'vars': vars, 'bindings': bindings})
+
 
             
 
@@ -0,0 +1,129 @@
+"""
+Conditional GET and response compression for the Flask blueprints.
+
+ETags are derived from the dataset version of the
+:py:class:`GenericEndpoint` and the request, i.e. they change whenever
+the data is modified through the graph store. Since they can be computed
+before a view runs, a client re-requesting unchanged data gets a 304 Not
+Modified without the query or the serialization being run again.
+
+Responses are compressed with gzip, or with brotli if the `brotli
+<https://pypi.python.org/pypi/Brotli>`_ module is installed, according
+to the client's Accept-Encoding. Streamed responses are compressed while
+they are streamed.
+
+Both are configured with ``app.config["etags"]`` and
+``app.config["compression"]`` (True by default), and
+``app.config["compression_level"]``.
+"""
+
+import hashlib
+import uuid
+import zlib
+
+from flask import request, g, current_app, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli=None
+
+__all__ = [ 'not_modified', 'finish' ]
+
+# The dataset version is only unique within one process
+_EPOCH=uuid.uuid4().hex
+
+# compressing these again does not pay off
+_UNCOMPRESSIBLE=("image/png", "image/jpeg", "image/gif", "application/pdf",
+                 "application/zip", "application/gzip")
+
+MIN_SIZE=500
+"""Responses smaller than that are not compressed (unless streamed)"""
+
+def _etag():
+    h=hashlib.sha1()
+    for x in (_EPOCH, g.generic.version, request.method, request.url,
+              request.headers.get("Accept", ""), request.headers.get("Cookie", "")):
+        h.update(unicode(x).encode("utf-8"))
+    return h.hexdigest()
+
+def not_modified():
+    """
+    To be called before a request is dispatched. Computes the ETag of
+    the response and returns a 304 response if the client has it
+    already, None otherwise.
+    """
+    if request.method not in ('GET', 'HEAD') or not current_app.config.get("etags", True):
+        return None
+    g.etag=_etag()
+    # weak, the bytes differ with the content-encoding
+    if request.if_none_match.contains_weak(g.etag):
+        response=Response(status=304)
+        response.set_etag(g.etag, weak=True)
+        return response
+    return None
+
+def _gzip(chunks, level):
+    c=zlib.compressobj(level, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+    for chunk in chunks:
+        data=c.compress(chunk)
+        # flush, so that the client gets what has been computed so far
+        data+=c.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield c.flush()
+
+def _brotli(chunks, level):
+    c=brotli.Compressor(quality=min(level, 11))
+    for chunk in chunks:
+        data=c.process(chunk)+c.flush()
+        if data:
+            yield data
+    yield c.finish()
+
+# in order of preference
+_ENCODERS=[("gzip", _gzip)]
+if brotli is not None:
+    _ENCODERS.insert(0, ("br", _brotli))
+
+def _compress(response):
+    if response.status_code!=200 or response.direct_passthrough or \
+            "Content-Encoding" in response.headers or \
+            response.mimetype in _UNCOMPRESSIBLE:
+        return response
+    if request.method=="HEAD":
+        # the headers of the GET, whose length may be given
+        size=response.headers.get("Content-Length", type=int)
+        if size is not None and size<MIN_SIZE:
+            return response
+    elif not response.is_streamed and len(response.get_data())<MIN_SIZE:
+        return response
+
+    encoding=request.accept_encodings.best_match([e for e, _ in _ENCODERS])
+    if encoding is None:
+        return response
+    if request.method=="HEAD":
+        # of the uncompressed body
+        response.headers.pop("Content-Length", None)
+        response.headers["Content-Encoding"]=encoding
+        return response
+
+    level=current_app.config.get("compression_level", 6)
+    body=dict(_ENCODERS)[encoding](response.iter_encoded(), level)
+    if response.is_streamed:
+        response.response=body
+    else:
+        response.set_data(b"".join(body))
+    response.headers["Content-Encoding"]=encoding
+    return response
+
+def finish(response):
+    """To be called after a request, adds the ETag and compresses the
+    response"""
+    if response.status_code==200 and g.get("etag"):
+        response.set_etag(g.etag, weak=True)
+    response.vary.add("Accept")
+    if current_app.config.get("compression", True):
+        response.vary.add("Accept-Encoding")
+        response=_compress(response)
+    return response
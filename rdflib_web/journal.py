@@ -0,0 +1,339 @@
+"""
+An append-only journal of the modifications of a served dataset, for
+restarting without parsing the original files again.
+
+The journal directory holds a snapshot of the dataset in N-Quads, and
+the modifications made since then, also in N-Quads: the triples added
+are written as they are, the other operations as comment lines, which
+N-Quads parsers skip::
+
+  #op CLEAR <http://example.org/graph>
+  <http://example.org/s> <http://example.org/p> "o" <http://example.org/graph> .
+  #op COMMIT
+
+``CLEAR`` (clear or create the graph, as by a PUT), ``CREATE`` (a
+POST), and ``DROP`` (a DELETE) are the operations on graphs,
+``DEFAULT`` stands for the default graph. The quads following
+``REMOVE`` were removed, those following ``ADD`` (or any other
+operation) were added. SPARQL Updates are journaled as the quads they
+added and removed, so that functions like ``NOW()`` or ``BNODE()`` are
+not evaluated again. Blank nodes are written with their ids, which
+they keep when the journal is replayed. Journals written by earlier
+versions may hold the text of an update instead (``UPDATE``, given as a
+JSON string), which is applied again.
+
+Only what is followed by ``COMMIT`` is replayed, a request cut short by
+a crash is thus ignored (and followed by ``ABORT`` when the journal is
+continued), as is a batch of updates rolled back.
+
+When the journal grows larger than ``snapshot_bytes``, a new snapshot
+is written and the journal started anew::
+
+  journal=Journal("/var/lib/books", graph)
+  if not journal.restore():
+      graph.parse("books.ttl")
+  journal.start() # writes the first snapshot if there is none
+
+The :py:class:`GenericEndpoint` writes to the journal given to it. With
+``rdfsparqlapp -j <directory>`` or ``rdflodapp -j <directory>``, the
+files given on the commandline are only parsed if the directory does
+not have a snapshot yet.
+
+Modifications of the dataset that do not go through the endpoint are
+not journaled, an application making them should call
+:py:meth:`Journal.snapshot` afterwards.
+"""
+
+import codecs
+import io
+import json
+import os
+import re
+import sys
+import threading
+
+import rdflib
+from rdflib.util import from_n3
+from rdflib.plugins.serializers.nt import _nt_row
+from rdflib.plugins.serializers.nquads import _nq_row
+
+from rdflib_web import bulkload
+
+__all__ = [ 'Journal', 'main' ]
+
+_r_file = re.compile(r"^(snapshot|journal)-(\d+)\.nq$")
+
+class Journal(object):
+    """
+    :argument:directory: Where the snapshots and journals are kept, it
+    is created if necessary
+    :argument:ds: The dataset, a Graph, ConjunctiveGraph or Dataset
+    :argument:snapshot_bytes: Size of the journal after which a new
+    snapshot is taken
+    :argument:sync: Whether to fsync the journal after each
+    modification, so that it survives a crash of the machine, not only
+    of the process
+    """
+
+    def __init__(self, directory, ds, snapshot_bytes=64*1024*1024, sync=False):
+        self.directory = directory
+        self.ds = ds
+        self.snapshot_bytes = snapshot_bytes
+        self.sync = sync
+        if ds.context_aware:
+            self._default = ds.default_context
+        else:
+            self._default = ds
+        self._file = None
+        self._pending = False
+        # whether the quads written now are removals
+        self._removing = False
+        self._snapshotting = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _files(self, kind):
+        # sequence numbers of the files of a kind, ascending
+        numbers = []
+        for name in os.listdir(self.directory):
+            m = _r_file.match(name)
+            if m and m.group(1) == kind:
+                numbers.append(int(m.group(2)))
+        return sorted(numbers)
+
+    def _path(self, kind, number):
+        return os.path.join(self.directory, "%s-%08d.nq" % (kind, number))
+
+    def has_snapshot(self):
+        return bool(self._files("snapshot"))
+
+    def restore(self):
+        """
+        Load the latest snapshot into the dataset and replay the journal
+        written after it. Returns False if there is no snapshot.
+        """
+        snapshots = self._files("snapshot")
+        if not snapshots:
+            return False
+        number = snapshots[-1]
+        with open(self._path("snapshot", number), "rb") as f:
+            self._load(f)
+        for n in self._files("journal"):
+            if n >= number:
+                with open(self._path("journal", n), "rb") as f:
+                    self._replay(f)
+        return True
+
+    def start(self):
+        """Take the first snapshot, if there is none yet. The
+        modifications are journaled from then on."""
+        if not self.has_snapshot():
+            self.snapshot()
+
+    def _load(self, f, graph=None):
+        format = "nquads" if self.ds.context_aware else "nt"
+        bulkload.load(f, self._default if graph is None else graph, format,
+                      keep_bnode_ids=True)
+
+    def _replay(self, f):
+        entry = []
+        lines = []
+        kind = "ADD"
+        for line in codecs.getreader("utf-8")(f):
+            if not line.startswith("#op "):
+                lines.append(line)
+                continue
+            if lines:
+                entry.append((kind, u"".join(lines)))
+                lines = []
+            op, _, arg = line[4:].rstrip("\n").partition(" ")
+            kind = "REMOVE" if op == "REMOVE" else "ADD"
+            if op in ("ADD", "REMOVE"):
+                continue
+            if op == "COMMIT":
+                for op, arg in entry:
+                    self._apply(op, arg)
+                entry = []
+            elif op == "ABORT":
+                entry = []
+            else:
+                entry.append((op, arg))
+
+    def _graph(self, arg):
+        if arg == "DEFAULT":
+            return self._default
+        return self.ds.get_context(from_n3(arg))
+
+    def _apply(self, op, arg):
+        if op == "ADD":
+            self._load(io.BytesIO(arg.encode("utf-8")))
+        elif op == "REMOVE":
+            removed = rdflib.ConjunctiveGraph()
+            self._load(io.BytesIO(arg.encode("utf-8")), removed.default_context)
+            default = removed.default_context.identifier
+            for s, p, o, c in removed.quads((None, None, None, None)):
+                if c.identifier == default:
+                    self._default.remove((s, p, o))
+                else:
+                    self.ds.get_context(c.identifier).remove((s, p, o))
+        elif op in ("CLEAR", "CREATE", "DROP"):
+            graph = self._graph(arg)
+            if op == "DROP" and graph is not self._default and hasattr(self.ds, "remove_graph"):
+                self.ds.remove_graph(graph)
+                return
+            if op != "CREATE":
+                graph.remove((None, None, None))
+            if graph is not self._default and self.ds.store.graph_aware:
+                self.ds.store.add_graph(graph)
+        elif op == "UPDATE":
+            # written by earlier versions
+            update = json.loads(arg)
+            bindings = dict((rdflib.Variable(k), from_n3(v))
+                            for k, v in update["bindings"].items())
+            self.ds.update(update["update"], initBindings=bindings)
+        else:
+            raise ValueError("Unknown journal operation %s" % op)
+
+    def _write(self, text):
+        if self._file is None:
+            path = self._path("journal", (self._files("snapshot") or [0])[-1])
+            if os.path.exists(path) and os.path.getsize(path):
+                # after a crash, the last modification may be incomplete
+                text = u"\n#op ABORT\n" + text
+            self._file = open(path, "ab")
+        self._file.write(text.encode("utf-8"))
+        self._pending = True
+
+    def _op(self, op, arg=None):
+        self._removing = op == "REMOVE"
+        self._write(u"#op %s\n" % op if arg is None else u"#op %s %s\n" % (op, arg))
+
+    def _identifier(self, identifier):
+        if identifier in ("DEFAULT", self._default.identifier):
+            return u"DEFAULT"
+        return identifier.n3()
+
+    def _rows(self, quads):
+        default = self._default.identifier
+        return u"".join(_nt_row((s, p, o)) if c.identifier == default
+                        else _nq_row((s, p, o), c.identifier)
+                        for s, p, o, c in quads)
+
+    # The following are called holding the write lock of the dataset
+
+    def clear(self, identifier):
+        """The graph (or "DEFAULT") was cleared or created"""
+        self._op("CLEAR", self._identifier(identifier))
+
+    def create(self, identifier):
+        """The graph was created if it did not exist"""
+        self._op("CREATE", self._identifier(identifier))
+
+    def drop(self, identifier):
+        """The graph was removed"""
+        self._op("DROP", self._identifier(identifier))
+
+    def add(self, quads):
+        """The (s, p, o, graph) quads were added"""
+        if self._removing:
+            self._op("ADD")
+        self._write(self._rows(quads))
+
+    def remove(self, quads):
+        """The (s, p, o, graph) quads were removed"""
+        if not self._removing:
+            self._op("REMOVE")
+        self._write(self._rows(quads))
+
+    def abort(self):
+        """Drop the modification written since the last commit, e.g.
+        when a transaction was rolled back"""
+        if not self._pending:
+            return
+        self._op("ABORT")
+        self._pending = False
+
+    def commit(self):
+        """End the modification, only committed modifications are
+        replayed"""
+        if not self._pending:
+            return
+        self._op("COMMIT")
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+        self._pending = False
+
+    def due(self):
+        """Whether the journal is large enough for a new snapshot"""
+        return self._file is not None and self._file.tell() >= self.snapshot_bytes
+
+    def snapshot(self):
+        """
+        Write a snapshot of the dataset and start a new journal. The
+        dataset must not be modified meanwhile (i.e. the read lock must
+        be held). If another thread is taking a snapshot, nothing is
+        done.
+        """
+        if not self._snapshotting.acquire(False):
+            return
+        try:
+            number = (self._files("snapshot") or [0])[-1] + 1
+            path = self._path("snapshot", number)
+            with open(path + ".tmp", "wb") as f:
+                for context in (self.ds.contexts() if self.ds.context_aware else [self.ds]):
+                    if context.identifier == self._default.identifier:
+                        rows = (_nt_row(t) for t in context)
+                    else:
+                        rows = (_nq_row(t, context.identifier) for t in context)
+                    for row in rows:
+                        f.write(row.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(path + ".tmp", path)
+
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            for kind in ("snapshot", "journal"):
+                for n in self._files(kind):
+                    if n < number:
+                        os.remove(self._path(kind, n))
+        finally:
+            self._snapshotting.release()
+
+    def fingerprint(self):
+        """A string that changes whenever the journaled dataset does,
+        e.g. to tell whether something computed from it is still up to
+        date after a restart"""
+        number = (self._files("snapshot") or [0])[-1]
+        if self._file is not None:
+            self._file.flush()
+        path = self._path("journal", number)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        return "%s %d %d" % (os.path.abspath(self.directory), number, size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def main(target, options):
+    """
+    Like rdflib.extras.cmdlineutils.main, but if the option ``-j``
+    names a journal directory with a snapshot, the dataset is restored
+    from there instead of parsing the files given. The target has to
+    start the journal.
+    """
+    import getopt
+    from rdflib.extras.cmdlineutils import main as cmdmain
+
+    args, files = getopt.getopt(sys.argv[1:], "hf:o:" + options)
+    directory = dict(args).get("-j")
+    if directory and os.path.isdir(directory):
+        g = rdflib.Graph()
+        if Journal(directory, g).restore():
+            sys.stderr.write("Restored %d triples from %s\n" % (len(g), directory))
+            target(g, sys.stdout, args)
+            return
+    cmdmain(target, options=options, stdin=False)
@@ -20,21 +20,38 @@ or if you installed with pip, commands ``rdflodapp`` has been added to your path
 
 Either way, the file will be served from http://localhost:5000
 
+With ``-j <directory>``, the modifications made through the graph store
+are journaled there, and on the next start the dataset is restored
+from the journal instead of the file, see :py:mod:`rdflib_web.journal`.
+With ``-i <file>``, the indexes of the app are saved to the file, and
+loaded from it on the next start if the files (or the journal) did not
+change, see :py:mod:`rdflib_web.lodindex`. With ``-c``, the indexes are
+kept in the smaller layout of :py:mod:`rdflib_web.compactindex`. With
+``-l``, only the types are indexed at startup, the resources of each
+type when it is first used or by a thread in the background, see
+:py:class:`rdflib_web.lodindex.LazyIndex`.
+
 You can also start the server from your application by calling the :py:func:`serve` method
 or get the application object yourself by called :py:func:`get` function
 
 The application creates local URIs based on the type of resources
 and servers content-negotiated HTML or serialised RDF from these.
 
+The indexes of types, resources and labels behind these URIs are built
+when the blueprint is registered. Graph store requests and SPARQL
+updates update the entries of the resources whose types or labels they
+touch, calls of ``app.config["generic"].changed()`` rebuild them.
+
 """
 import re
-import warnings
+import atexit
+import logging
 import urllib2
-import collections
 import subprocess
 import codecs
 import os.path
 import itertools
+import threading
 
 import rdflib
 
@@ -51,13 +68,20 @@ from werkzeug.urls import url_quote
 
 from jinja2 import contextfilter, Markup
 
-from rdflib_web.endpoint import endpoint
+from rdflib_web.endpoint import endpoint, start_parse_pool
 from rdflib_web import mimeutils
+from rdflib_web import httputils
+from rdflib_web import journal
+from rdflib_web import compactindex
+from rdflib_web import lodindex
+from rdflib_web.lodindex import LABEL_PROPERTIES, localname, quote
 
 from rdflib_web.caches import lfu_cache
 
 __all__ = ['lod', 'get', 'serve' ]
 
+log = logging.getLogger(__name__)
+
 lod = Blueprint('lod', __name__)
 """The Flask Blueprint object for a LOD Application on top of
 ``app.config["graph"]``. See :py:func:`get` for further configuration options."""
@@ -103,36 +127,85 @@ def setup_lod(state):
     app.jinja_env.filters["term"]=termdict_link
     app.jinja_env.tests["rdf_node"]=is_rdf_node
 
-    graph = app.config['graph']
-
     types = app.config.get('types', 'auto')
-
-    foundtypes, resource_types=_find_types(graph)
-    if types=='auto':
-        app.config["types"]=foundtypes
-    elif types==None:
-        app.config["types"]={None:None}
+    app.config["auto_types"]=types=='auto'
+
+    _index(app.config, app.config['graph'], types,
+           app.config.get('index_snapshot'), app.config.get('index_fingerprint'))
+
+    app.before_first_request(_subscribe)
+
+def _index(config, graph, types, snapshot=None, fingerprint=None):
+    """Build the indexes of graph in config, or load them from the
+    snapshot file if it was saved for the same fingerprint"""
+    label_properties=config.get('label_properties', LABEL_PROPERTIES)
+    if config.get('lazy'):
+        config['lazy'].stop()
+    if config.get('lazy_index'):
+        config['lazy']=lodindex.LazyIndex(graph, types, label_properties, progress=_progress)
+        config.update(config['lazy'].indexes())
+        _warm_up(config)
+        return
+    key=None
+    index=None
+    if snapshot and fingerprint:
+        key=lodindex.snapshot_key(fingerprint, types, label_properties)
+        index=lodindex.load(snapshot, key)
+        if index is not None:
+            log.info("Loaded the indexes from %s", snapshot)
+    if index is None:
+        index=lodindex.build(graph, types, label_properties, progress=_progress)
+        if key is not None:
+            lodindex.save(index, snapshot, key)
+    if config.get('compact_index'):
+        index=compactindex.compact(index)
+    config.update(index)
+
+def _progress(phase, n):
+    log.info("Indexing %s: %d triples", phase, n)
+
+def _warm_up(config):
+    """Build the types of a LazyIndex in the background, once the
+    endpoint (and its lock) is set up"""
+    if not config.get('lazy') or "generic" not in config:
+        return
+    t=threading.Thread(target=config['lazy'].warm_up, args=(config["generic"].lock,),
+                       name="LazyIndex-warm-up")
+    t.daemon=True
+    t.start()
+    if 'warm_up' not in config:
+        atexit.register(_stop_warm_up, config)
+    config['warm_up']=t
+
+def _stop_warm_up(config, timeout=5):
+    """Stop the warm up thread of the current index at exit, it is left
+    running at the interpreter shutdown otherwise. The threads of
+    earlier indexes were stopped when they were replaced. Waits at most
+    timeout seconds for the type being built."""
+    config['lazy'].stop()
+    config['warm_up'].join(timeout)
+
+def _subscribe():
+    """Keep the indexes up to date with the modifications made through
+    the endpoint"""
+    config=current_app.config
+    def changed(added, removed):
+        _update_indexes(config, config["graph"], added, removed)
+    # the other triples do not affect the indexes
+    changed.predicates=set([RDF.type])|set(config.get('label_properties', LABEL_PROPERTIES))
+    config["generic"].change_hooks.append(changed)
+    _warm_up(config)
+
+def _update_indexes(config, graph, added, removed):
+    """Update the indexes after a modification, see
+    lodindex.update. Called holding the write lock of the graph."""
+    resolve.clear()
+    if added is None:
+        _index(config, graph, 'auto' if config["auto_types"] else config["types"])
     else:
-        app.config["types"]=types
-
-    app.config["resource_types"]=resource_types
-
-    app.config["rtypes"]=_reverse_types(app.config["types"])
+        lodindex.update(config, graph, added, removed, config["auto_types"],
+                        config.get('label_properties', LABEL_PROPERTIES))
 
-    app.config["resources"]=_find_resources(graph, app.config['types'])
-    app.config["rresources"]=_reverse_resources(app.config["resources"])
-
-    app.config["labels"]=_find_labels(graph, app.config["resources"],
-                                      app.config.get('label_properties', LABEL_PROPERTIES))
-
-
-LABEL_PROPERTIES=[RDFS.label,
-                  rdflib.URIRef("http://purl.org/dc/elements/1.1/title"),
-                  rdflib.URIRef("http://xmlns.com/foaf/0.1/name"),
-                  rdflib.URIRef("http://www.w3.org/2006/vcard/ns#fn"),
-                  rdflib.URIRef("http://www.w3.org/2006/vcard/ns#org")
-
-                  ]
 @lfu_cache(200)
 def resolve(r):
     """
@@ -173,29 +246,6 @@ def resolve(r):
              'type': types,
              'picked': unicode(r) in session["picked"]}
 
-def localname(t):
-    """standard rdflib qname computer is not quite what we want"""
-
-    r=t[max(t.rfind("/"), t.rfind("#"))+1:]
-    # pending apache 2.2.18 being available
-    # work around %2F encoding bug for AllowEncodedSlashes apache option
-    r=r.replace("%2F", "_")
-    return r
-
-def _find_label(t, graph, label_props):
-    if isinstance(t, rdflib.Literal): return unicode(t)
-    for l in label_props:
-        try:
-            return graph.objects(t,l).next()
-        except StopIteration:
-            pass
-    try:
-        #return g.graph.namespace_manager.compute_qname(t)[2]
-        return urllib2.unquote(localname(t))
-    except:
-        return t
-
-
 def get_label(r):
     try:
         return current_app.config["labels"][r]
@@ -212,91 +262,8 @@ def label_to_url(label):
     label=re.sub(re.compile('[^\w ]',re.U), '',label)
     return re.sub(" ", "_", label)
 
-def _find_types(graph):
-    types={}
-    resource_types=collections.defaultdict(set)
-    types[RDFS.Class]=localname(RDFS.Class)
-    types[RDF.Property]=localname(RDF.Property)
-    for s,p,o in graph.triples((None, RDF.type, None)):
-        if o not in types: types[o]=_quote(localname(o))
-        resource_types[s].add(o)
-
-    for t in types:
-        resource_types[t].add(RDFS.Class)
-
-    return types, resource_types
-
-def _reverse_types(types):
-    """Generate cache of localname=>type mapping"""
-    rtypes={}
-    for t,l in types.iteritems():
-        while l in rtypes:
-            warnings.warn(u"Multiple types for label '%s': (%s) rewriting to '%s_'"%(l,rtypes[l], l))
-            l+="_"
-        rtypes[l]=t
-
-    # rewrite type cache, in case we changed some labels
-    types.clear()
-    for l,t in rtypes.iteritems():
-        types[t]=l
-    return rtypes
-
-
-def _find_resources(graph, types):
-
-    """Build up cache of type=>[resource=>localname]]"""
-
-    resources=collections.defaultdict(dict)
-
-    for t in types:
-        resources[t]={}
-        for x in graph.subjects(RDF.type, t):
-            resources[t][x]=_quote(localname(x))
-
-    resources[RDFS.Class].update(types.copy())
-
-    return resources
-
-def _reverse_resources(resources):
-    """
-    Reverse resource-cache, build up cache
-    type=>[localname=>resource]
-
-    (for finding resources when entering URL)
-    """
-    rresources={}
-    for t,res in resources.iteritems():
-        rresources[t]={}
-        for r, l in res.iteritems():
-            while l in rresources[t]:
-                warnings.warn(u"Multiple resources for label '%s': (%s, %s) rewriting to '%s_'"%(repr(l),rresources[t][l], r, repr(l+'_')))
-                l+="_"
-
-            rresources[t][l]=r
-
-        resources[t].clear()
-        for l,r in rresources[t].iteritems():
-            resources[t][r]=l
-
-    return rresources
-
-def _find_labels(graph, resources, label_props):
-    labels={}
-    for t, res in resources.iteritems():
-        for r in res:
-            if r not in labels:
-                labels[r]=_find_label(r, graph, label_props)
-    return labels
-
-def _quote(l):
-    if isinstance(l,unicode):
-        l=l.encode("utf-8")
-    return l
-    #return urllib2.quote(l, safe="")
-
-
 def get_resource(label, type_):
-    label=_quote(label)
+    label=quote(label)
     if type_ and type_ not in current_app.config["rtypes"]:
         return "No such type_ %s"%type_, 404
     try:
@@ -500,6 +467,9 @@ def page(label, type_=None):
 
     return render_template(p, **params)
 
+_RESOURCE_NEGOTIATOR=mimeutils.negotiator([mimeutils.RDFXML_MIME, mimeutils.N3_MIME,
+    mimeutils.NTRIPLES_MIME, mimeutils.HTML_MIME])
+
 @lod.route("/resource/<type_>/<rdf:label>")
 @lod.route("/resource/<rdf:label>")
 def resource(label, type_=None):
@@ -508,8 +478,7 @@ def resource(label, type_=None):
     redirect to the appropriate place
     """
 
-    mimetype=mimeutils.best_match([mimeutils.RDFXML_MIME, mimeutils.N3_MIME,
-        mimeutils.NTRIPLES_MIME, mimeutils.HTML_MIME], request.headers.get("Accept"))
+    mimetype=_RESOURCE_NEGOTIATOR.best_match(request.headers.get("Accept"))
 
     if mimetype and mimetype!=mimeutils.HTML_MIME:
         path="lod.data"
@@ -562,8 +531,10 @@ def search():
 
     results=[]
     found=set()
+    # a copy, the labels of a LazyIndex are filled in by other threads
+    labels=current_app.config["labels"].items()
 
-    for resource, label in current_app.config["labels"].iteritems():
+    for resource, label in labels:
         r=re.compile("\W%s\W"%re.escape(searchterm), re.I)
         if r.search(label):
             results.append(resolve(resource))
@@ -572,7 +543,7 @@ def search():
 
     results.sort(key=lambda x: x["label"].lower())
 
-    for resource, label in current_app.config["labels"].iteritems():
+    for resource, label in labels:
         if len(results)>offset+10: break
 
         r=re.compile("%s"%re.escape(searchterm), re.I)
@@ -593,6 +564,27 @@ def setupSession():
     if "picked" not in session:
         session["picked"]={}
 
+@lod.before_request
+def _conditional():
+    return httputils.not_modified()
+
+@lod.after_request
+def _finish(response):
+    return httputils.finish(response)
+
+@lod.before_request
+def _lock_graph():
+    """Pages are computed from the graph, which graph store requests
+    may modify from other threads"""
+    g.generic.lock.acquire_read()
+    g.lod_locked=True
+
+@lod.teardown_request
+def _unlock_graph(exc):
+    if g.get("lod_locked"):
+        g.lod_locked=False
+        g.generic.lock.release_read()
+
 @lod.route("/pick")
 def pick():
     u = request.args["uri"]
@@ -649,22 +641,38 @@ def picked(action=None, format_=None):
 def serve(graph_,debug=False):
     """Serve the given graph on localhost with the LOD App"""
 
-    get(graph_).run(debug=debug)
+    app=get(graph_)
+    start_parse_pool(app)
+    app.run(debug=debug)
 
 
 def get(graph, types='auto',image_patterns=["\.[png|jpg|gif]$"],
         label_properties=LABEL_PROPERTIES,
         hierarchy_properties=[ RDFS.subClassOf, RDFS.subPropertyOf ],
-        add_types_labels=True,dbname="RDFLib LOD App"):
+        add_types_labels=True,dbname="RDFLib LOD App",journal=None,
+        index_snapshot=None,index_fingerprint=None,compact_index=False,
+        lazy_index=False):
 
     """
-    Get the LOD Flask App setup to serve the given graph
+    Get the LOD Flask App setup to serve the given graph, optionally
+    writing the modifications to a started journal.Journal. The
+    indexes are loaded from the index_snapshot file if they were saved
+    there for the same index_fingerprint of the data, and saved there
+    otherwise, see lodindex.save. With compact_index, the indexes are
+    kept in the layout of compactindex.compact. With lazy_index, only
+    the types are indexed here, see lodindex.LazyIndex, the snapshot
+    and compact_index are not used then.
     """
 
     app = Flask(__name__)
 
     app.config["graph"]=graph
     app.config["dbname"]=dbname
+    app.config["journal"]=journal
+    app.config["index_snapshot"]=index_snapshot
+    app.config["index_fingerprint"]=index_fingerprint
+    app.config["compact_index"]=compact_index
+    app.config["lazy_index"]=lazy_index
 
     app.config['types']=types
 
@@ -691,6 +699,7 @@ def get(graph, types='auto',image_patterns=["\.[png|jpg|gif]$"],
 def _main(g, out, opts):
     import rdflib
     import sys
+    import getopt
 
     dbname="commandline DB"
 
@@ -701,6 +710,8 @@ def _main(g, out, opts):
 
     opts=dict(opts)
     debug='-d' in opts
+    # report the progress of indexing
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     if '-N' in opts:
         dbname=opts["-N"]
     types='auto'
@@ -708,12 +719,28 @@ def _main(g, out, opts):
         types=[rdflib.URIRef(x) for x in opts['-t'].split(',')]
     if '-n' in opts:
         types=None
+    j=None
+    if '-j' in opts:
+        j=journal.Journal(opts['-j'], g)
+        j.start()
+    fingerprint=None
+    if '-i' in opts:
+        if j is not None:
+            fingerprint=j.fingerprint()
+        else:
+            files=getopt.getopt(sys.argv[1:], "hf:o:"+OPTIONS)[1]
+            fingerprint=lodindex.file_fingerprint(files)
+
+    app=get(g, types=types, dbname=dbname, journal=j, index_snapshot=opts.get('-i'),
+            index_fingerprint=fingerprint, compact_index='-c' in opts,
+            lazy_index='-l' in opts)
+    start_parse_pool(app)
+    app.run(host="0.0.0.0", debug=debug)
 
-    get(g, types=types, dbname=dbname).run(host="0.0.0.0", debug=debug)
+OPTIONS='t:ndN:j:i:cl'
 
 def main():
-    from rdflib.extras.cmdlineutils import main as cmdmain
-    cmdmain(_main, options='t:ndN:', stdin=False)
+    journal.main(_main, options=OPTIONS)
 
 if __name__=='__main__':
     main()
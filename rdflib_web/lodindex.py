@@ -0,0 +1,663 @@
+"""
+The indexes behind the URLs of the LOD app.
+
+:py:func:`build` computes, for a graph:
+
+``types``
+  type => label, the types shown by the app
+``rtypes``
+  label => type
+``resource_types``
+  resource => set of its types
+``resources``
+  type => {resource => label}, the resources of each type
+``rresources``
+  type => {label => resource}
+``labels``
+  resource => human readable label
+
+The labels in URLs are the local names of the URIs, with "_" appended
+where two would be the same. Which resource keeps the plain label is
+decided as by looking up the resources of the type, the resources of
+the types with clashing labels are looked up for that. The indexes are built in one pass over the
+``rdf:type`` triples and one pass over the triples of each label
+property, instead of looking up the resources of each type and the
+labels of each resource::
+
+  index=build(graph, progress=lambda phase, n: log.info("%s: %d", phase, n))
+  app.config.update(index)
+
+:py:func:`update` brings them up to date after triples were added or
+removed.
+
+Building the indexes of a large graph takes a while, :py:func:`save`
+writes them to a snapshot file, which :py:func:`load` reads back
+instead as long as the data they were built from did not change. The
+caller tells with a fingerprint of the data, e.g. of the files parsed
+(see :py:func:`file_fingerprint`) or of the journal the dataset was
+restored from (see :py:meth:`rdflib_web.journal.Journal.fingerprint`)::
+
+  key=snapshot_key(file_fingerprint(files), 'auto', LABEL_PROPERTIES)
+  index=load("books.index", key)
+  if index is None:
+      index=build(graph)
+      save(index, "books.index", key)
+
+A :py:class:`LazyIndex` only finds the types up front, and builds the
+resources and labels of each type when it is first used, or when a
+background thread gets to it::
+
+  index=LazyIndex(graph)
+  app.config.update(index.indexes())
+  threading.Thread(target=index.warm_up, args=(graph_lock,)).start()
+"""
+
+import collections
+import hashlib
+import itertools
+import marshal
+import os
+import threading
+import urllib2
+import warnings
+try:
+    from collections.abc import MutableMapping
+except ImportError: # python 2
+    from collections import MutableMapping
+
+import rdflib
+from rdflib import RDF, RDFS
+
+__all__ = [ 'build', 'update', 'save', 'load', 'snapshot_key', 'file_fingerprint', 'LazyIndex',
+            'localname', 'quote', 'find_label', 'LABEL_PROPERTIES', 'INDEXES' ]
+
+LABEL_PROPERTIES=[RDFS.label,
+                  rdflib.URIRef("http://purl.org/dc/elements/1.1/title"),
+                  rdflib.URIRef("http://xmlns.com/foaf/0.1/name"),
+                  rdflib.URIRef("http://www.w3.org/2006/vcard/ns#fn"),
+                  rdflib.URIRef("http://www.w3.org/2006/vcard/ns#org")
+
+                  ]
+
+INDEXES=("types", "rtypes", "resource_types", "resources", "rresources", "labels")
+"""The keys of the dict returned by build"""
+
+PROGRESS_STEP=100000
+"""Number of triples between two progress reports"""
+
+# the first line of a snapshot, followed by the key
+_SNAPSHOT_HEADER="rdflib-web lodindex 1 "
+
+def localname(t):
+    """standard rdflib qname computer is not quite what we want"""
+
+    r=t[max(t.rfind("/"), t.rfind("#"))+1:]
+    # pending apache 2.2.18 being available
+    # work around %2F encoding bug for AllowEncodedSlashes apache option
+    r=r.replace("%2F", "_")
+    return r
+
+def quote(l):
+    if isinstance(l,unicode):
+        l=l.encode("utf-8")
+    return l
+    #return urllib2.quote(l, safe="")
+
+def _default_label(t):
+    try:
+        #return g.graph.namespace_manager.compute_qname(t)[2]
+        return urllib2.unquote(localname(t))
+    except:
+        return t
+
+def find_label(t, graph, label_props):
+    """The label of t, the value of the first of label_props it has, or
+    its local name"""
+    if isinstance(t, rdflib.Literal): return unicode(t)
+    for l in label_props:
+        try:
+            return graph.objects(t,l).next()
+        except StopIteration:
+            pass
+    return _default_label(t)
+
+def _counted(triples, phase, progress):
+    # passes the triples through, reporting every PROGRESS_STEP
+    if progress is None:
+        return triples
+    def counting():
+        n=0
+        for n, t in enumerate(triples, 1):
+            if n%PROGRESS_STEP==0:
+                progress(phase, n)
+            yield t
+        progress(phase, n)
+    return counting()
+
+def build(graph, types='auto', label_properties=LABEL_PROPERTIES, progress=None):
+    """
+    Build the indexes of graph.
+
+    :argument:types: 'auto' to show all types used in graph, None to
+    show all typed resources without types, or a dict type => label
+    :argument:label_properties: The properties whose values are labels,
+    the first one a resource has is used
+    :argument:progress: An optional function called with the name of
+    the pass and the number of triples read so far, every
+    PROGRESS_STEP triples and at the end of each pass
+
+    :Returns: a dict with the :py:data:`INDEXES`
+    """
+    auto=types=='auto'
+    if auto:
+        types={}
+        types[RDFS.Class]=localname(RDFS.Class)
+        types[RDF.Property]=localname(RDF.Property)
+    elif types==None:
+        types={None:None}
+    typeless=None in types
+
+    resource_types=collections.defaultdict(set)
+    resources=collections.defaultdict(dict)
+    for t in types:
+        resources[t]={}
+    # the types found, as they are listed as classes in any case
+    found=set(types) if auto else set([RDFS.Class, RDF.Property])
+
+    names={}
+    for s,p,o in _counted(graph.triples((None, RDF.type, None)), "types", progress):
+        name=names.get(s)
+        if name is None:
+            name=names[s]=quote(localname(s))
+        if o not in found:
+            found.add(o)
+            if auto:
+                types[o]=quote(localname(o))
+                resources[o]={}
+        resource_types[s].add(o)
+        if o in resources:
+            resources[o][s]=name
+        if typeless:
+            resources[None][s]=name
+    del names
+
+    for t in found:
+        resource_types[t].add(RDFS.Class)
+
+    rtypes=_reverse_types(types)
+    resources[RDFS.Class].update(types.copy())
+    for t, res in resources.items():
+        if len(set(res.itervalues()))<len(res):
+            resources[t]=_lookup_order(graph, t, res, types)
+    rresources=_reverse_resources(resources)
+
+    labels={}
+    wanted=set()
+    for res in resources.itervalues():
+        wanted.update(res)
+    for prop in label_properties:
+        for s,p,o in _counted(graph.triples((None, prop, None)), unicode(prop), progress):
+            if s in wanted and s not in labels:
+                labels[s]=o
+    wanted.discard(None)
+    for r in wanted:
+        if r not in labels:
+            labels[r]=_default_label(r)
+
+    return { "types": types, "rtypes": rtypes, "resource_types": resource_types,
+             "resources": resources, "rresources": rresources, "labels": labels }
+
+def _lookup_order(graph, t, res, types):
+    """res with the resources in the order they are found by looking up
+    the resources of type t, which decides the ones that keep their
+    label where labels clash"""
+    ordered={}
+    for x in graph.subjects(RDF.type, t):
+        if x in res:
+            ordered[x]=res[x]
+    if t==RDFS.Class:
+        ordered.update(types.copy())
+    return ordered
+
+def _reverse_types(types):
+    """Generate cache of localname=>type mapping"""
+    rtypes={}
+    for t,l in types.iteritems():
+        while l in rtypes:
+            warnings.warn(u"Multiple types for label '%s': (%s) rewriting to '%s_'"%(l,rtypes[l], l))
+            l+="_"
+        rtypes[l]=t
+
+    # rewrite type cache, in case we changed some labels
+    types.clear()
+    for l,t in rtypes.iteritems():
+        types[t]=l
+    return rtypes
+
+def _reverse_resources(resources):
+    """
+    Reverse resource-cache, build up cache
+    type=>[localname=>resource]
+
+    (for finding resources when entering URL)
+    """
+    rresources={}
+    for t,res in resources.iteritems():
+        rresources[t]={}
+        for r, l in res.iteritems():
+            while l in rresources[t]:
+                warnings.warn(u"Multiple resources for label '%s': (%s, %s) rewriting to '%s_'"%(repr(l),rresources[t][l], r, repr(l+'_')))
+                l+="_"
+
+            rresources[t][l]=r
+
+        resources[t].clear()
+        for l,r in rresources[t].iteritems():
+            resources[t][r]=l
+
+    return rresources
+
+def update(index, graph, added, removed, auto=True, label_properties=LABEL_PROPERTIES):
+    """
+    Update the indexes after the triples were added to or removed from
+    graph. Only the entries of the resources whose types or labels
+    changed are recomputed. A new label gets "_" appended where it
+    clashes, existing labels are kept.
+
+    :argument:index: The dict with the :py:data:`INDEXES`, updated in
+    place
+    :argument:added: The (s, p, o) triples added
+    :argument:removed: The (s, p, o) triples removed
+    :argument:auto: Whether the types were found automatically, types
+    are then added and removed with their instances
+    """
+    resources=index["resources"]
+    built=getattr(resources, "built", None)
+    label_props=set(label_properties)
+    typed=set()
+    labelled=set()
+    classes=set()
+    for s,p,o in itertools.chain(added, removed):
+        if p==RDF.type:
+            typed.add(s)
+            classes.add(o)
+        elif p in label_props:
+            labelled.add(s)
+
+    types=index["types"]
+    rtypes=index["rtypes"]
+    rresources=index["rresources"]
+
+    if auto:
+        for t in classes:
+            used=(None, RDF.type, t) in graph
+            if used and t not in types:
+                l=_unique_label(quote(localname(t)), rtypes)
+                types[t]=l
+                rtypes[l]=t
+                resources[t]={}
+                rresources[t]={}
+                typed.add(t)
+            elif not used and t in types and t not in (RDFS.Class, RDF.Property):
+                del rtypes[types.pop(t)]
+                resources.pop(t, None)
+                rresources.pop(t, None)
+                typed.add(t)
+
+    for x in typed:
+        _update_resource(index, graph, x)
+
+    labels=index["labels"]
+    for x in typed|labelled:
+        if any(x in resources[t] for t in resources if built is None or built(t)):
+            labels[x]=find_label(x, graph, label_properties)
+        else:
+            labels.pop(x, None)
+
+def _update_resource(index, graph, x):
+    """Recompute the types of x and its entries in the resource
+    indexes"""
+    types=index["types"]
+    found=set(graph.objects(x, RDF.type))
+    if found:
+        index["resource_types"][x]=set(found)
+    else:
+        index["resource_types"].pop(x, None)
+    if x in types:
+        index["resource_types"][x].add(RDFS.Class)
+
+    resources=index["resources"]
+    rresources=index["rresources"]
+    built=getattr(resources, "built", None)
+    for t in set(types)|set([RDFS.Class]):
+        if built is not None and not built(t):
+            # built from the graph as it is then
+            continue
+        if t is None:
+            member=bool(found)
+        elif t==RDFS.Class and (x in types or RDFS.Class not in types):
+            # the types are listed as classes even without a type triple
+            member=x in types
+        else:
+            member=t in found
+        if member and x not in resources[t]:
+            if t==RDFS.Class and x in types:
+                l=types[x]
+            else:
+                l=quote(localname(x))
+            l=_unique_label(l, rresources.setdefault(t, {}))
+            resources[t][x]=l
+            rresources[t][l]=x
+        elif not member and x in resources[t]:
+            l=resources[t].pop(x)
+            if rresources[t].get(l)==x:
+                del rresources[t][l]
+
+def _unique_label(l, taken):
+    """l, or l with "_" appended until it is not in taken"""
+    while l in taken:
+        warnings.warn(u"Label %r is taken by %s, rewriting to %r"%(l, taken[l], l+'_'))
+        l+="_"
+    return l
+
+class LazyIndex(object):
+    """
+    The indexes of :py:func:`build`, built lazily: only the types are
+    found when it is created, with one pass over the ``rdf:type``
+    triples. The resources of a type, the reverse lookup and the labels
+    of the resources are built from the graph when the type is first
+    used (which holds the threads that need the same type meanwhile,
+    but not the others) and kept. The types of a resource are looked up
+    when first needed.
+
+    The graph must not be modified while a type is built, i.e. the read
+    lock of the graph must be held when using the indexes. Until all
+    types are built, the labels only hold those of the types built so
+    far.
+
+    :argument:types: As for build
+    :argument:label_properties: As for build
+    :argument:progress: As for build
+    """
+
+    def __init__(self, graph, types='auto', label_properties=LABEL_PROPERTIES, progress=None):
+        self.graph=graph
+        self.label_properties=label_properties
+        auto=types=='auto'
+        if auto:
+            types={}
+            types[RDFS.Class]=localname(RDFS.Class)
+            types[RDF.Property]=localname(RDF.Property)
+        elif types==None:
+            types={None:None}
+        else:
+            types=dict(types)
+
+        classes=set(types) if auto else set([RDFS.Class, RDF.Property])
+        for s,p,o in _counted(graph.triples((None, RDF.type, None)), "types", progress):
+            if o not in classes:
+                classes.add(o)
+                if auto:
+                    types[o]=quote(localname(o))
+
+        self.types=types
+        self.rtypes=_reverse_types(types)
+        self.resource_types=_ResourceTypes(graph, classes)
+        self.labels={}
+        self.resources=_ByType(self, 0)
+        self.rresources=_ByType(self, 1)
+        self.stopped=False
+
+        # type => [resources, rresources]
+        self._built={}
+        # type => lock held while building it
+        self._building={}
+        self._lock=threading.Lock()
+
+    def indexes(self):
+        """The dict with the :py:data:`INDEXES`"""
+        return { "types": self.types, "rtypes": self.rtypes,
+                 "resource_types": self.resource_types,
+                 "resources": self.resources, "rresources": self.rresources,
+                 "labels": self.labels }
+
+    def built(self, t):
+        """Whether the resources of type t were built"""
+        return t in self._built
+
+    def _entry(self, t):
+        entry=self._built.get(t)
+        if entry is not None:
+            return entry
+        with self._lock:
+            lock=self._building.setdefault(t, threading.Lock())
+        with lock:
+            entry=self._built.get(t)
+            if entry is None:
+                entry=self._built[t]=self._build(t)
+                with self._lock:
+                    del self._building[t]
+        return entry
+
+    def _build(self, t):
+        types=self.types
+        res={}
+        if t is None:
+            subjects=self.graph.subjects(RDF.type, None) if None in types else ()
+        else:
+            subjects=self.graph.subjects(RDF.type, t) if t in types else ()
+        for s in subjects:
+            if s not in res:
+                res[s]=quote(localname(s))
+        if t==RDFS.Class:
+            res.update(types)
+        rres=_reverse_resources({ t: res })[t]
+        for r in res:
+            if r is not None:
+                self.labels[r]=find_label(r, self.graph, self.label_properties)
+        return [res, rres]
+
+    def warm_up(self, lock=None):
+        """
+        Build the types not used yet, one at a time, until all are built
+        or stop is called.
+
+        :argument:lock: The ReadWriteLock of the graph, held for reading
+        while building a type
+        """
+        for t in list(self.types)+[RDFS.Class]:
+            if self.stopped:
+                return
+            if t in self._built:
+                continue
+            if lock is None:
+                self._entry(t)
+            else:
+                with lock.reading():
+                    self._entry(t)
+
+    def stop(self):
+        """Stop warm_up, e.g. when the indexes are replaced"""
+        self.stopped=True
+
+class _ByType(MutableMapping):
+    """type => resources or rresources of a LazyIndex, built on first
+    access"""
+
+    def __init__(self, index, part):
+        self.index=index
+        self.part=part
+
+    def built(self, t):
+        return self.index.built(t)
+
+    def __getitem__(self, t):
+        return self.index._entry(t)[self.part]
+
+    def __setitem__(self, t, value):
+        entry=self.index._built.setdefault(t, [{}, {}])
+        entry[self.part]=value
+
+    def __delitem__(self, t):
+        del self.index._built[t]
+
+    def __contains__(self, t):
+        return t in self.index.types or t==RDFS.Class or t in self.index._built
+
+    def pop(self, t, *default):
+        # without building t first
+        entry=self.index._built.pop(t, None)
+        if entry is not None:
+            return entry[self.part]
+        if t in self:
+            return {}
+        if default:
+            return default[0]
+        raise KeyError(t)
+
+    def __iter__(self):
+        keys=set(self.index.types)
+        keys.add(RDFS.Class)
+        keys.update(self.index._built)
+        return iter(keys)
+
+    def __len__(self):
+        return sum(1 for t in self)
+
+class _ResourceTypes(dict):
+    """resource => set of its types, looked up when first needed"""
+
+    def __init__(self, graph, classes):
+        dict.__init__(self)
+        self.graph=graph
+        self.classes=classes
+
+    def __missing__(self, r):
+        found=set(self.graph.objects(r, RDF.type))
+        if r in self.classes:
+            found.add(RDFS.Class)
+        self[r]=found
+        return found
+
+def snapshot_key(fingerprint, types, label_properties):
+    """The key of the snapshot of the indexes built with the types and
+    label_properties from the data with the fingerprint"""
+    if isinstance(types, dict):
+        types=sorted(types.items())
+    key=repr((fingerprint, types, list(label_properties)))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def file_fingerprint(paths):
+    """The SHA-1 of the contents of the files"""
+    h=hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024*1024), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+def _encode_term(t):
+    # a term as a value marshal can write, URIs as plain strings
+    if isinstance(t, rdflib.Literal):
+        return ("l", unicode(t), t.language, t.datatype and unicode(t.datatype))
+    if isinstance(t, rdflib.BNode):
+        return ("b", unicode(t))
+    return unicode(t)
+
+def _decode_term(x):
+    if isinstance(x, tuple):
+        if x[0]=="b":
+            return rdflib.BNode(x[1])
+        return rdflib.Literal(x[1], lang=x[2], datatype=x[3])
+    # the URIs were checked when they were parsed, URIRef() would
+    # check them again
+    return unicode.__new__(rdflib.URIRef, x)
+
+def _encode(index):
+    """The indexes as lists of strings and numbers, the terms replaced
+    by their position in a table of terms. rtypes and rresources are
+    left out, they are the reverse of types and resources."""
+    terms=[]
+    ids={None: -1}
+    def term(t):
+        i=ids.get(t)
+        if i is None:
+            i=ids[t]=len(terms)
+            terms.append(_encode_term(t))
+        return i
+
+    types=[]
+    for t, l in index["types"].iteritems():
+        types+=(term(t), l)
+    resource_types=[]
+    for r, ts in index["resource_types"].iteritems():
+        resource_types+=(term(r), [term(t) for t in ts])
+    resources=[]
+    for t, res in index["resources"].iteritems():
+        entries=[]
+        for r, l in res.iteritems():
+            entries+=(term(r), l)
+        resources+=(term(t), entries)
+    term_labels=[]
+    string_labels=[]
+    for r, l in index["labels"].iteritems():
+        if isinstance(l, rdflib.term.Node):
+            term_labels+=(term(r), term(l))
+        else:
+            string_labels+=(term(r), l)
+    return (terms, types, resource_types, resources, term_labels, string_labels)
+
+def _pairs(flat):
+    i=iter(flat)
+    return itertools.izip(i, i)
+
+def _decode(data):
+    encoded, types_, resource_types_, resources_, term_labels, string_labels=data
+    terms=[_decode_term(x) for x in encoded]
+    term=lambda i: terms[i] if i>=0 else None
+
+    types=dict((term(t), l) for t, l in _pairs(types_))
+    resource_types=collections.defaultdict(set)
+    for r, ts in _pairs(resource_types_):
+        resource_types[terms[r]]=set(term(t) for t in ts)
+    resources=collections.defaultdict(dict)
+    rresources={}
+    for t, entries in _pairs(resources_):
+        res=resources[term(t)]={}
+        rres=rresources[term(t)]={}
+        for r, l in _pairs(entries):
+            res[terms[r]]=l
+            rres[l]=terms[r]
+    labels=dict((terms[r], terms[l]) for r, l in _pairs(term_labels))
+    labels.update((terms[r], l) for r, l in _pairs(string_labels))
+
+    return { "types": types, "rtypes": dict((l, t) for t, l in types.iteritems()),
+             "resource_types": resource_types, "resources": resources,
+             "rresources": rresources, "labels": labels }
+
+def save(index, path, key):
+    """Write the indexes to the snapshot file path, replacing it
+    atomically"""
+    with open(path+".tmp", "wb") as f:
+        f.write((_SNAPSHOT_HEADER+key+"\n").encode("ascii"))
+        marshal.dump(_encode(index), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path+".tmp", path)
+
+def load(path, key):
+    """
+    Read the indexes from the snapshot file path.
+
+    :Returns: the dict with the :py:data:`INDEXES`, or None if there is
+    no snapshot or it was saved with another key
+    """
+    try:
+        f=open(path, "rb")
+    except IOError:
+        return None
+    with f:
+        header=(_SNAPSHOT_HEADER+key+"\n").encode("ascii")
+        if f.readline()!=header:
+            return None
+        return _decode(marshal.load(f))
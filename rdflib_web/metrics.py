@@ -0,0 +1,209 @@
+"""
+Latency histograms for the phases of SPARQL and graph store requests,
+exported in the `Prometheus text format
+<https://prometheus.io/docs/instrumenting/exposition_formats/>`_.
+
+Every request is timed by a :py:class:`RequestTimer`. Queries are split
+into the phases ``parse``, ``algebra`` (translating the parse tree),
+``evaluation``, ``serialization`` and ``render`` (the HTML page around
+the results). Rows of SELECT results are computed lazily while they are
+serialized, the time spent producing them is counted as evaluation.
+Graph store requests are split into ``parse`` (of the request body),
+``evaluation`` and ``serialization``.
+
+When the request is done, the phase times are added to histograms
+labelled with the phase, the form (``SELECT``, ``ASK``, ``CONSTRUCT``,
+``DESCRIBE``, or the HTTP method for graph store requests) and the
+format of the result::
+
+  metrics=Metrics()
+  timer=RequestTimer(metrics, form="SELECT", format="json")
+  with timer.phase("evaluation"):
+      ...
+  timer.finish()
+  text=metrics.render()
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+__all__ = [ 'Metrics', 'RequestTimer', 'Histogram', 'BUCKETS' ]
+
+BUCKETS=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+         0.25, 0.5, 1, 2.5, 5, 10, 30)
+"""Default upper bounds in seconds of the histogram buckets"""
+
+class Histogram(object):
+    """Counts observations in buckets, not thread-safe by itself"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets=buckets
+        self.counts=[0]*len(buckets)
+        self.count=0
+        self.sum=0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value<=bound:
+                self.counts[i]+=1
+                break
+        self.count+=1
+        self.sum+=value
+
+    def cumulative(self):
+        """Returns (bound, count of observations <= bound) pairs"""
+        total=0
+        for bound, n in zip(self.buckets, self.counts):
+            total+=n
+            yield bound, total
+
+class Metrics(object):
+    """
+    The phase histograms of an endpoint.
+
+    :argument:buckets: Upper bounds of the histogram buckets
+    :argument:maxseries: Maximum number of distinct phase/form/format
+    combinations, further ones are dropped. This keeps clients sending
+    arbitrary formats from growing the metrics without bound.
+    """
+
+    def __init__(self, buckets=BUCKETS, maxseries=500):
+        self.buckets=buckets
+        self.maxseries=maxseries
+        self._histograms={}
+        self._lock=threading.Lock()
+
+    def observe(self, phase, form, format, seconds):
+        key=(phase, form or "", format or "")
+        with self._lock:
+            h=self._histograms.get(key)
+            if h is None:
+                if len(self._histograms)>=self.maxseries:
+                    return
+                h=self._histograms[key]=Histogram(self.buckets)
+            h.observe(seconds)
+
+    def histogram(self, phase, form, format):
+        """The histogram for the given labels or None"""
+        return self._histograms.get((phase, form or "", format or ""))
+
+    def render(self):
+        """The histograms in the Prometheus text format"""
+        lines=["# HELP rdflib_web_phase_seconds Time spent in the phases of a request",
+               "# TYPE rdflib_web_phase_seconds histogram"]
+        with self._lock:
+            for (phase, form, format), h in sorted(self._histograms.items()):
+                labels='phase="%s",form="%s",format="%s"'%(
+                    _escape(phase), _escape(form), _escape(format))
+                for bound, n in h.cumulative():
+                    lines.append('rdflib_web_phase_seconds_bucket{%s,le="%s"} %d'%(labels, bound, n))
+                lines.append('rdflib_web_phase_seconds_bucket{%s,le="+Inf"} %d'%(labels, h.count))
+                lines.append('rdflib_web_phase_seconds_sum{%s} %r'%(labels, h.sum))
+                lines.append('rdflib_web_phase_seconds_count{%s} %d'%(labels, h.count))
+        return "\n".join(lines)+"\n"
+
+def render_lock(stats):
+    """The stats of a rwlock.ReadWriteLock in the Prometheus text format"""
+    lines=["# HELP rdflib_web_lock_acquisitions_total Acquisitions of the dataset lock",
+           "# TYPE rdflib_web_lock_acquisitions_total counter"]
+    for mode in ("read", "write"):
+        lines.append('rdflib_web_lock_acquisitions_total{mode="%s"} %d'%(mode, stats[mode+"s"]))
+    lines+=["# HELP rdflib_web_lock_wait_seconds_total Time spent waiting for the dataset lock",
+            "# TYPE rdflib_web_lock_wait_seconds_total counter"]
+    for mode in ("read", "write"):
+        lines.append('rdflib_web_lock_wait_seconds_total{mode="%s"} %r'%(mode, stats[mode+"_wait"]))
+    return "\n".join(lines)+"\n"
+
+def render_cache(name, cache):
+    """The counters of a caches.LRUCache in the Prometheus text format"""
+    lines=[]
+    for counter in ("hits", "misses", "evictions"):
+        metric="rdflib_web_%s_cache_%s_total"%(name, counter)
+        lines+=["# TYPE %s counter"%metric,
+                "%s %d"%(metric, getattr(cache, counter))]
+    return "\n".join(lines)+"\n"
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class RequestTimer(object):
+    """
+    Collects the time spent in the phases of one request. With metrics
+    None, nothing is recorded and the iterators are passed through
+    unchanged.
+
+    The form and format can be set later, when they are known.
+    """
+
+    def __init__(self, metrics, form=None, format=None):
+        self.metrics=metrics
+        self.form=form
+        self.format=format
+        self.phases={}
+        self._finished=False
+
+    def add(self, phase, seconds):
+        self.phases[phase]=self.phases.get(phase, 0.0)+seconds
+
+    def total(self):
+        return sum(self.phases.values())
+
+    @contextmanager
+    def phase(self, name):
+        start=time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time()-start)
+
+    def rows(self, rows):
+        """Wrap the iterator over lazily computed result rows, counting
+        the time to get each row as evaluation"""
+        if self.metrics is None:
+            return rows
+        return self._rows(rows)
+
+    def _rows(self, rows):
+        rows=iter(rows)
+        while True:
+            start=time.time()
+            try:
+                row=next(rows)
+            except StopIteration:
+                self.add("evaluation", time.time()-start)
+                return
+            self.add("evaluation", time.time()-start)
+            yield row
+
+    def chunks(self, chunks):
+        """Wrap the iterator over the chunks of a serialized result,
+        counting the time to get each chunk as serialization, except the
+        evaluation of the rows written to it"""
+        if self.metrics is None:
+            return chunks
+        return self._chunks(chunks)
+
+    def _chunks(self, chunks):
+        chunks=iter(chunks)
+        while True:
+            start=time.time()
+            evaluation=self.phases.get("evaluation", 0.0)
+            try:
+                chunk=next(chunks)
+            except StopIteration:
+                chunk=None
+            elapsed=time.time()-start
+            self.add("serialization",
+                     elapsed-(self.phases.get("evaluation", 0.0)-evaluation))
+            if chunk is None:
+                return
+            yield chunk
+
+    def finish(self):
+        """Record the phase times, only the first call has an effect"""
+        if self.metrics is None or self._finished:
+            return
+        self._finished=True
+        for phase, seconds in self.phases.items():
+            self.metrics.observe(phase, self.form, self.format, seconds)
@@ -1,3 +1,19 @@
+"""
+Mime types and content negotiation.
+
+Clients send few distinct Accept headers, so a :py:class:`Negotiator`
+for a fixed list of candidates keeps the decision for each header it
+has seen. Get the one for a list with :py:func:`negotiator`, once::
+
+  rdf=mimeutils.negotiator([mimeutils.N3_MIME, mimeutils.RDFXML_MIME])
+  ...
+  mimetype=rdf.best_match(request.headers.get("Accept"))
+
+The mime types of graph serializations are taken from the serializer
+plugins registered with rdflib, see :py:func:`graph_mimetypes`.
+"""
+
+from rdflib_web import caches
 
 try: 
     import mimeparse
@@ -9,6 +25,8 @@ except:
 # sparql results
 JSON_MIME="application/sparql-results+json"
 XML_MIME="application/sparql-results+xml"
+CSV_MIME="text/csv"
+TSV_MIME="text/tab-separated-values"
 
 HTML_MIME="text/html"
 N3_MIME="text/n3"
@@ -38,9 +56,86 @@ def resultformat_to_mime(format):
     if format=='xml': return XML_MIME
     if format=='json': return JSON_MIME
     if format=='html': return HTML_MIME
+    if format=='csv': return CSV_MIME
+    if format=='tsv': return TSV_MIME
     return "text/plain"
     
+# in order of increasing preference, xml last as the default for */*
+RESULT_FORMATS=[ ("html", HTML_MIME), ("json", JSON_MIME), ("csv", CSV_MIME),
+                 ("tsv", TSV_MIME), ("xml", XML_MIME) ]
+
+# the serializations which can hold more than one graph
+QUAD_MIMETYPES=set([ "application/n-quads", "application/trix", "application/trig" ])
+
+_MISSING=object()
+
+class Negotiator(object):
+    """
+    Content negotiation among candidates, a list of mime types in order
+    of increasing preference, as for mimeparse.best_match. The result
+    for each Accept header is cached. Without mimeparse, the last of
+    the candidates that occurs in the header is taken.
+
+    :argument:default: Returned if there is no header or nothing
+    matches
+    :argument:maxsize: Number of headers whose result is kept
+    """
+
+    def __init__(self, candidates, default=None, maxsize=256):
+        self.candidates=list(candidates)
+        self.default=default
+        self.cache=caches.LRUCache(maxsize)
+
+    def best_match(self, header):
+        if not header:
+            return self.default
+        if not mimeparse:
+            return self._contained(header)
+        best=self.cache.get(header, _MISSING)
+        if best is _MISSING:
+            try:
+                best=mimeparse.best_match(self.candidates, header) or self.default
+            except ValueError: # a malformed header
+                best=self.default
+            self.cache.put(header, best)
+        return best
+
+    def _contained(self, header):
+        for candidate in reversed(self.candidates):
+            if candidate in header:
+                return candidate
+        return self.default
+
+_negotiators={}
+
+def negotiator(candidates, default=None):
+    """The Negotiator for the candidates and default, created on the
+    first call"""
+    key=(tuple(candidates), default)
+    n=_negotiators.get(key)
+    if n is None:
+        n=_negotiators.setdefault(key, Negotiator(candidates, default))
+    return n
+
 def best_match(cand, header): 
-    if mimeparse and header:
-        return mimeparse.best_match(cand,header)
-    return None
+    return negotiator(cand).best_match(header)
+
+_RESULT_FORMAT=dict((m, f) for f, m in RESULT_FORMATS)
+
+def resultformat(header):
+    """The name of the SPARQL result format for the Accept header, xml
+    if none is acceptable"""
+    n=negotiator([m for _, m in RESULT_FORMATS], XML_MIME)
+    return _RESULT_FORMAT[n.best_match(header)]
+
+def graph_mimetypes(preferred):
+    """
+    The mime types of the rdflib serializers for single graphs. Those
+    in preferred come last, in the given order, the others before in
+    alphabetical order.
+    """
+    from rdflib.plugin import plugins
+    from rdflib.serializer import Serializer
+    found=set(p.name for p in plugins(kind=Serializer) if "/" in p.name)
+    others=sorted(found-QUAD_MIMETYPES-set(preferred))
+    return others+[m for m in preferred if m in found]
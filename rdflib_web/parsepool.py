@@ -0,0 +1,124 @@
+"""
+Parsing many RDF documents in parallel, in a pool of processes.
+
+Parsing with rdflib is pure python, threads would take turns holding
+the interpreter lock. A :py:class:`ParsePool` parses each document in a
+worker process and hands back the parsed quads, which the caller then
+adds to the store, e.g. with :py:func:`rdflib_web.bulkload.add`::
+
+  pool=ParsePool(workers=4)
+  for quads, error in pool.parse([(data1, "text/turtle"), (data2, "nt")]):
+      if error is None:
+          bulkload.add(quads, graph)
+
+The graph store uses it for the parts of multipart/form-data uploads,
+which are thus parsed before the write lock is taken.
+
+Forking a process with several threads copies the locks other threads
+hold at that moment, so where there is a choice (python 3.4 and newer)
+the workers are started by a fork server or spawned instead. Otherwise
+:py:meth:`ParsePool.start` must be called before any other threads are
+started, it is called by the first :py:meth:`ParsePool.parse` if not.
+The processes are stopped at exit, or by :py:meth:`ParsePool.close`.
+"""
+
+import atexit
+import multiprocessing
+import threading
+
+import rdflib
+
+__all__ = [ 'ParsePool', 'parse', 'QUAD_FORMATS' ]
+
+QUAD_FORMATS = set(["application/n-quads", "nquads", "trig", "application/trix", "trix"])
+"""The rdflib formats which may name graphs"""
+
+def parse(data, format):
+    """
+    Parse data in format (a mime type or rdflib format name).
+
+    :Returns: a list of (s, p, o, graph identifier) tuples, the
+    identifier is None for the triples not in a named graph
+    """
+    if format in QUAD_FORMATS:
+        g = rdflib.ConjunctiveGraph()
+        g.parse(data=data, format=format)
+        default = g.default_context.identifier
+        return [(s, p, o, None if c.identifier == default else c.identifier)
+                for s, p, o, c in g.quads()]
+    g = rdflib.Graph()
+    g.parse(data=data, format=format)
+    return [(s, p, o, None) for s, p, o in g]
+
+def _parse(part):
+    data, format = part
+    try:
+        return parse(data, format), None
+    except Exception, e:
+        return None, "%s: %s" % (e.__class__.__name__, e)
+
+def _context():
+    # the multiprocessing start method safe in a threaded server
+    get_context = getattr(multiprocessing, "get_context", None)
+    if get_context is None:
+        return multiprocessing
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return get_context("forkserver")
+    return get_context("spawn")
+
+def _fresh_bnodes(quads):
+    # The workers are forks of one process, which generate the same
+    # blank node ids
+    bnodes = {}
+    def fresh(node):
+        if isinstance(node, rdflib.BNode):
+            if node not in bnodes:
+                bnodes[node] = rdflib.BNode()
+            return bnodes[node]
+        return node
+    return [(fresh(s), p, fresh(o), fresh(c)) for s, p, o, c in quads]
+
+class ParsePool(object):
+    """
+    :argument:workers: Number of worker processes. With fewer than two,
+    documents are parsed one after the other in the calling thread.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def parse(self, parts):
+        """
+        Parse the documents in parallel.
+
+        :argument:parts: A list of (data, format) pairs
+        :Returns: a list with a (quads, error) pair for each part, in
+        the same order. quads is as returned by :py:func:`parse`, or
+        None if the part could not be parsed, error is then a message.
+        """
+        if self.workers < 2 or len(parts) < 2:
+            return [_parse(part) for part in parts]
+        pool = self.start()
+        results = pool.map(_parse, parts, chunksize=1)
+        return [(_fresh_bnodes(quads) if quads is not None else None, error)
+                for quads, error in results]
+
+    def start(self):
+        """Start the worker processes if they are not running, and
+        return the multiprocessing pool (None without workers). They
+        are stopped at exit."""
+        with self._lock:
+            if self._pool is None and self.workers >= 2:
+                self._pool = _context().Pool(self.workers)
+                atexit.register(self.close)
+            return self._pool
+
+    def close(self):
+        """Stop the worker processes"""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
@@ -0,0 +1,201 @@
+"""
+A bounded pool of worker threads for evaluating queries with a timeout.
+
+The work submitted is a function returning an iterable of chunks (e.g.
+one of the serializers in :py:mod:`rdflib_web.streaming`). It runs on
+one of the workers, which hands the chunks over to the requesting thread
+through a small queue. If the requesting thread does not get the next
+chunk before the deadline, the job is cancelled: the worker stops at the
+next chunk and moves on to the next job. The query itself cannot be
+interrupted, but it is abandoned as soon as it produces output.
+
+Work that collects all its chunks before handing anything over, e.g.
+writing them to a file with streaming.spool while holding a lock, passes
+them through :py:func:`checked`, which raises QueryTimeout in the worker
+once the job was cancelled or its deadline passed::
+
+  def work():
+      with lock.reading():
+          f=streaming.spool(checked(serialize_xml(g.query(q))))
+      yield f
+
+When all workers are busy, jobs wait in a queue of limited length. If
+that is full as well, :py:class:`PoolFull` is raised, so the application
+can shed load instead of piling up requests::
+
+  pool=QueryPool(workers=4, queue_size=16, timeout=30)
+  try:
+      for chunk in pool.submit(lambda: serialize_xml(g.query(q))):
+          out.write(chunk)
+  except PoolFull:
+      ... # 503 with Retry-After
+  except QueryTimeout:
+      ... # 503
+"""
+
+import sys
+import time
+import threading
+import Queue
+
+__all__ = [ 'QueryPool', 'PoolFull', 'QueryTimeout', 'parse_timeout', 'checked' ]
+
+class PoolFull(Exception):
+    """All workers are busy and the queue of waiting jobs is full"""
+    pass
+
+class QueryTimeout(Exception):
+    """The job did not produce its next chunk before the deadline"""
+    pass
+
+_CHUNK, _DONE, _ERROR = range(3)
+
+# the job run by the current worker thread
+_running = threading.local()
+
+def parse_timeout(requested):
+    """The timeout in seconds given by a client as a string, raises
+    ValueError if it is not a number of seconds"""
+    timeout = float(requested)
+    # also rejects nan
+    if not timeout >= 0:
+        raise ValueError("Invalid timeout %s" % requested)
+    return timeout
+
+def checked(chunks, expired=None):
+    """
+    Pass the chunks through, raising QueryTimeout before handing over the
+    next one once expired() returns True. By default, once the job run
+    by the current worker thread was cancelled or its deadline passed,
+    outside of a worker the chunks are passed through unchecked.
+    """
+    if expired is None:
+        job = getattr(_running, "job", None)
+        if job is not None:
+            expired = job.abandoned
+    for chunk in chunks:
+        if expired is not None and expired():
+            raise QueryTimeout()
+        yield chunk
+
+class _Job(object):
+
+    def __init__(self, work, deadline, maxchunks):
+        self.work = work
+        self.deadline = deadline
+        self.cancelled = False
+        self._chunks = Queue.Queue(maxchunks)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def expired(self):
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def abandoned(self):
+        return self.cancelled or self.expired()
+
+    def _put(self, item):
+        # Don't block forever if nobody is listening anymore
+        while not self.cancelled:
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def run(self):
+        chunks = None
+        _running.job = self
+        try:
+            chunks = self.work()
+            for chunk in chunks:
+                if not self._put((_CHUNK, chunk)):
+                    return
+            self._put((_DONE, None))
+        except Exception:
+            self._put((_ERROR, sys.exc_info()))
+        finally:
+            # Give generators the chance to release what they hold
+            # right away when the job was cancelled
+            if hasattr(chunks, "close"):
+                chunks.close()
+            _running.job = None
+
+    def __iter__(self):
+        try:
+            while True:
+                timeout = None
+                if self.deadline is not None:
+                    timeout = self.deadline - time.time()
+                    if timeout <= 0:
+                        raise QueryTimeout()
+                try:
+                    kind, value = self._chunks.get(timeout=timeout)
+                except Queue.Empty:
+                    raise QueryTimeout()
+
+                if kind == _DONE:
+                    return
+                elif kind == _ERROR:
+                    raise value[0], value[1], value[2]
+                yield value
+        finally:
+            # Also when the consumer stops iterating early
+            self.cancel()
+
+class QueryPool(object):
+    """
+    Evaluates jobs on a fixed number of daemon threads.
+
+    :argument:workers: Number of worker threads
+    :argument:queue_size: Number of jobs that may wait for a worker
+    :argument:timeout: Default timeout in seconds for a job, None for no
+    timeout. Requests can only lower it.
+    :argument:maxchunks: Number of chunks a worker may compute ahead of
+    the consumer
+    """
+
+    def __init__(self, workers=4, queue_size=16, timeout=None, maxchunks=4):
+        self.timeout = timeout
+        self.maxchunks = maxchunks
+        self._jobs = Queue.Queue(queue_size)
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name="QueryPool-%d" % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def timeout_for(self, requested=None):
+        """The timeout for a job when the client asks for requested
+        seconds (or None)"""
+        if requested is None:
+            return self.timeout
+        requested = parse_timeout(requested)
+        if self.timeout is None:
+            return requested
+        return min(requested, self.timeout)
+
+    def submit(self, work, timeout=None):
+        """
+        Queue the function work, which must return an iterable of chunks.
+        Returns an iterator over the chunks that raises QueryTimeout when
+        the deadline has passed, measured from now, including the time
+        the job waited for a worker.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        job = _Job(work, deadline, self.maxchunks)
+        try:
+            self._jobs.put_nowait(job)
+        except Queue.Full:
+            raise PoolFull()
+        return iter(job)
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            # The requester may have given up while the job was queued
+            if not job.cancelled and not job.expired():
+                job.run()
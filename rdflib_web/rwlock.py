@@ -0,0 +1,105 @@
+"""
+A reader-writer lock for sharing a dataset between request threads.
+
+Any number of threads may hold the lock for reading at the same time,
+a writer holds it exclusively. Waiting writers have preference: once a
+writer waits, new readers wait as well, so a steady stream of queries
+cannot starve updates. The lock is not reentrant, a thread holding it
+must not try to acquire it again::
+
+  lock=ReadWriteLock()
+  with lock.reading():
+      ... # query the graph
+  with lock.writing():
+      ... # modify the graph
+
+The lock counts acquisitions and the time spent waiting for it, see
+:py:meth:`ReadWriteLock.stats`.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+__all__ = [ 'ReadWriteLock' ]
+
+class ReadWriteLock(object):
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+        # wait metrics
+        self.reads = self.writes = 0
+        self.read_wait = self.write_wait = 0.0
+        self.max_read_wait = self.max_write_wait = 0.0
+
+    def acquire_read(self):
+        start = time.time()
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+            wait = time.time() - start
+            self.reads += 1
+            self.read_wait += wait
+            self.max_read_wait = max(self.max_read_wait, wait)
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        start = time.time()
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+            wait = time.time() - start
+            self.writes += 1
+            self.write_wait += wait
+            self.max_write_wait = max(self.max_write_wait, wait)
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+    def stats(self):
+        """Returns a dict with the number of acquisitions and the total
+        and maximum wait times in seconds for reading and writing"""
+        with self._cond:
+            return { "reads": self.reads,
+                     "read_wait": self.read_wait,
+                     "max_read_wait": self.max_read_wait,
+                     "writes": self.writes,
+                     "write_wait": self.write_wait,
+                     "max_write_wait": self.max_write_wait,
+                     "readers": self._readers,
+                     "waiting_writers": self._waiting_writers }
@@ -0,0 +1,291 @@
+"""
+Incremental serializers for SPARQL results.
+
+The serializers shipped with rdflib write the complete document to a
+stream before they return. The generators in this module yield the
+document in chunks of roughly ``chunksize`` bytes while the result rows
+are produced, so a web-app can send them as a chunked response without
+ever holding the whole document in memory::
+
+  result=graph.query("SELECT * WHERE { ?s ?p ?o }")
+  for chunk in streaming.serialize_xml(result):
+      out.write(chunk)
+
+The chunks are utf-8 encoded byte strings.
+
+Graphs can be streamed as N-Triples, and datasets as N-Quads or TriG,
+with :py:data:`GRAPH_SERIALIZERS`. Each triple is written as it is read from
+the store.
+
+As the rows are read from the store while the chunks are produced, the
+store must not be modified meanwhile. A web-app holding a lock for that
+should not hold it while a slow client takes the chunks:
+:py:func:`spool` writes them to a temporary file (in memory while it is
+small), from which :py:func:`read_chunks` reads them after the lock is
+released::
+
+  with lock.reading():
+      f=streaming.spool(streaming.serialize_xml(graph.query(q)))
+  for chunk in streaming.read_chunks(f):
+      out.write(chunk)
+
+The memory used stays bounded, but nothing is sent before the whole
+document was written to the file.
+"""
+
+import json
+import tempfile
+
+import rdflib
+from rdflib.graph import DATASET_DEFAULT_GRAPH_ID
+from rdflib.plugins.sparql.results.xmlresults import SPARQLXMLWriter
+from rdflib.plugins.sparql.results.jsonresults import termToJSON
+from rdflib.plugins.serializers.nt import _nt_row
+from rdflib.plugins.serializers.nquads import _nq_row
+
+from rdflib_web import htmlresults
+
+__all__ = [ 'iter_bindings', 'serialize_xml', 'serialize_json',
+            'serialize_html', 'serialize_csv', 'serialize_tsv',
+            'serialize_ntriples', 'serialize_nquads', 'serialize_trig',
+            'RESULT_SERIALIZERS', 'GRAPH_SERIALIZERS', 'CHUNKSIZE',
+            'spool', 'read_chunks', 'SPOOL_BYTES' ]
+
+CHUNKSIZE=64*1024
+"""Default size in bytes of the chunks yielded by the serializers"""
+
+SPOOL_BYTES=1024*1024
+"""Size up to which spooled chunks are kept in memory"""
+
+def iter_bindings(result):
+    """
+    Iterate over the bindings of a SELECT result.
+
+    Iterating over a rdflib result (or accessing ``result.bindings``)
+    appends every row to a list kept in the result object. Here we take
+    over the underlying generator instead, so rows can be garbage
+    collected as soon as they have been written. The result can only
+    be iterated once after this.
+    """
+    gen=getattr(result, "_genbindings", None)
+    if gen is not None:
+        result._genbindings=None
+        return gen
+    return iter(result.bindings)
+
+def _chunked(pieces, chunksize):
+    """Join the byte strings from pieces to chunks of at least chunksize
+    bytes (except the last one)"""
+    buf=[]
+    size=0
+    for p in pieces:
+        buf.append(p)
+        size+=len(p)
+        if size>=chunksize:
+            yield b"".join(buf)
+            buf=[]
+            size=0
+    if buf:
+        yield b"".join(buf)
+
+class _Collector(object):
+    """Minimal write()-able object the XMLGenerator can write to, we
+    take the written data out between rows"""
+
+    def __init__(self):
+        self.data=[]
+        self.size=0
+
+    def write(self, s):
+        self.data.append(s)
+        self.size+=len(s)
+
+    def drain(self):
+        s=b"".join(self.data)
+        self.data=[]
+        self.size=0
+        return s
+
+def serialize_xml(result, chunksize=CHUNKSIZE):
+    """Yield the result in SPARQL Query Results XML Format"""
+    out=_Collector()
+    writer=SPARQLXMLWriter(out, "utf-8")
+    if result.type=='ASK':
+        writer.write_header([])
+        writer.write_ask(result.askAnswer)
+    else:
+        writer.write_header(result.vars)
+        writer.write_results_header()
+        for b in iter_bindings(result):
+            writer.write_start_result()
+            for key, val in b.iteritems():
+                writer.write_binding(key, val)
+            writer.write_end_result()
+            if out.size>=chunksize:
+                yield out.drain()
+    writer.close()
+    yield out.drain()
+
+def _json_pieces(result):
+    # json.dumps escapes all non-ascii characters
+    if result.type=='ASK':
+        yield json.dumps({"head": {}, "boolean": result.askAnswer}).encode("ascii")
+        return
+
+    yield ('{"head": {"vars": %s}, "results": {"bindings": ['%json.dumps(result.vars)).encode("ascii")
+    sep=''
+    for b in iter_bindings(result):
+        row={}
+        for var, val in b.iteritems():
+            j=termToJSON(None, val)
+            if j is not None:
+                row[var]=j
+        yield (sep+json.dumps(row)).encode("ascii")
+        sep=', '
+    yield b']}}'
+
+def serialize_json(result, chunksize=CHUNKSIZE):
+    """Yield the result in SPARQL 1.1 Query Results JSON Format"""
+    return _chunked(_json_pieces(result), chunksize)
+
+def _html_pieces(result):
+    if result.type=='ASK':
+        yield ("<strong>%s</strong>"%str(result.askAnswer).lower()).encode("utf-8")
+        return
+    for s in htmlresults.generate_select(result.vars, iter_bindings(result)):
+        yield s.encode("utf-8")
+
+def serialize_html(result, chunksize=CHUNKSIZE):
+    """Yield the result as HTML table (without the surrounding page)"""
+    return _chunked(_html_pieces(result), chunksize)
+
+def _csv_term(t):
+    # SPARQL 1.1 Query Results CSV Format: plain values, quoted if needed
+    if t is None:
+        return u""
+    if isinstance(t, rdflib.BNode):
+        t=u"_:"+t
+    if u'"' in t or u',' in t or u'\n' in t or u'\r' in t:
+        return u'"%s"'%t.replace(u'"', u'""')
+    return t
+
+def _tsv_escape(s):
+    return s.replace(u'\\', u'\\\\').replace(u'"', u'\\"').replace(
+        u'\n', u'\\n').replace(u'\r', u'\\r').replace(u'\t', u'\\t')
+
+def _tsv_term(t):
+    # SPARQL 1.1 Query Results TSV Format: terms in Turtle syntax
+    if t is None:
+        return u""
+    if isinstance(t, rdflib.URIRef):
+        return u"<%s>"%t
+    if isinstance(t, rdflib.BNode):
+        return u"_:"+t
+    s=u'"%s"'%_tsv_escape(t)
+    if t.language:
+        return s+u"@"+t.language
+    if t.datatype:
+        return s+u"^^<%s>"%t.datatype
+    return s
+
+def _delimited_pieces(result, term, sep, header):
+    if result.type=='ASK':
+        # not covered by the specification, common practice
+        yield (u"_askResult\r\n%s\r\n"%str(result.askAnswer).lower()).encode("utf-8")
+        return
+    vars=result.vars
+    yield (sep.join(header(v) for v in vars)+u"\r\n").encode("utf-8")
+    for b in iter_bindings(result):
+        yield (sep.join([term(b.get(v)) for v in vars])+u"\r\n").encode("utf-8")
+
+def serialize_csv(result, chunksize=CHUNKSIZE):
+    """Yield the result in SPARQL 1.1 Query Results CSV Format"""
+    return _chunked(_delimited_pieces(result, _csv_term, u",", unicode), chunksize)
+
+def serialize_tsv(result, chunksize=CHUNKSIZE):
+    """Yield the result in SPARQL 1.1 Query Results TSV Format"""
+    return _chunked(_delimited_pieces(result, _tsv_term, u"\t", lambda v: u"?"+v), chunksize)
+
+RESULT_SERIALIZERS={ "xml": serialize_xml,
+                     "json": serialize_json,
+                     "html": serialize_html,
+                     "csv": serialize_csv,
+                     "tsv": serialize_tsv }
+"""Maps the output format names used by the endpoint to streaming
+serializers"""
+
+def serialize_ntriples(graph, chunksize=CHUNKSIZE):
+    """Yield the triples of graph as N-Triples"""
+    # escaped to ascii like the rdflib serializer does
+    return _chunked((_nt_row(t).encode("ascii", "_rdflib_nt_escape") for t in graph),
+                    chunksize)
+
+def _default_identifier(ds):
+    # the identifier of the default graph of ds, whose triples are
+    # written without a graph name
+    default=getattr(ds, "default_context", None)
+    if default is None:
+        return DATASET_DEFAULT_GRAPH_ID
+    return default.identifier
+
+def _nquads_pieces(ds):
+    default=_default_identifier(ds)
+    for s, p, o, c in ds.quads((None, None, None, None)):
+        # Dataset.quads gives the identifiers, ConjunctiveGraph.quads the graphs
+        c=getattr(c, "identifier", c)
+        if c is None or c==default:
+            yield _nt_row((s, p, o)).encode("utf-8")
+        else:
+            yield _nq_row((s, p, o), c).encode("utf-8")
+
+def serialize_nquads(ds, chunksize=CHUNKSIZE):
+    """Yield the quads of the context aware ds as N-Quads, the triples
+    of its default graph as N-Triples"""
+    return _chunked(_nquads_pieces(ds), chunksize)
+
+def _trig_pieces(ds):
+    default=_default_identifier(ds)
+    for context in ds.contexts():
+        if context.identifier==default:
+            yield b"{\n"
+        else:
+            yield (u"%s {\n"%context.identifier.n3()).encode("utf-8")
+        # a graph block may contain plain N-Triples
+        for t in context:
+            yield _nt_row(t).encode("utf-8")
+        yield b"}\n"
+
+def serialize_trig(ds, chunksize=CHUNKSIZE):
+    """Yield the graphs of the context aware ds as TriG, one block
+    per graph"""
+    return _chunked(_trig_pieces(ds), chunksize)
+
+GRAPH_SERIALIZERS={ "application/n-triples": serialize_ntriples,
+                    "application/n-quads": serialize_nquads,
+                    "application/trig": serialize_trig }
+"""Maps mime types to streaming serializers for graphs"""
+
+def spool(chunks, max_size=SPOOL_BYTES, directory=None):
+    """Write the chunks to a temporary file, which is kept in memory
+    until it grows larger than max_size bytes, and return it rewound"""
+    f=tempfile.SpooledTemporaryFile(max_size=max_size, dir=directory)
+    try:
+        for chunk in chunks:
+            f.write(chunk)
+    except:
+        f.close()
+        raise
+    f.seek(0)
+    return f
+
+def read_chunks(f, chunksize=CHUNKSIZE):
+    """Yield the contents of the file f in chunks, closing it at the end
+    or when the iteration is abandoned"""
+    try:
+        while True:
+            chunk=f.read(chunksize)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        f.close()
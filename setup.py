@@ -81,6 +81,7 @@ tests_require = install_requires
                       
 extras_require = { 
     "web-conneg": ["mimeparse"],
+    "asgi": ["uvicorn"],
 
     }
 
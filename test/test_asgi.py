@@ -0,0 +1,127 @@
+import sys
+import unittest
+
+if sys.version_info < (3, 5):
+    raise unittest.SkipTest("the ASGI app needs Python 3.5")
+
+import asyncio
+import json
+import tempfile
+import time
+
+import rdflib
+from rdflib_web import asgi
+
+EX=rdflib.Namespace("http://example.org/")
+
+class TestSPARQLApp(unittest.TestCase):
+
+    def setUp(self):
+        ds=rdflib.Dataset()
+        g=ds.graph(EX.g)
+        for i in range(100):
+            g.add((EX["s%d" % i], EX.p, rdflib.Literal("o%d" % i)))
+        # one thread, so that a lock held across sends would block
+        self.app=asgi.get(ds, workers=1, chunksize=64)
+        self.loop=asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.app.executor.shutdown()
+        self.app.io_executor.shutdown()
+        self.loop.close()
+
+    def start(self, method, path, query="", body=b"", headers=(), gate=None):
+        """Runs a request, returns its task and the messages sent. body
+        may be a list of the chunks received. The sends of the response
+        body wait for gate."""
+        messages=[]
+        chunks=list(body) if isinstance(body, list) else [body]
+        def receive():
+            f=self.loop.create_future()
+            f.set_result({"type": "http.request", "body": chunks.pop(0),
+                          "more_body": bool(chunks)})
+            return f
+        def send(message):
+            messages.append(message)
+            if gate is not None and message["type"]=="http.response.body":
+                return gate
+            f=self.loop.create_future()
+            f.set_result(None)
+            return f
+        scope={"type": "http", "method": method, "path": path,
+               "query_string": query.encode("latin-1"),
+               "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]}
+        return self.loop.create_task(self.app(scope, receive, send)), messages
+
+    def request(self, *args, **kwargs):
+        task, messages=self.start(*args, **kwargs)
+        self.loop.run_until_complete(asyncio.wait_for(task, 10))
+        return messages[0]["status"], b"".join(m.get("body", b"") for m in messages[1:])
+
+    def testQuery(self):
+        status, body=self.request("GET", "/sparql",
+                                  "query=SELECT+*+WHERE+{+GRAPH+?g+{+?s+?p+?o+}+}&output=json")
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body.decode("utf-8"))["results"]["bindings"]), 100)
+
+    def testNegativeTimeout(self):
+        status, _=self.request("GET", "/sparql", "query=ASK+{}&timeout=-1")
+        self.assertEqual(status, 400)
+
+    def testSlowClient(self):
+        # a client not reading the results does not hold off an update
+        gate=self.loop.create_future()
+        query, messages=self.start("GET", "/sparql",
+                                   "query=SELECT+*+WHERE+{+GRAPH+?g+{+?s+?p+?o+}+}&output=json",
+                                   gate=gate)
+        self.loop.run_until_complete(asyncio.sleep(0.5))
+        self.assertEqual(messages[0]["status"], 200)
+        status, _=self.request("POST", "/update",
+                               body=b'INSERT DATA { <http://example.org/x> <http://example.org/p> "x" }',
+                               headers=[("content-type", "application/sparql-update")])
+        self.assertEqual(status, 204)
+        gate.set_result(None)
+        self.loop.run_until_complete(asyncio.wait_for(query, 10))
+        body=b"".join(m.get("body", b"") for m in messages[1:])
+        self.assertEqual(len(json.loads(body.decode("utf-8"))["results"]["bindings"]), 100)
+
+    def testSlowGraphClient(self):
+        gate=self.loop.create_future()
+        get, messages=self.start("GET", "/graph-store", "graph=http://example.org/g",
+                                 headers=[("accept", "application/n-triples")], gate=gate)
+        self.loop.run_until_complete(asyncio.sleep(0.5))
+        status, _=self.request("DELETE", "/graph-store", "graph=http://example.org/g")
+        self.assertEqual(status, 204)
+        gate.set_result(None)
+        self.loop.run_until_complete(asyncio.wait_for(get, 10))
+        body=b"".join(m.get("body", b"") for m in messages[1:])
+        self.assertEqual(body.count(b"\n"), 100)
+
+    def testLockReleased(self):
+        # a query that timed out does not hold off writers until it ends
+        status, _=self.request("GET", "/sparql",
+                               "query=SELECT+*+WHERE+{+GRAPH+?g+{+?a+?p+?o+.+?b+?q+?r+.+?c+?x+?y+}+}"
+                               "&output=json&timeout=0.5")
+        self.assertEqual(status, 503)
+        start=time.time()
+        status, _=self.request("DELETE", "/graph-store", "graph=http://example.org/g")
+        self.assertEqual(status, 204)
+        self.assertTrue(time.time()-start < 5)
+
+    def testSpooledUpload(self):
+        # the body arrives in chunks and is handed over as a file
+        bodies=[]
+        graph_store=self.app.generic.graph_store
+        def spy(method, identifier, args, body, *rest):
+            bodies.append(body)
+            return graph_store(method, identifier, args, body, *rest)
+        self.app.generic.graph_store=spy
+        lines=[b'<http://example.org/s%d> <http://example.org/p> "o" .\n' % i for i in range(50)]
+        status, _=self.request("PUT", "/graph-store", "graph=http://example.org/g2", body=lines,
+                               headers=[("content-type", "application/n-triples")])
+        self.assertEqual(status, 201)
+        self.assertTrue(isinstance(bodies[0], tempfile.SpooledTemporaryFile))
+        self.assertTrue(bodies[0].closed)
+        status, body=self.request("GET", "/graph-store", "graph=http://example.org/g2",
+                                  headers=[("accept", "application/n-triples")])
+        self.assertEqual(body.count(b"\n"), 50)
@@ -0,0 +1,77 @@
+import unittest
+import json
+import cPickle as pickle
+
+import rdflib
+import rdflib_web.endpoint
+
+EX=rdflib.Namespace("http://example.org/")
+QUERY="SELECT ?s WHERE { ?s ?p ?o . }"
+
+class TestCursors(unittest.TestCase):
+
+    def setUp(self):
+        self.graph=rdflib.Graph()
+        for i in range(25):
+            self.graph.add((EX["s%d"%i], EX.p, rdflib.Literal(i)))
+        self.app=rdflib_web.endpoint.get(self.graph)
+        self.client=self.app.test_client()
+
+    def get(self, **params):
+        params["output"]="json"
+        r=self.client.get("/sparql", query_string=params, headers={"Accept": "*/*"})
+        self.assertEqual(r.status_code, 200)
+        rows=[b["s"]["value"] for b in json.loads(r.data)["results"]["bindings"]]
+        return rows, r.headers.get("X-Cursor")
+
+    def testPaging(self):
+        rows, token=self.get(query=QUERY, pagesize=10)
+        self.assertEqual(len(rows), 10)
+        more, token2=self.get(cursor=token, pagesize=10)
+        rows+=more
+        more, token3=self.get(cursor=token2, pagesize=10)
+        rows+=more
+        self.assertEqual(token3, None)
+        self.assertEqual(sorted(rows), sorted(unicode(EX["s%d"%i]) for i in range(25)))
+        # exhausted cursors are closed
+        self.assertEqual(len(self.app.config["generic"].cursors), 0)
+        r=self.client.get("/sparql", query_string={"cursor": token2}, headers={"Accept": "*/*"})
+        self.assertEqual(r.status_code, 404)
+
+    def testSpill(self):
+        rows, token=self.get(query=QUERY, pagesize=20)
+        r=self.client.put("/graph-store?default", content_type="text/turtle",
+                          data='<http://example.org/new> <http://example.org/p> 1 .')
+        self.assertEqual(r.status_code, 204)
+        # the remaining rows come from the state before the PUT
+        more, token=self.get(cursor=token, pagesize=20)
+        self.assertEqual(len(rows+more), 25)
+        self.assertFalse(unicode(EX.new) in more)
+        self.assertEqual(token, None)
+
+    def testSpilledValues(self):
+        rows, token=self.get(query=QUERY, pagesize=20)
+        cursor=self.app.config["generic"].cursors._cursors[token]
+        self.app.config["generic"].cursors.spill_all()
+        # the spill file holds the values of the rows, not their
+        # context with the graph
+        values=pickle.load(cursor.spill)
+        self.assertTrue(isinstance(values, tuple) and isinstance(values[0], rdflib.URIRef))
+        cursor.spill.seek(0)
+        more, token=self.get(cursor=token, pagesize=20)
+        self.assertEqual(len(rows+more), 25)
+
+    def testInvalidPagesize(self):
+        for pagesize in ("0", "-1", "x"):
+            r=self.client.get("/sparql", query_string={"query": QUERY, "pagesize": pagesize},
+                              headers={"Accept": "*/*"})
+            self.assertEqual(r.status_code, 400)
+
+    def testLimit(self):
+        self.app.config["max_cursors"]=1
+        rows, token=self.get(query=QUERY, pagesize=1)
+        r=self.client.get("/sparql", query_string={"query": QUERY, "pagesize": 1}, headers={"Accept": "*/*"})
+        self.assertEqual(r.status_code, 503)
+        # a result fitting on one page needs no cursor
+        rows, token=self.get(query=QUERY, pagesize=100)
+        self.assertEqual((len(rows), token), (25, None))
@@ -0,0 +1,264 @@
+import unittest
+import threading
+import time
+from io import BytesIO
+
+import rdflib
+import rdflib.plugins.sparql.parser
+from rdflib_web.generic_endpoint import GenericEndpoint
+from rdflib_web.caches import SpillingLRUCache
+from rdflib_web.parsepool import ParsePool
+from rdflib_web import bulkload
+
+EX=rdflib.Namespace("http://example.org/")
+DATA='<http://example.org/s> <http://example.org/p> "o" .'
+
+class TestGraphIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.ds=rdflib.Dataset()
+        self.generic=GenericEndpoint(self.ds, coin_url=lambda: EX.coined)
+
+    def request(self, method, graph, body=None):
+        return self.generic.graph_store(method, graph, {}, body, "text/turtle", None)[0]
+
+    def testMaintained(self):
+        self.assertFalse(self.generic.has_graph(EX.g))
+        self.assertEqual(self.request("PUT", EX.g, DATA), 201)
+        self.assertTrue(self.generic.has_graph(EX.g))
+        self.assertEqual(self.request("PUT", EX.g, DATA), 204)
+        self.assertEqual(self.request("POST", None, DATA), 201)
+        self.assertTrue(self.generic.has_graph(EX.coined))
+        self.assertEqual(self.request("DELETE", EX.g), 204)
+        self.assertFalse(self.generic.has_graph(EX.g))
+        self.assertEqual(self.request("GET", EX.g), 404)
+
+    def testChangedBehindItsBack(self):
+        self.assertFalse(self.generic.has_graph(EX.g))
+        self.ds.graph(EX.g).add((EX.s, EX.p, EX.o))
+        self.generic.changed()
+        self.assertTrue(self.generic.has_graph(EX.g))
+        self.assertEqual(self.request("GET", EX.g), 200)
+
+
+class TestGraphMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.ds=rdflib.Dataset()
+        self.generic=GenericEndpoint(self.ds, coin_url=lambda: EX.coined)
+        self.generic.graph_store("PUT", EX.g, {}, DATA, "text/turtle", None)
+        self.generic.graph_store("PUT", EX.h, {}, DATA, "text/turtle", None)
+
+    def request(self, method, graph=EX.g, if_none_match=None):
+        return self.generic.graph_store(method, graph, {}, None, None,
+                                        "text/turtle", if_none_match)
+
+    def testHead(self):
+        code, headers, body=self.request("HEAD")
+        self.assertEqual((code, body), (200, None))
+        self.assertEqual(headers["X-Graph-Triples"], "1")
+        self.assertFalse("Content-Length" in headers)
+        code, get_headers, data=self.request("GET")
+        self.assertEqual(get_headers["ETag"], headers["ETag"])
+        code, headers, body=self.request("HEAD")
+        self.assertEqual(headers["Content-Length"], str(len(data)))
+        self.assertEqual(self.request("HEAD", if_none_match=headers["ETag"])[0], 304)
+        self.assertEqual(self.request("GET", if_none_match='"x", '+headers["ETag"][2:])[0], 304)
+
+    def testModified(self):
+        etag=self.request("HEAD")[1]["ETag"]
+        other=self.request("HEAD", EX.h)[1]["ETag"]
+        self.generic.graph_store("POST", EX.g, {}, '<http://example.org/s> <http://example.org/p> "x" .',
+                                 "text/turtle", None)
+        code, headers, _=self.request("HEAD")
+        self.assertNotEqual(headers["ETag"], etag)
+        self.assertEqual(headers["X-Graph-Triples"], "2")
+        # the other graph is unchanged
+        self.assertEqual(self.request("HEAD", EX.h, other)[0], 304)
+        self.generic.changed()
+        self.assertEqual(self.request("HEAD", EX.h, other)[0], 200)
+
+
+class TestGraphCache(unittest.TestCase):
+
+    def setUp(self):
+        self.ds=rdflib.Dataset()
+        self.cache=SpillingLRUCache(spill_bytes=10)
+        self.generic=GenericEndpoint(self.ds, coin_url=lambda: EX.coined,
+                                     graph_cache=self.cache)
+        self.generic.graph_store("PUT", EX.g, {}, DATA, "text/turtle", None)
+        self.generic.graph_store("PUT", EX.h, {}, DATA, "text/turtle", None)
+
+    def get(self, graph, format):
+        body=self.generic.graph_store("GET", graph, {}, None, None, format)[2]
+        return body if isinstance(body, str) else b"".join(body)
+
+    def testInvalidation(self):
+        for format in ("text/turtle", "application/n-triples"):
+            data=self.get(EX.g, format)
+            self.assertEqual(self.get(EX.g, format), data)
+        self.get(EX.h, "text/turtle")
+        self.assertEqual((self.cache.hits, len(self.cache)), (2, 3))
+
+        self.generic.graph_store("POST", EX.g, {}, '<http://example.org/s> <http://example.org/p> "x" .',
+                                 "text/turtle", None)
+        self.assertEqual(sorted(self.cache._cache), [(EX.h, "text/turtle")])
+        self.assertTrue('"x"' in self.get(EX.g, "application/n-triples"))
+        self.generic.changed()
+        self.assertEqual(len(self.cache), 0)
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.ds=rdflib.Dataset()
+        self.generic=GenericEndpoint(self.ds, coin_url=lambda: EX.coined)
+        self.generic.graph_store("PUT", EX.g, {}, DATA, "text/turtle", None)
+
+    def write(self):
+        # from another thread, as a held read lock would block it
+        t=threading.Thread(target=self.generic.graph_store,
+                           args=("DELETE", EX.g, {}, None, None, None))
+        t.daemon=True
+        t.start()
+        t.join(5)
+        self.assertFalse(t.is_alive())
+
+    def testGraphLockReleased(self):
+        body=self.generic.graph_store("GET", EX.g, {}, None, None,
+                                      "application/n-triples")[2]
+        first=next(body)
+        self.write()
+        self.assertTrue(b'"o"' in first+b"".join(body))
+
+    def testOneReadLock(self):
+        # the ETag and the body are of the same version
+        reads=[]
+        acquire_read=self.generic.lock.acquire_read
+        def counted():
+            reads.append(1)
+            acquire_read()
+        self.generic.lock.acquire_read=counted
+        code, headers, body=self.generic.graph_store("GET", EX.g, {}, None, None,
+                                                     "application/n-triples")
+        self.assertEqual(b"".join(body).count(b"\n"), int(headers["X-Graph-Triples"]))
+        self.assertEqual(len(reads), 1)
+
+    def testDatasetLockReleased(self):
+        body=self.generic.dataset("GET", None, None, "application/n-quads")[2]
+        first=next(body)
+        self.write()
+        self.assertTrue(b"<http://example.org/g>" in first+b"".join(body))
+
+
+class TestBulkLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.ds=rdflib.Dataset()
+        self.generic=GenericEndpoint(self.ds, coin_url=lambda: EX.coined)
+        self.generic.INGEST_BATCHSIZE=3
+
+    def testNTriples(self):
+        lines=['<http://example.org/s%d> <http://example.org/p> "o\\u00e9 %d" .' % (i, i)
+               for i in range(10)]
+        body=BytesIO(("# comment\n"+"\n".join(lines)+"\n_:b <http://example.org/p> _:b .").encode("ascii"))
+        code, headers, _=self.generic.graph_store("PUT", EX.g, {}, body, "application/n-triples", None)
+        self.assertEqual(code, 201)
+        self.assertEqual(headers["X-Ingest-Triples"], "11")
+        self.assertTrue("X-Ingest-Triples-Per-Second" in headers)
+        if bulkload.resource is not None:
+            self.assertTrue(int(headers["X-Ingest-Peak-Memory-KB"])>=0)
+        g=self.ds.graph(EX.g)
+        self.assertEqual(len(g), 11)
+        self.assertTrue((EX.s3, EX.p, rdflib.Literal(u"o\xe9 3")) in g)
+        b=list(g.subjects(EX.p, None))
+        self.assertTrue(any(isinstance(s, rdflib.BNode) and (s, EX.p, s) in g for s in b))
+
+    def testNQuads(self):
+        body=('<http://example.org/s> <http://example.org/p> "o" <http://example.org/g2> .\n'
+              '<http://example.org/s> <http://example.org/p> "o" .\n')
+        code, headers, _=self.generic.graph_store("POST", EX.g, {}, body, "application/n-quads", None)
+        self.assertEqual(headers["X-Ingest-Triples"], "2")
+        self.assertEqual(len(self.ds.graph(EX.g)), 1)
+        self.assertEqual(len(self.ds.graph(EX.g2)), 1)
+        self.assertTrue(self.generic.has_graph(EX.g2))
+
+    def testBodyReadBeforeLock(self):
+        generic=self.generic
+        class Body(BytesIO):
+            locked=[]
+            def read(self, *args):
+                Body.locked.append(generic.lock._writer)
+                return BytesIO.read(self, *args)
+        code, headers, _=self.generic.graph_store("PUT", EX.g, {}, Body(DATA.encode("ascii")),
+                                                  "application/n-triples", None)
+        self.assertEqual((code, headers["X-Ingest-Triples"]), (201, "1"))
+        self.assertFalse(any(Body.locked))
+        self.assertTrue(set(["X-Ingest-Triples", "X-Ingest-Triples-Per-Second"])<=set(headers))
+
+    def testMultipart(self):
+        self.generic.parse_pool=ParsePool(workers=2)
+        try:
+            parts=[{"data": '<http://example.org/s> <http://example.org/p> "%d" .' % i,
+                    "mimetype": "text/turtle"} for i in range(3)]
+            code, headers, _=self.generic.graph_store("POST", EX.g, {}, parts,
+                                                      "multipart/form-data", None)
+            self.assertEqual((code, headers["X-Ingest-Triples"]), (201, "3"))
+            self.assertEqual(len(self.ds.graph(EX.g)), 3)
+
+            parts[1]["data"]="<broken"
+            code, _, message=self.generic.graph_store("POST", EX.g2, {}, parts,
+                                                      "multipart/form-data", None)
+            self.assertEqual(code, 400)
+            self.assertTrue(message.startswith("Part 2 (text/turtle): "))
+            self.assertFalse(self.generic.has_graph(EX.g2))
+        finally:
+            self.generic.parse_pool.close()
+
+
+class TestUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.ds=rdflib.Dataset()
+        self.generic=GenericEndpoint(self.ds, coin_url=lambda: EX.coined)
+
+    def testUpdate(self):
+        self.generic.update('INSERT DATA { GRAPH <http://example.org/g> { %s } }' % DATA)
+        self.assertTrue(self.generic.has_graph(EX.g))
+        self.assertEqual(self.generic.version, 1)
+        self.generic.update('DELETE DATA { GRAPH <http://example.org/g> { %s } }' % DATA)
+        self.assertEqual(len(self.ds.graph(EX.g)), 0)
+        self.assertRaises(Exception, self.generic.update, 'INSERT DATA { ')
+
+    def testCoalesced(self):
+        # hold the write lock so the updates queue up
+        self.generic.lock.acquire_read()
+        threads=[threading.Thread(target=self.generic.update,
+                                  args=('INSERT DATA { <http://example.org/s> <http://example.org/p> %d }' % i,))
+                 for i in range(10)]
+        for t in threads:
+            t.start()
+        for i in range(100):
+            if len(self.generic.updates._queue)==10:
+                break
+            time.sleep(0.05)
+        self.generic.lock.release_read()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.ds), 10)
+        self.assertEqual((self.generic.updates.batches, self.generic.updates.items), (1, 10))
+
+    def testFailureIsolated(self):
+        parse=rdflib.plugins.sparql.parser.parseUpdate
+        self.ds.graph(EX.g).add((EX.s, EX.p, EX.o))
+        results=self.generic._apply_updates([
+            # fails when it is evaluated, the graph exists
+            (parse('CREATE GRAPH <http://example.org/g>'), {}, None),
+            (parse('INSERT DATA { %s }' % DATA), {}, None)])
+        self.assertTrue(results[0][1] is not None)
+        self.assertTrue(results[1][1] is None)
+        self.assertEqual(len(list(self.ds.quads((EX.s, EX.p, rdflib.Literal("o"), None)))), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import gzip
+import io
+import unittest
+
+import rdflib
+import rdflib_web.endpoint
+
+QUERY="SELECT ?s ?o WHERE { ?s ?p ?o . }"
+
+class TestConditionalGet(unittest.TestCase):
+
+    def setUp(self):
+        self.graph=rdflib.Graph()
+        for i in range(50):
+            self.graph.add((rdflib.URIRef("http://example.org/s%d" % i),
+                            rdflib.URIRef("http://example.org/p"),
+                            rdflib.Literal("hello %d" % i)))
+        self.app=rdflib_web.endpoint.get(self.graph)
+        self.client=self.app.test_client()
+
+    def query(self, **headers):
+        headers.setdefault("Accept", "*/*")
+        return self.client.get("/sparql", query_string={"query": QUERY, "output": "json"},
+                               headers=headers)
+
+    def testNotModified(self):
+        r=self.query()
+        self.assertEqual(r.status_code, 200)
+        etag=r.headers["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+
+        r=self.query(**{"If-None-Match": etag})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.data, b"")
+
+        # modifying the dataset changes the etag
+        r=self.client.put("/graph-store?default", content_type="text/turtle",
+                          data='<http://example.org/s> <http://example.org/p> "new" .')
+        self.assertEqual(r.status_code, 204)
+        r=self.query(**{"If-None-Match": etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r.headers["ETag"], etag)
+
+    def testCompression(self):
+        plain=self.query().data
+        r=self.query(**{"Accept-Encoding": "gzip"})
+        self.assertEqual(r.headers["Content-Encoding"], "gzip")
+        self.assertTrue("Accept-Encoding" in r.headers["Vary"])
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(r.data)).read(), plain)
+
+        self.app.config["compression"]=False
+        r=self.query(**{"Accept-Encoding": "gzip"})
+        self.assertFalse("Content-Encoding" in r.headers)
+
+    def testGraphHead(self):
+        r=self.client.head("/graph-store?default", headers={"Accept": "text/turtle"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.headers["X-Graph-Triples"], "50")
+        self.assertFalse("Content-Length" in r.headers)
+        self.assertTrue("Last-Modified" in r.headers)
+        etag=r.headers["ETag"]
+
+        r=self.client.get("/graph-store?default", headers={"Accept": "text/turtle"})
+        self.assertEqual(r.headers["ETag"], etag)
+        length=len(r.data)
+        r=self.client.head("/graph-store?default", headers={"Accept": "text/turtle"})
+        self.assertEqual(r.headers["Content-Length"], str(length))
+        r=self.client.head("/graph-store?default",
+                           headers={"Accept": "text/turtle", "Accept-Encoding": "gzip"})
+        self.assertEqual(r.headers["Content-Encoding"], "gzip")
+        self.assertFalse("Content-Length" in r.headers)
+        r=self.client.get("/graph-store?default",
+                          headers={"Accept": "text/turtle", "If-None-Match": etag})
+        self.assertEqual(r.status_code, 304)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import rdflib
+from rdflib.compare import isomorphic
+from rdflib_web.generic_endpoint import GenericEndpoint
+from rdflib_web.journal import Journal
+
+EX=rdflib.Namespace("http://example.org/")
+
+def triple(o):
+    return '<http://example.org/s> <http://example.org/p> "%s" .' % o
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def endpoint(self, ds, **kwargs):
+        journal=Journal(self.dir, ds, **kwargs)
+        journal.start()
+        return GenericEndpoint(ds, coin_url=lambda: EX.coined, journal=journal)
+
+    def restored(self):
+        ds=rdflib.Dataset()
+        self.assertTrue(Journal(self.dir, ds).restore())
+        return ds
+
+    def assertSameDataset(self, a, b):
+        graphs=lambda ds: dict((g.identifier, g) for g in ds.contexts() if len(g))
+        ga, gb=graphs(a), graphs(b)
+        self.assertEqual(sorted(ga), sorted(gb))
+        for identifier in ga:
+            self.assertTrue(isomorphic(ga[identifier], gb[identifier]), identifier)
+
+    def testReplay(self):
+        ds=rdflib.Dataset()
+        ds.graph(EX.base).add((EX.s, EX.p, rdflib.Literal("before")))
+        generic=self.endpoint(ds)
+        generic.graph_store("PUT", EX.g, {}, triple("a")+"\n_:b <http://example.org/p> _:b .",
+                            "text/turtle", None)
+        generic.graph_store("POST", EX.g, {}, triple("b"), "application/n-triples", None)
+        generic.graph_store("PUT", EX.h, {}, triple("c"), "text/turtle", None)
+        generic.graph_store("PUT", EX.h, {}, triple("d"), "text/turtle", None)
+        generic.graph_store("POST", EX.g, {}, [{"data": triple("e"), "mimetype": "text/turtle"}],
+                            "multipart/form-data", None)
+        generic.graph_store("DELETE", EX.base, {}, None, None, None)
+        generic.graph_store("PUT", None, {"default": ""}, triple("f"), "text/turtle", None)
+        generic.update('INSERT { GRAPH <http://example.org/u> { ?s ?p "g" } } WHERE { }',
+                       {rdflib.Variable("s"): EX.s, rdflib.Variable("p"): EX.p})
+        self.assertSameDataset(self.restored(), ds)
+
+    def assertSameQuads(self, a, b):
+        # blank nodes keep their ids
+        quads=lambda ds: set((s, p, o, getattr(c, "identifier", c))
+                             for s, p, o, c in ds.quads((None, None, None, None)))
+        self.assertEqual(quads(a), quads(b))
+
+    def testUpdateDeltas(self):
+        ds=rdflib.Dataset()
+        generic=self.endpoint(ds)
+        generic.graph_store("PUT", EX.g, {}, triple("a")+"\n_:b <http://example.org/p> _:b .",
+                            "text/turtle", None)
+        # not the same when evaluated again
+        generic.update('INSERT { GRAPH <http://example.org/u> { ?b <http://example.org/q> ?id, ?n } } '
+                       'WHERE { GRAPH <http://example.org/g> { ?b <http://example.org/p> ?b } '
+                       'BIND(STRUUID() AS ?id) BIND(BNODE() AS ?n) }')
+        generic.update('DELETE WHERE { GRAPH <http://example.org/g> { ?s ?p "a" } }')
+        generic.update('DROP GRAPH <http://example.org/g>')
+        self.assertEqual(len(ds.graph(EX.u)), 2)
+        self.assertSameQuads(self.restored(), ds)
+
+    def testPartialUpdate(self):
+        ds=rdflib.Dataset()
+        generic=self.endpoint(ds)
+        generic.graph_store("PUT", EX.g, {}, triple("a"), "text/turtle", None)
+        # the insert is applied, the store is not transactional
+        self.assertRaises(Exception, generic.update,
+                          'INSERT DATA { GRAPH <http://example.org/u> { %s } } ; '
+                          'CREATE GRAPH <http://example.org/g>' % triple("b"))
+        self.assertEqual(len(ds.graph(EX.u)), 1)
+        self.assertSameQuads(self.restored(), ds)
+
+    def testQuadFormat(self):
+        ds=rdflib.Dataset()
+        generic=self.endpoint(ds)
+        trix=('<TriX xmlns="http://www.w3.org/2004/03/trix/trix-1/"><graph>'
+              '<uri>http://example.org/t</uri><triple><uri>http://example.org/s</uri>'
+              '<uri>http://example.org/p</uri><plainLiteral>o</plainLiteral></triple>'
+              '</graph></TriX>')
+        code, _, _=generic.graph_store("POST", EX.g, {}, trix, "application/trix", None)
+        self.assertEqual(code, 201)
+        self.assertEqual(len(ds.graph(EX.t)), 1)
+        restored=self.restored()
+        self.assertEqual(len(restored.graph(EX.t)), 1)
+        self.assertSameQuads(restored, ds)
+
+    def testIncompleteTail(self):
+        ds=rdflib.Dataset()
+        generic=self.endpoint(ds)
+        generic.graph_store("PUT", EX.g, {}, triple("a"), "text/turtle", None)
+        generic.journal.close()
+        journals=[f for f in os.listdir(self.dir) if f.startswith("journal")]
+        with open(os.path.join(self.dir, journals[0]), "ab") as f:
+            f.write(b"#op CLEAR <http://example.org/g>\n<http://example.org/s> <http")
+        self.assertEqual(len(self.restored().graph(EX.g)), 1)
+
+        # continued after the crash
+        generic=self.endpoint(self.restored())
+        generic.graph_store("POST", EX.g, {}, triple("b"), "text/turtle", None)
+        self.assertEqual(len(self.restored().graph(EX.g)), 2)
+
+    def testSnapshot(self):
+        ds=rdflib.Dataset()
+        generic=self.endpoint(ds, snapshot_bytes=200)
+        for i in range(10):
+            generic.graph_store("POST", EX.g, {}, triple(i), "text/turtle", None)
+        names=sorted(os.listdir(self.dir))
+        self.assertTrue(names[-1] > "snapshot-00000001", names)
+        self.assertEqual(len([n for n in names if n.startswith("snapshot")]), 1)
+        self.assertSameDataset(self.restored(), ds)
+
+    def testPlainGraph(self):
+        g=rdflib.Graph()
+        generic=self.endpoint(g)
+        generic.graph_store("POST", None, {"default": ""}, triple("a"), "text/turtle", None)
+        restored=rdflib.Graph()
+        Journal(self.dir, restored).restore()
+        self.assertTrue(isomorphic(restored, g))
+
+    def testFingerprint(self):
+        ds=rdflib.Dataset()
+        generic=self.endpoint(ds)
+        before=generic.journal.fingerprint()
+        generic.graph_store("PUT", EX.g, {}, triple("a"), "text/turtle", None)
+        after=generic.journal.fingerprint()
+        self.assertNotEqual(after, before)
+        generic.journal.close()
+        journal=Journal(self.dir, rdflib.Dataset())
+        journal.restore()
+        self.assertEqual(journal.fingerprint(), after)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,266 @@
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import rdflib
+from rdflib import RDF, RDFS
+
+import rdflib_web.lod as lod
+from rdflib_web import lodindex, compactindex
+
+EX=rdflib.Namespace("http://example.org/")
+OTHER=rdflib.Namespace("http://other.org/")
+DATA='''
+@prefix ex: <http://example.org/> .
+@prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+ex:book1 a ex:Book ; rdfs:label "One" .
+ex:book2 a ex:Book .
+'''
+
+class TestBuild(unittest.TestCase):
+
+    def testBuild(self):
+        graph=rdflib.Graph()
+        graph.parse(data=DATA, format="turtle")
+        graph.add((EX.book2, lodindex.LABEL_PROPERTIES[1], rdflib.Literal("Two")))
+        graph.add((OTHER.book2, RDF.type, EX.Book))
+        progress=[]
+        index=lodindex.build(graph, progress=lambda phase, n: progress.append((phase, n)))
+        self.assertEqual(progress[0], ("types", 3))
+        self.assertEqual(len(progress), 1+len(lodindex.LABEL_PROPERTIES))
+        self.assertEqual(index["rtypes"]["Book"], EX.Book)
+        self.assertEqual(sorted(index["rresources"][EX.Book]), ["book1", "book2", "book2_"])
+        self.assertEqual(index["resource_types"][EX.Book], set([RDFS.Class]))
+        self.assertEqual(index["labels"][EX.book1], rdflib.Literal("One"))
+        self.assertEqual(index["labels"][EX.book2], rdflib.Literal("Two"))
+        self.assertEqual(index["labels"][EX.Book], "Book")
+        self.assertEqual(index["resources"][RDFS.Class][EX.Book], "Book")
+
+        index=lodindex.build(graph, None)
+        self.assertEqual(len(index["resources"][None]), 3)
+
+    def testClashingLabels(self):
+        # the labels are given as when the resources of each type were
+        # looked up into a dict
+        graph=rdflib.Graph()
+        for i in range(20):
+            for ns in (EX, OTHER, rdflib.Namespace("http://third.org/")):
+                graph.add((ns["r%d" % i], RDF.type, EX.Thing))
+                if i%2:
+                    graph.add((ns["r%d" % i], RDF.type, EX.Other))
+        index=lodindex.build(graph)
+        for t in (EX.Thing, EX.Other):
+            res={}
+            for x in graph.subjects(RDF.type, t):
+                res[x]=lodindex.localname(x)
+            rres={}
+            for x, l in res.items():
+                while l in rres:
+                    l+="_"
+                rres[l]=x
+            self.assertEqual(index["rresources"][t], rres)
+            self.assertEqual(lodindex.LazyIndex(graph).rresources[t], rres)
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.path=os.path.join(self.dir, "index")
+        self.graph=rdflib.Graph()
+        self.graph.parse(data=DATA, format="turtle")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testSaveLoad(self):
+        self.assertEqual(lodindex.load(self.path, "key"), None)
+        index=lodindex.build(self.graph)
+        lodindex.save(index, self.path, "key")
+        self.assertEqual(lodindex.load(self.path, "other"), None)
+        loaded=lodindex.load(self.path, "key")
+        self.assertEqual(sorted(loaded), sorted(lodindex.INDEXES))
+        for name in lodindex.INDEXES:
+            self.assertEqual(loaded[name], index[name])
+
+    def testApp(self):
+        app=lod.get(self.graph, index_snapshot=self.path, index_fingerprint="v1")
+        self.assertTrue(os.path.exists(self.path))
+        # the data is not read again while the fingerprint is the same
+        self.graph.add((EX.book3, RDF.type, EX.Book))
+        app=lod.get(self.graph, index_snapshot=self.path, index_fingerprint="v1")
+        self.assertFalse(EX.book3 in app.config["resources"][EX.Book])
+        self.assertEqual(app.test_client().get("/page/Book/book1").status_code, 200)
+        app=lod.get(self.graph, index_snapshot=self.path, index_fingerprint="v2")
+        self.assertTrue(EX.book3 in app.config["resources"][EX.Book])
+
+
+class TestIncrementalIndex(unittest.TestCase):
+
+    options={}
+
+    def setUp(self):
+        self.graph=rdflib.Graph()
+        self.graph.parse(data=DATA, format="turtle")
+        self.app=lod.get(self.graph, **self.options)
+        self.client=self.app.test_client()
+        self.config=self.app.config
+
+    def post(self, data):
+        r=self.client.post("/graph-store?default", data=data, content_type="text/turtle")
+        self.assertEqual(r.status_code, 204)
+
+    def testAdded(self):
+        self.assertEqual(self.client.get("/page/Book/book3").status_code, 404)
+        self.post('<http://example.org/book3> a <http://example.org/Book> ; '
+                  '<http://www.w3.org/2000/01/rdf-schema#label> "Three" .')
+        self.assertEqual(self.client.get("/page/Book/book3").status_code, 200)
+        self.assertEqual(self.config["labels"][EX.book3], rdflib.Literal("Three"))
+
+        self.post('<http://example.org/x> a <http://example.org/Journal> .')
+        self.assertEqual(self.config["rtypes"]["Journal"], EX.Journal)
+        self.assertEqual(self.client.get("/page/Journal/x").status_code, 200)
+        self.assertEqual(self.client.get("/page/Class/Journal").status_code, 200)
+
+    def testStableLabels(self):
+        self.post('<http://other.org/book1> a <http://example.org/Book> .')
+        self.assertEqual(self.config["rresources"][EX.Book]["book1"], EX.book1)
+        self.assertEqual(self.config["rresources"][EX.Book]["book1_"], OTHER.book1)
+        self.post('<http://other.org/Book> a <http://other.org/Book> .')
+        self.assertEqual(self.config["types"][EX.Book], "Book")
+        self.assertEqual(self.config["types"][OTHER.Book], "Book_")
+
+    def testUpdate(self):
+        # builds the type of a lazy index
+        self.assertEqual(self.client.get("/page/Book/book1").status_code, 200)
+        self.post('<http://other.org/book1> a <http://example.org/Book> .')
+        resources=self.config["resources"]
+        r=self.client.post("/update", data={"update":
+            'INSERT DATA { <http://example.org/book3> a <http://example.org/Book> ; '
+            '<http://www.w3.org/2000/01/rdf-schema#label> "Three" }'})
+        self.assertEqual(r.status_code, 204)
+        self.assertEqual(self.client.get("/page/Book/book3").status_code, 200)
+        # updated, not rebuilt
+        self.assertTrue(self.config["resources"] is resources)
+        self.assertEqual(self.config["rresources"][EX.Book]["book1_"], OTHER.book1)
+        r=self.client.post("/update", data={"update":
+            'DELETE WHERE { <http://example.org/book3> ?p ?o }'})
+        self.assertEqual(self.client.get("/page/Book/book3").status_code, 404)
+
+    def testRemoved(self):
+        self.client.get("/page/Book/book1")
+        r=self.client.put("/graph-store?default", content_type="text/turtle",
+                          data='<http://example.org/book1> a <http://example.org/Novel> .')
+        self.assertEqual(r.status_code, 204)
+        self.assertFalse(EX.book1 in self.config["resources"][EX.Book])
+        self.assertEqual(self.client.get("/page/Book/book2").status_code, 404)
+        self.assertEqual(self.client.get("/page/Novel/book1").status_code, 200)
+        self.assertEqual(self.config["labels"][EX.book1], "book1")
+        self.assertFalse(EX.Book in self.config["types"])
+
+
+class TestQuadUpload(unittest.TestCase):
+
+    def testTriX(self):
+        graph=rdflib.ConjunctiveGraph()
+        graph.parse(data=DATA, format="turtle")
+        app=lod.get(graph)
+        client=app.test_client()
+        trix=('<TriX xmlns="http://www.w3.org/2004/03/trix/trix-1/"><graph>'
+              '<uri>http://example.org/t</uri><triple><uri>http://example.org/book5</uri>'
+              '<uri>http://www.w3.org/1999/02/22-rdf-syntax-ns#type</uri>'
+              '<uri>http://example.org/Book</uri></triple></graph></TriX>')
+        r=client.post("/graph-store?graph=http://example.org/g", data=trix,
+                      content_type="application/trix")
+        self.assertEqual(r.status_code, 201)
+        # in the graph named in the document
+        self.assertEqual(len(graph.get_context(EX.t)), 1)
+        self.assertEqual(client.get("/page/Book/book5").status_code, 200)
+
+
+class TestCompactIndex(TestIncrementalIndex):
+
+    options={"compact_index": True}
+
+    def testLayout(self):
+        self.graph.add((OTHER.book1, RDF.type, EX.Book))
+        for types in ('auto', None):
+            index=lodindex.build(self.graph, types)
+            compact=compactindex.compact(lodindex.build(self.graph, types))
+            for name in ("resources", "rresources"):
+                for t in index[name]:
+                    self.assertEqual(dict(compact[name][t]), index[name][t])
+            self.assertEqual(dict(compact["resource_types"]), index["resource_types"])
+            # the labels are kept as plain strings
+            self.assertEqual(dict(compact["labels"]),
+                             dict((r, unicode(l)) for r, l in index["labels"].items()))
+        self.assertEqual(set([compact["rresources"][None]["book1"],
+                              compact["rresources"][None]["book1_"]]),
+                         set([EX.book1, OTHER.book1]))
+        self.assertFalse("book3" in compact["rresources"][None])
+        self.assertEqual(compact["resource_types"][EX.book3], set())
+
+
+class TestLazyIndex(TestIncrementalIndex):
+
+    options={"lazy_index": True}
+
+    def testLazy(self):
+        self.graph.add((OTHER.x, RDF.type, EX.Journal))
+        index=lodindex.LazyIndex(self.graph)
+        self.assertEqual(index.rtypes["Journal"], EX.Journal)
+        self.assertEqual(index.labels, {})
+        self.assertEqual(index.resources[EX.Book][EX.book1], "book1")
+        self.assertTrue(index.built(EX.Book))
+        self.assertFalse(index.built(EX.Journal))
+        self.assertEqual(index.labels[EX.book1], rdflib.Literal("One"))
+        self.assertEqual(index.resource_types[EX.Journal], set([RDFS.Class]))
+
+        index.warm_up()
+        built=lodindex.build(self.graph)
+        for name in ("types", "rtypes", "resources", "rresources", "labels"):
+            self.assertEqual(dict(index.indexes()[name]), dict(built[name]))
+        for r, types in built["resource_types"].items():
+            self.assertEqual(index.resource_types[r], types)
+
+    def testStableLabels(self):
+        # the labels are kept once the type is built
+        self.assertEqual(self.client.get("/page/Book/book1").status_code, 200)
+        TestIncrementalIndex.testStableLabels(self)
+
+    def testWarmUp(self):
+        self.assertEqual(self.client.get("/page/Book/book1").status_code, 200)
+        lazy=self.config["lazy"]
+        self.config["warm_up"].join(10)
+        self.assertFalse(self.config["warm_up"].is_alive())
+        self.assertEqual([t for t in list(lazy.types)+[RDFS.Class] if not lazy.built(t)], [])
+
+    def testStopWarmUp(self):
+        # a rebuilt index, warmed up once the write lock is released, is
+        # stopped before building more than the type it waits for
+        self.assertEqual(self.client.get("/page/Book/book1").status_code, 200)
+        registered=[]
+        register=atexit.register
+        atexit.register=lambda *args: registered.append(args)
+        try:
+            with self.config["generic"].lock.writing():
+                lod._index(self.config, self.graph, 'auto')
+                lazy=self.config["lazy"]
+                stop=threading.Thread(target=lod._stop_warm_up, args=(self.config,))
+                stop.start()
+                while not lazy.stopped:
+                    time.sleep(0.01)
+        finally:
+            atexit.register=register
+        stop.join(10)
+        # the handler registered for the first index stops this one
+        self.assertEqual(registered, [])
+        self.assertFalse(self.config["warm_up"].is_alive())
+        self.assertTrue(sum(1 for t in lazy.types if lazy.built(t))<=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+import rdflib
+import rdflib_web.endpoint
+from rdflib_web.metrics import Metrics, RequestTimer
+
+QUERY="SELECT ?s ?o WHERE { ?s ?p ?o . }"
+
+class TestRequestTimer(unittest.TestCase):
+
+    def testRowsAreEvaluation(self):
+        m=Metrics(buckets=(1,))
+        timer=RequestTimer(m, "SELECT", "json")
+        def rows():
+            timer.add("evaluation", 0.5) # as if computing took a while
+            yield 1
+        self.assertEqual(list(timer.chunks(timer.rows(rows()))), [1])
+        timer.finish()
+        timer.finish()
+        self.assertTrue(timer.phases["evaluation"]>=0.5)
+        self.assertTrue(timer.phases["serialization"]<0.5)
+        self.assertEqual(m.histogram("evaluation", "SELECT", "json").count, 1)
+        self.assertTrue('le="+Inf"} 1' in m.render())
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.graph=rdflib.Graph()
+        self.graph.add((rdflib.URIRef("http://example.org/s"),
+                        rdflib.URIRef("http://example.org/p"),
+                        rdflib.Literal("hello")))
+        self.app=rdflib_web.endpoint.get(self.graph)
+        self.client=self.app.test_client()
+
+    def testPhases(self):
+        for output in ("json", "html"):
+            r=self.client.get("/sparql", query_string={"query": QUERY, "output": output},
+                              headers={"Accept": "*/*"})
+            self.assertEqual(r.status_code, 200)
+            r.close()
+        self.client.get("/graph-store?default", headers={"Accept": "text/turtle"})
+
+        m=self.app.config["generic"].metrics
+        for phase in ("parse", "algebra", "evaluation", "serialization"):
+            self.assertEqual(m.histogram(phase, "SELECT", "json").count, 1)
+        self.assertEqual(m.histogram("render", "SELECT", "html").count, 1)
+        self.assertEqual(m.histogram("serialization", "GET", "text/turtle").count, 1)
+
+        r=self.client.get("/metrics")
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.headers["Content-Type"].startswith("text/plain"))
+        self.assertTrue('phase="evaluation",form="SELECT",format="json"' in r.data)
+        self.assertTrue('rdflib_web_lock_acquisitions_total{mode="read"}' in r.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
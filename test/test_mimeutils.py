@@ -0,0 +1,48 @@
+import unittest
+
+from rdflib_web import mimeutils
+
+class TestNegotiation(unittest.TestCase):
+
+    def testResultFormat(self):
+        self.assertEqual(mimeutils.resultformat(None), "xml")
+        self.assertEqual(mimeutils.resultformat("*/*"), "xml")
+        self.assertEqual(mimeutils.resultformat(
+            "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"), "html")
+        self.assertEqual(mimeutils.resultformat(
+            "application/sparql-results+json, */*;q=0.1"), "json")
+        self.assertEqual(mimeutils.resultformat("text/csv;q=0.5, text/tab-separated-values"), "tsv")
+
+    def testWithoutMimeparse(self):
+        mimeparse=mimeutils.mimeparse
+        mimeutils.mimeparse=None
+        try:
+            self.assertEqual(mimeutils.resultformat(None), "xml")
+            self.assertEqual(mimeutils.resultformat("*/*"), "xml")
+            self.assertEqual(mimeutils.resultformat(
+                "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"), "html")
+            self.assertEqual(mimeutils.resultformat(
+                "application/sparql-results+json, */*;q=0.1"), "json")
+            self.assertEqual(mimeutils.resultformat(
+                "text/html, application/sparql-results+json"), "json")
+        finally:
+            mimeutils.mimeparse=mimeparse
+
+    def testCached(self):
+        n=mimeutils.Negotiator([mimeutils.N3_MIME, mimeutils.RDFXML_MIME], mimeutils.HTML_MIME)
+        for i in range(3):
+            self.assertEqual(n.best_match("text/n3, */*;q=0.1"), mimeutils.N3_MIME)
+        self.assertEqual((n.cache.hits, len(n.cache)), (2, 1))
+        self.assertEqual(n.best_match("image/png"), mimeutils.HTML_MIME)
+        self.assertEqual(n.best_match("text"), mimeutils.HTML_MIME)
+        self.assertTrue(mimeutils.negotiator([mimeutils.N3_MIME]) is
+                        mimeutils.negotiator([mimeutils.N3_MIME]))
+
+    def testGraphMimetypes(self):
+        types=mimeutils.graph_mimetypes([mimeutils.TURTLE_MIME, mimeutils.RDFXML_MIME])
+        self.assertEqual(types[-2:], [mimeutils.TURTLE_MIME, mimeutils.RDFXML_MIME])
+        self.assertFalse("application/n-quads" in types)
+
+
+if __name__ == "__main__":
+    unittest.main()
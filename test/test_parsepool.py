@@ -0,0 +1,44 @@
+import unittest
+
+import rdflib
+from rdflib_web.parsepool import ParsePool
+
+DATA='_:b <http://example.org/p> "%d" .'
+
+class TestParsePool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool=ParsePool(workers=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def testParallel(self):
+        parts=[(DATA % i, "nt") for i in range(4)]
+        parts.append(('<http://example.org/s> <http://example.org/p> "o" <http://example.org/g> .',
+                      "nquads"))
+        results=self.pool.parse(parts)
+        self.assertEqual([error for _, error in results], [None]*5)
+        # blank nodes of different parts are different
+        bnodes=set(quads[0][0] for quads, _ in results[:4])
+        self.assertEqual(len(bnodes), 4)
+        self.assertEqual(results[4][0][0][3], rdflib.URIRef("http://example.org/g"))
+
+    def testStartClose(self):
+        pool=self.pool.start()
+        self.assertTrue(self.pool.start() is pool)
+        self.pool.close()
+        self.assertTrue(self.pool._pool is None)
+        # started again when needed
+        results=self.pool.parse([(DATA % i, "nt") for i in range(2)])
+        self.assertEqual([error for _, error in results], [None]*2)
+
+    def testError(self):
+        results=self.pool.parse([(DATA % 1, "nt"), ("<broken", "text/turtle")])
+        self.assertEqual(results[0][1], None)
+        self.assertEqual(results[1][0], None)
+        self.assertTrue(results[1][1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import rdflib
+import rdflib_web.endpoint
+from rdflib_web.caches import LRUCache, SpillingLRUCache
+
+QUERY="SELECT ?o WHERE { <http://example.org/s> ?p ?o . }"
+
+class TestLRUCache(unittest.TestCase):
+
+    def testLimits(self):
+        c=LRUCache(maxsize=3, maxbytes=10)
+        c.put(1, "aaaa")
+        c.put(2, "bbbb")
+        c.get(1)
+        c.put(3, "cccc") # too many bytes, evicts 2
+        self.assertEqual(sorted(c._cache), [1,3])
+        self.assertFalse(c.put(4, "x"*11))
+        self.assertEqual(c.bytes, 8)
+        self.assertEqual((c.hits, c.misses, c.evictions), (1, 0, 1))
+
+    def testClear(self):
+        c=LRUCache(maxsize=3)
+        c.put(1, "a")
+        c.get(1)
+        c.clear(keep_statistics=True)
+        self.assertEqual((len(c), c.hits), (0, 1))
+        c.clear()
+        self.assertEqual((c.hits, c.misses, c.evictions), (0, 0, 0))
+
+
+class TestSpillingLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir=tempfile.mkdtemp()
+        self.cache=SpillingLRUCache(maxsize=3, maxbytes=20, spill_bytes=5,
+                                    spill_dir=self.dir, chunksize=4)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testSpill(self):
+        c=self.cache
+        c.put(1, b"small")
+        self.assertEqual(c.open(1), b"small")
+        self.assertEqual(list(c.cache_chunks(2, [b"abc", b"def", b"ghi"])), [b"abc", b"def", b"ghi"])
+        self.assertEqual(len(os.listdir(self.dir)), 1)
+        chunks=c.open(2)
+        c.open(1)
+        self.assertEqual(c.bytes, 14)
+        # the reader keeps the file after it was dropped
+        c.put(3, b"x"*10)
+        self.assertEqual(sorted(c._cache), [1, 3])
+        self.assertEqual(b"".join(chunks), b"abcdefghi")
+        self.assertEqual(len(os.listdir(self.dir)), 1)
+        c.clear()
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def testIncomplete(self):
+        c=self.cache
+        chunks=c.cache_chunks(1, [b"abc", b"def", b"ghi"])
+        next(chunks)
+        next(chunks)
+        chunks.close()
+        self.assertEqual(os.listdir(self.dir), [])
+        list(c.cache_chunks(1, [b"x"*15, b"x"*15])) # too large
+        self.assertEqual((len(c), os.listdir(self.dir)), (0, []))
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.graph=rdflib.Graph()
+        self.app=rdflib_web.endpoint.get(self.graph)
+        self.app.config["query_cache_entries"]=10
+        self.client=self.app.test_client()
+
+    def query(self, q=QUERY, output="json"):
+        return self.client.get("/sparql", query_string={"query": q, "output": output},
+                               headers={"Accept": "*/*"}).data
+
+    def testInvalidation(self):
+        self.assertFalse("hello" in self.query())
+        # whitespace differences share the entry
+        self.query("  "+QUERY.replace(" ", " \t "))
+        cache=self.app.config["generic"].query_cache
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        r=self.client.put("/graph-store?default", content_type="text/turtle",
+                          data='<http://example.org/s> <http://example.org/p> "hello" .')
+        self.assertEqual(r.status_code, 204)
+        self.assertTrue("hello" in self.query())
+        self.assertEqual(cache.misses, 2)
+
+        # html results are cached without the surrounding page
+        self.query(output="html")
+        self.assertTrue("hello" in self.query(output="html"))
+        self.assertEqual(cache.hits, 2)
+
+    def testUpdate(self):
+        self.assertFalse("hello" in self.query())
+        r=self.client.post("/update", data={"update":
+            'INSERT DATA { <http://example.org/s> <http://example.org/p> "hello" }'})
+        self.assertEqual(r.status_code, 204)
+        self.assertTrue("hello" in self.query())
+        r=self.client.post("/update", content_type="application/sparql-update", data="DELETE DATA {")
+        self.assertEqual(r.status_code, 400)
+
+
+class TestPreparedQueries(unittest.TestCase):
+
+    def testBindings(self):
+        graph=rdflib.Graph()
+        graph.bind("ex", "http://example.org/")
+        graph.parse(data='<http://example.org/s> <http://example.org/p> "hello", "world" .', format="turtle")
+        app=rdflib_web.endpoint.get(graph)
+        client=app.test_client()
+        for value in ('"hello"', '"world"'):
+            r=client.get("/sparql", headers={"Accept": "*/*"}, query_string={
+                "query": "SELECT ?s WHERE { ?s ex:p ?o }", "output": "json", "$o": value})
+            self.assertTrue("http://example.org/s" in r.data)
+        r=client.get("/sparql", headers={"Accept": "*/*"}, query_string={
+            "query": "SELECT ?s WHERE { ?s ex:p ?o }", "output": "json", "$o": '"nope"'})
+        self.assertFalse("http://example.org/s" in r.data)
+        cache=app.config["generic"].prepared_cache
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
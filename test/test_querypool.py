@@ -0,0 +1,111 @@
+import unittest
+import threading
+import time
+
+import rdflib
+import rdflib_web.endpoint
+from rdflib_web.querypool import QueryPool, PoolFull, QueryTimeout, checked
+
+class TestQueryPool(unittest.TestCase):
+
+    def testChunks(self):
+        pool=QueryPool(workers=2)
+        self.assertEqual(list(pool.submit(lambda: iter(["a", "b", "c"]))), ["a", "b", "c"])
+
+    def testError(self):
+        pool=QueryPool(workers=1)
+        def fail():
+            raise ValueError("broken")
+        self.assertRaises(ValueError, list, pool.submit(fail))
+
+    def testTimeout(self):
+        pool=QueryPool(workers=1, timeout=10)
+        self.assertEqual(pool.timeout_for("0.1"), 0.1)
+        self.assertEqual(pool.timeout_for("20"), 10)
+        self.assertRaises(ValueError, pool.timeout_for, "-1")
+        self.assertRaises(ValueError, pool.timeout_for, "nan")
+
+        produced=[]
+        def slow():
+            for i in range(100):
+                time.sleep(0.05)
+                produced.append(i)
+                yield str(i)
+        chunks=pool.submit(slow, timeout=0.2)
+        self.assertRaises(QueryTimeout, list, chunks)
+        time.sleep(0.3)
+        # the worker stopped after the job was cancelled and is free again
+        self.assertTrue(len(produced) < 20)
+        self.assertEqual(list(pool.submit(lambda: ["x"], timeout=1)), ["x"])
+
+    def testChecked(self):
+        # work handing over all its chunks at the end stops at the deadline
+        pool=QueryPool(workers=1)
+        produced=[]
+        def slow():
+            for i in range(100):
+                time.sleep(0.05)
+                produced.append(i)
+                yield str(i)
+        def spooled():
+            yield "".join(checked(slow()))
+        self.assertRaises(QueryTimeout, list, pool.submit(spooled, timeout=0.2))
+        time.sleep(0.3)
+        self.assertTrue(len(produced) < 20)
+        self.assertEqual(list(checked(["a", "b"])), ["a", "b"])
+
+    def testFull(self):
+        pool=QueryPool(workers=1, queue_size=1)
+        block=threading.Event()
+        def wait():
+            block.wait()
+            return ["done"]
+        running=pool.submit(wait)
+        time.sleep(0.1) # taken by the worker
+        queued=pool.submit(wait)
+        self.assertRaises(PoolFull, pool.submit, wait)
+        block.set()
+        self.assertEqual(list(running)+list(queued), ["done", "done"])
+
+
+class TestEndpointTimeout(unittest.TestCase):
+
+    def setUp(self):
+        graph=rdflib.Graph()
+        for i in range(500):
+            graph.add((rdflib.URIRef("http://example.org/s%d" % i),
+                       rdflib.RDFS.label, rdflib.Literal("x" * 50)))
+        self.app=rdflib_web.endpoint.get(graph)
+        self.app.config["stream_chunksize"]=1024
+        self.client=self.app.test_client()
+        # the first query sets up the app and the parser
+        self.client.get("/sparql", query_string={"query": "ASK {}"})
+
+    def testNegative(self):
+        r=self.client.get("/sparql", query_string={"query": "ASK {}", "timeout": "-1"})
+        self.assertEqual(r.status_code, 400)
+
+    def testSlowClient(self):
+        # the deadline only applies to the evaluation
+        r=self.client.get("/sparql", query_string={"query": "SELECT * WHERE { ?s ?p ?o }",
+                                                   "output": "json", "timeout": "1"},
+                          buffered=False)
+        self.assertEqual(r.status_code, 200)
+        chunks=iter(r.response)
+        first=next(chunks)
+        time.sleep(2)
+        data=first+b"".join(chunks)
+        self.assertTrue(data.rstrip().endswith(b"}"))
+        self.assertEqual(data.count(b'"value": "xxx'), 500)
+        r.close()
+
+    def testLockReleased(self):
+        # a query that timed out does not hold off writers until it ends
+        r=self.client.get("/sparql", query_string={"query": "SELECT * WHERE { ?a ?p ?o . ?b ?q ?r }",
+                                                   "output": "json", "timeout": "0.5"})
+        self.assertEqual(r.status_code, 503)
+        start=time.time()
+        r=self.client.put("/graph-store?default", data="<http://example.org/a> <http://example.org/b> <http://example.org/c> .",
+                          content_type="application/n-triples")
+        self.assertEqual(r.status_code, 204)
+        self.assertTrue(time.time()-start < 5)
@@ -0,0 +1,46 @@
+import unittest
+import threading
+import time
+
+from rdflib_web.rwlock import ReadWriteLock
+
+class TestReadWriteLock(unittest.TestCase):
+
+    def testConcurrentReaders(self):
+        lock=ReadWriteLock()
+        lock.acquire_read()
+        got=threading.Event()
+        def reader():
+            with lock.reading():
+                got.set()
+        threading.Thread(target=reader).start()
+        self.assertTrue(got.wait(1))
+        lock.release_read()
+
+    def testWriterPreference(self):
+        lock=ReadWriteLock()
+        order=[]
+        lock.acquire_read()
+
+        def writer():
+            with lock.writing():
+                order.append("write")
+        def reader():
+            with lock.reading():
+                order.append("read")
+
+        w=threading.Thread(target=writer)
+        w.start()
+        time.sleep(0.1) # writer waits for the first reader
+        r=threading.Thread(target=reader)
+        r.start()
+        time.sleep(0.1) # late reader waits for the writer
+        self.assertEqual(order, [])
+        lock.release_read()
+        w.join(1)
+        r.join(1)
+        self.assertEqual(order, ["write", "read"])
+
+        stats=lock.stats()
+        self.assertEqual((stats["reads"], stats["writes"]), (2, 1))
+        self.assertTrue(stats["max_write_wait"]>=0.1)
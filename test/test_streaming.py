@@ -0,0 +1,131 @@
+import unittest
+import json
+import re
+from io import BytesIO
+
+import rdflib
+import rdflib_web.endpoint
+from rdflib_web import streaming
+from rdflib_web.bookdb import bookdb
+
+QUERY="SELECT * WHERE { ?s ?p ?o . }"
+
+class TestStreamingResults(unittest.TestCase):
+
+    def setUp(self):
+        self.app=rdflib_web.endpoint.get(bookdb)
+        self.client=self.app.test_client()
+
+    def query(self, output, q=QUERY):
+        return self.client.get("/sparql", query_string={"query": q, "output": output},
+                               headers={"Accept": "*/*"})
+
+    def testSmallChunks(self):
+        chunks=list(streaming.serialize_xml(bookdb.query(QUERY), chunksize=100))
+        self.assertTrue(len(chunks)>2)
+        parsed=rdflib.query.Result.parse(BytesIO(b"".join(chunks)), format="xml")
+        self.assertEqual(len(parsed), len(bookdb))
+
+    def testXML(self):
+        r=self.query("xml")
+        self.assertEqual(r.status_code, 200)
+        self.assertFalse("Content-Length" in r.headers)
+        self.assertEqual(r.headers["Content-Type"], "application/sparql-results+xml")
+        parsed=rdflib.query.Result.parse(BytesIO(r.data), format="xml")
+        self.assertEqual(set(parsed), set(bookdb.query(QUERY)))
+
+    def testJSON(self):
+        r=self.query("json")
+        self.assertEqual(r.status_code, 200)
+        res=json.loads(r.data)
+        self.assertEqual(len(res["results"]["bindings"]), len(bookdb))
+        self.assertEqual(set(res["head"]["vars"]), set(["s","p","o"]))
+
+    def testASK(self):
+        r=self.query("json", "ASK { ?s ?p ?o }")
+        self.assertEqual(json.loads(r.data), {"head": {}, "boolean": True})
+
+    def testHTML(self):
+        r=self.query("html")
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue("Query Results" in r.data)
+        self.assertEqual(r.data.count("<tr>"), len(bookdb)+1)
+        self.assertFalse("__EXECUTION_TIME__" in r.data)
+
+    def testNotStreamed(self):
+        self.app.config["stream_results"]=False
+        r=self.query("xml")
+        self.assertTrue("Content-Length" in r.headers)
+        parsed=rdflib.query.Result.parse(BytesIO(r.data), format="xml")
+        self.assertEqual(len(parsed), len(bookdb))
+
+    def testCSV(self):
+        r=self.client.get("/sparql", query_string={"query": QUERY}, headers={"Accept": "text/csv"})
+        self.assertEqual(r.headers["Content-Type"], "text/csv")
+        lines=r.data.split("\r\n")
+        self.assertEqual(lines[0].split(","), ["s", "p", "o"])
+        self.assertEqual(len(lines), len(bookdb)+2)
+
+    def testEscaping(self):
+        g=rdflib.Graph()
+        g.add((rdflib.BNode("b1"), rdflib.URIRef("http://example.org/p"), rdflib.Literal(u'say "h\xe9llo",\n\tworld', lang="en")))
+        q="SELECT ?s ?o WHERE { ?s ?p ?o }"
+        csv=b"".join(streaming.serialize_csv(g.query(q)))
+        self.assertEqual(csv, u's,o\r\n_:b1,"say ""h\xe9llo"",\n\tworld"\r\n'.encode("utf-8"))
+        tsv=b"".join(streaming.serialize_tsv(g.query(q)))
+        self.assertEqual(tsv, u'?s\t?o\r\n_:b1\t"say \\"h\xe9llo\\",\\n\\tworld"@en\r\n'.encode("utf-8"))
+
+    def testGraphStore(self):
+        r=self.client.get("/graph-store?default", headers={"Accept": "application/n-triples"})
+        self.assertEqual(r.status_code, 200)
+        self.assertFalse("Content-Length" in r.headers)
+        g=rdflib.Graph().parse(data=r.data, format="nt")
+        self.assertEqual(len(g), len(bookdb))
+
+    def testNQuads(self):
+        ds=rdflib.ConjunctiveGraph()
+        ds.get_context(rdflib.URIRef("http://example.org/g")).add(
+            (rdflib.URIRef("http://example.org/s"), rdflib.URIRef("http://example.org/p"), rdflib.Literal(u"h\xe9llo")))
+        client=rdflib_web.endpoint.get(ds).test_client()
+        r=client.get("/graph-store?default", headers={"Accept": "application/n-quads"})
+        self.assertEqual(r.headers["Content-Type"], "application/n-quads")
+        self.assertEqual(r.data, u'<http://example.org/s> <http://example.org/p> "h\xe9llo" <http://example.org/g> .\n'.encode("utf-8"))
+        # wildcards still get rdf/xml
+        r=client.get("/graph-store?default", headers={"Accept": "*/*"})
+        self.assertEqual(r.headers["Content-Type"], "application/rdf+xml")
+
+    def testConjunctiveGraphRoundTrip(self):
+        # the default graph of a ConjunctiveGraph has a blank node as
+        # identifier, it must not become a named graph
+        ds=rdflib.ConjunctiveGraph()
+        ds.add((rdflib.URIRef("http://example.org/s"), rdflib.URIRef("http://example.org/p"), rdflib.Literal("default")))
+        ds.get_context(rdflib.URIRef("http://example.org/g")).add(
+            (rdflib.URIRef("http://example.org/s"), rdflib.URIRef("http://example.org/p"), rdflib.Literal("named")))
+        client=rdflib_web.endpoint.get(ds).test_client()
+        for mimetype in ("application/n-quads", "application/trig"):
+            dump=client.get("/dataset", headers={"Accept": mimetype})
+            self.assertFalse("_:" in dump.data)
+            r=client.put("/dataset", data=dump.data, content_type=mimetype)
+            self.assertEqual(r.status_code, 204)
+            self.assertEqual(len(ds.default_context), 1)
+            self.assertEqual(len(ds.get_context(rdflib.URIRef("http://example.org/g"))), 1)
+            self.assertEqual(len(list(ds.contexts())), 2)
+
+    def testDatasetRoundTrip(self):
+        ds=rdflib.Dataset()
+        ds.add((rdflib.URIRef("http://example.org/s"), rdflib.URIRef("http://example.org/p"), rdflib.Literal("default")))
+        g=ds.graph(rdflib.URIRef("http://example.org/g"))
+        g.add((rdflib.BNode(), rdflib.URIRef("http://example.org/p"), rdflib.Literal(u"h\xe9llo", lang="fr")))
+        client=rdflib_web.endpoint.get(ds).test_client()
+        for mimetype in ("application/n-quads", "application/trig"):
+            dump=client.get("/dataset", headers={"Accept": mimetype})
+            self.assertEqual(dump.headers["Content-Type"], mimetype)
+            r=client.put("/dataset", data=dump.data, content_type=mimetype)
+            self.assertEqual(r.status_code, 204)
+            self.assertEqual(len(ds), 2)
+            self.assertEqual(len(list(ds)), 1) # the default graph
+            self.assertEqual(len(ds.graph(rdflib.URIRef("http://example.org/g"))), 1)
+            # the blank node is relabelled
+            after=client.get("/dataset", headers={"Accept": mimetype}).data
+            self.assertEqual(sorted(re.sub("_:\\w+", "_:b", after).splitlines()),
+                             sorted(re.sub("_:\\w+", "_:b", dump.data).splitlines()))